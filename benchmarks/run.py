@@ -0,0 +1,304 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Запуск как «python -m benchmarks.run» из корня проекта или напрямую файлом
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from benchmarks.synthetic import SyntheticSurvey, generate_survey
+from config.config import config
+from src.data_processing.analyzer import analyze_groups, analyze_questions
+from src.data_processing.calculate_targets import calculate_raw_weights_from_questions
+from src.data_processing.file_processor import create_questions_list, read_file, table_validation
+from src.data_processing.models import AnalysisResult
+from src.data_processing.prepare_target_distributions import prepare_target_distributions
+from src.utils.cleaner import clean_dict_keys, clean_text
+from src.utils.division_df import division_rows, multi_division_rows
+from src.utils.tracing import start_trace, trace_stage
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Формат файла результатов
+RESULTS_VERSION = 1
+
+# Разница во времени, которая меньше этой, не считается регрессией (шум коротких этапов)
+MIN_REGRESSION_SECONDS = 0.005
+
+# Генеральная совокупность для взвешивания (как форма в mini app)
+POPULATION = {
+    "male_count": 400,
+    "female_count": 600,
+    "age_group_labels": ["до 18", "18-25", "26-35", "36-50", "51+"],
+    "age_group_distribution": [10, 30, 25, 20, 15],
+    "art_school_labels": ["Школа А", "Школа Б", "Школа В", "Школа Г"],
+    "art_school_distribution": [40, 30, 20, 10],
+}
+
+
+class StageTimer:
+    """
+    Замеры этапов одного набора данных: каждый этап запускается repeat раз,
+    сохраняются минимум и медиана времени и пик памяти (через trace_stage)
+    """
+    def __init__(self, repeat: int):
+        self.repeat: int = repeat
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    def run(self, stage: str, func: Callable[[], Any], setup: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        Замер этапа
+
+        Args:
+            stage: название этапа в результатах
+            func: этап; если задан setup — вызывается с его результатом
+            setup: подготовка входа, не входит в замер (например, копия таблицы)
+
+        Returns:
+            Результат последнего запуска этапа
+        """
+        result = None
+        with start_trace(emit=False, measure_peak=True) as trace:
+            for _ in range(self.repeat):
+                argument = setup() if setup is not None else None
+                with trace_stage(stage):
+                    result = func(argument) if setup is not None else func()
+
+        walls = [record["wall"] for record in trace.records]
+        self.stages[stage] = {
+            "min": round(min(walls), 4),
+            "median": round(float(np.median(walls)), 4),
+            "cpu": round(float(np.median([record["cpu"] for record in trace.records])), 4),
+            "peak_rss_mb": max(record["peak_rss_mb"] for record in trace.records),
+        }
+        return result
+
+
+def rake(questions_list, survey: SyntheticSurvey) -> pd.DataFrame:
+    """Веса респондентов — так же, как при взвешенной обработке в processor"""
+    target_pol, target_age, target_art, sample_size = prepare_target_distributions(
+        POPULATION["male_count"], POPULATION["female_count"],
+        POPULATION["age_group_distribution"], POPULATION["age_group_labels"],
+        POPULATION["art_school_distribution"], POPULATION["art_school_labels"],
+        0.95, 0.5, 0.05)
+
+    weighting_questions = []
+    for q in questions_list:
+        if int(q.id.split("_")[1]) in survey.weighting_numbers:
+            q = q.copy()
+            q.replace_column(pd.Series(q.column).astype(str).apply(clean_text).to_numpy())
+        weighting_questions.append(q)
+
+    targets = [clean_dict_keys(target_pol), clean_dict_keys(target_age), clean_dict_keys(target_art)]
+    return calculate_raw_weights_from_questions(weighting_questions, survey.weighting_numbers, targets, sample_size - 1)
+
+
+def analyze_division(questions_list, survey: SyntheticSurvey, division: List[int], weights) -> List[AnalysisResult]:
+    """Деление на группы и анализ всех групп вместе с общим итогом, как в processor"""
+    num_persons = len(questions_list[0]) - 2
+    if len(division) == 1:
+        parts = division_rows(questions_list, division[0])
+    else:
+        parts = multi_division_rows(questions_list, division)
+
+    groups = [rows for rows in parts.values()] + [None]
+    nums = [len(rows) for rows in parts.values()] + [num_persons]
+    return analyze_groups(
+        questions_list, groups, nums,
+        survey.mood_number, survey.nps_number, survey.csi_numbers, weights,
+        survey.tr_number, survey.roti_number,
+        dividers=list(parts) + ["Общее"],
+    )
+
+
+def merge_groups(results: List[AnalysisResult]) -> AnalysisResult:
+    """Объединение результатов групп для записи отчета с делением"""
+    merged = AnalysisResult()
+    merged.data_frames = [frame for result in results for frame in result.data_frames]
+    for name in ("free_answers_frame", "nps_frame", "csi_frame", "tr_frame", "roti_frame"):
+        frames = [getattr(result, name) for result in results if getattr(result, name) is not None]
+        if frames:
+            setattr(merged, name, pd.concat(frames, ignore_index=True))
+    return merged
+
+
+def run_case(survey: SyntheticSurvey, repeat: int, output_dir: str) -> Dict[str, Dict[str, float]]:
+    """
+    Замеры всех этапов на одной выгрузке
+
+    Returns:
+        {этап: {"min", "median", "cpu", "peak_rss_mb"}}
+    """
+    timer = StageTimer(repeat)
+
+    # Чтение: разбор Excel, валидация заголовков и создание вопросов
+    raw = timer.run("read_file", lambda: read_file(survey.path))
+    df = timer.run("table_validation", table_validation, setup=raw.copy)
+    questions_list = timer.run("create_questions", lambda: create_questions_list(df))
+
+    num_persons = len(questions_list[0]) - 2
+    ones = pd.DataFrame({"ones": [1] * len(questions_list[0])})
+
+    result = timer.run("analyze", lambda: analyze_questions(
+        questions_list, survey.mood_number, survey.nps_number, survey.csi_numbers,
+        num_persons, ones, survey.tr_number, survey.roti_number))
+    weights = timer.run("raking", lambda: rake(questions_list, survey))
+    timer.run("analyze_weighted", lambda: analyze_questions(
+        questions_list, survey.mood_number, survey.nps_number, survey.csi_numbers,
+        num_persons, weights, survey.tr_number, survey.roti_number))
+
+    division = timer.run("division", lambda: analyze_division(questions_list, survey, survey.division, ones))
+    timer.run("division_multi", lambda: analyze_division(questions_list, survey, survey.multi_division, ones))
+    divided = merge_groups(division)
+
+    excel_path = os.path.join(output_dir, "report.xlsx")
+    timer.run("write_excel", lambda: result.to_excel(excel_path))
+    timer.run("write_excel_division", lambda: divided.to_excel_division(excel_path))
+    timer.run("write_csv", lambda: result.to_csv(os.path.join(output_dir, "report.csv")))
+
+    return timer.stages
+
+
+def git_revision() -> str:
+    """Короткий хеш текущего коммита (с пометкой о незакоммиченных изменениях)"""
+    root = os.path.dirname(RESULTS_DIR)
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{revision}-dirty" if dirty else revision
+
+
+def case_key(case: Dict[str, Any]) -> Tuple:
+    return case["rows"], case["questions"], case["matrix_width"], case["options"]
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Сравнение с прошлым запуском по минимальному времени этапа (оно меньше
+    всего зависит от фоновой нагрузки)
+
+    Args:
+        current: результаты текущего запуска
+        baseline: результаты прошлого запуска (другой версии)
+        threshold: во сколько раз этап должен замедлиться, чтобы считаться регрессией
+
+    Returns:
+        Строки с регрессиями (этапы, которые стали медленнее threshold)
+    """
+    previous = {case_key(case): case for case in baseline.get("cases", [])}
+    regressions = []
+    for case in current["cases"]:
+        old = previous.get(case_key(case))
+        if old is None:
+            continue
+        print(f"\nrows={case['rows']} questions={case['questions']} matrix_width={case['matrix_width']}: "
+              f"{baseline.get('revision')} -> {current['revision']}")
+        for stage, timing in case["stages"].items():
+            old_timing = old["stages"].get(stage)
+            if old_timing is None or old_timing["min"] <= 0:
+                continue
+            ratio = timing["min"] / old_timing["min"]
+            regressed = ratio > threshold and timing["min"] - old_timing["min"] > MIN_REGRESSION_SECONDS
+            mark = " <-- регрессия" if regressed else ""
+            print(f"  {stage:<22} {old_timing['min']:>9.4f} -> {timing['min']:>9.4f}  x{ratio:.2f}{mark}")
+            if regressed:
+                regressions.append(f"{case_key(case)} {stage}: x{ratio:.2f}")
+    return regressions
+
+
+def parse_sizes(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Замеры этапов обработки на синтетических выгрузках Анкетолога")
+    parser.add_argument("--rows", type=parse_sizes, default=[1000, 5000], help="число ответов (через запятую)")
+    parser.add_argument("--questions", type=parse_sizes, default=[32], help="число вопросов всех типов")
+    parser.add_argument("--matrix-width", type=parse_sizes, default=[5], help="число строк в матрицах")
+    parser.add_argument("--options", type=int, default=5, help="число вариантов в вопросах с выбором")
+    parser.add_argument("--repeat", type=int, default=3, help="число запусков каждого этапа")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="файл результатов (по умолчанию benchmarks/results/<коммит>.json)")
+    parser.add_argument("--compare", help="файл результатов прошлой версии для сравнения")
+    parser.add_argument("--threshold", type=float, default=1.2, help="замедление, которое считается регрессией")
+    args = parser.parse_args(argv)
+
+    revision = git_revision()
+    report = {
+        "version": RESULTS_VERSION,
+        "revision": revision,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "openpyxl": openpyxl.__version__,
+        },
+        "settings": {
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "bootstrap_replicates": config.bootstrap_replicates,
+            "trash_list": len(config.trash_list),
+        },
+        "cases": [],
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for rows, questions, matrix_width in itertools.product(args.rows, args.questions, args.matrix_width):
+            path = os.path.join(work_dir, f"survey_{rows}_{questions}_{matrix_width}.xlsx")
+            survey = generate_survey(path, rows, questions, matrix_width, args.options, args.seed)
+            print(f"rows={rows} questions={questions} matrix_width={matrix_width}: "
+                  f"{survey.questions} вопросов, {survey.columns} столбцов")
+
+            stages = run_case(survey, args.repeat, work_dir)
+            for stage, timing in stages.items():
+                print(f"  {stage:<22} min {timing['min']:>9.4f} s  median {timing['median']:>9.4f} s  "
+                      f"peak {timing['peak_rss_mb']:>7.1f} MB")
+
+            report["cases"].append({
+                "rows": rows,
+                "questions": questions,
+                "matrix_width": matrix_width,
+                "options": args.options,
+                "columns": survey.columns,
+                "file_mb": round(os.path.getsize(path) / (1024 * 1024), 2),
+                "stages": stages,
+            })
+            os.remove(path)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты: {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print("\nРегрессии:\n" + "\n".join(regressions))
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
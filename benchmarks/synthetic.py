@@ -0,0 +1,224 @@
+import random
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from openpyxl import Workbook
+
+from src.data_processing.question_types import QuestionType
+
+
+# Служебные столбцы выгрузки Анкетолога до первой «Страница N»
+PREFIX_COLUMNS = ("ID", "Дата заполнения", "IP", "Длительность")
+
+# Значения признаков взвешивания и вопроса-разделителя
+GENDERS = ("Мужской", "Женский", "муж.", "Девушка")
+AGE_GROUPS = ("до 18", "18-25", "26-35", "36-50", "51+")
+SCHOOLS = ("Школа А", "Школа Б", "Школа В", "Школа Г")
+
+# Типы вопросов, которые повторяются по кругу после обязательного блока
+FILLER_TYPES = (
+    QuestionType.SCALE,
+    QuestionType.SINGLE,
+    QuestionType.MULTIPLE,
+    QuestionType.DROPDOWN,
+    QuestionType.MULTIPLE_DROPDOWN,
+    QuestionType.AREA,
+    QuestionType.MATRIX,
+    QuestionType.MATRIX_3D,
+    QuestionType.FREE_ANSWER,
+    QuestionType.FREE_ANSWER_MATRIX,
+    QuestionType.FREE_ANSWER_GROUP,
+    QuestionType.NAME,
+    QuestionType.DATE,
+    QuestionType.EMAIL,
+    QuestionType.PHONE,
+    QuestionType.FILE_UPLOAD,
+)
+
+FREE_ANSWERS = (
+    "отличное мероприятие. всё понравилось.",
+    "было скучно, но полезно",
+    "хотелось бы больше практики",
+    "ок",
+)
+
+
+class SyntheticColumn:
+    """
+    Столбец синтетической выгрузки: подпись вопроса (только у первого столбца
+    вопроса), две строки заголовка и генератор значений
+    """
+    def __init__(self, label: Optional[str], first: Any, second: Any, value: Callable[[], Any]):
+        self.label: Optional[str] = label
+        self.first: Any = first
+        self.second: Any = second
+        self.value: Callable[[], Any] = value
+
+
+class SyntheticSurvey:
+    """
+    Описание сгенерированной выгрузки: размеры и номера вопросов для
+    настроения, NPS, CSI, TR, ROTI, взвешивания и деления
+    """
+    def __init__(self, path: str, rows: int, questions: int, columns: int):
+        self.path: str = path
+        self.rows: int = rows
+        self.questions: int = questions
+        self.columns: int = columns
+        self.mood_number: int = 4
+        self.nps_number: List[int] = [5]
+        self.tr_number: int = 6
+        self.roti_number: int = 7
+        self.csi_numbers: List[int] = [8, 9]
+        self.weighting_numbers: List[int] = [1, 2, 3]
+        self.division: List[int] = [2]
+        self.multi_division: List[int] = [2, 3]
+
+    def as_dict(self) -> Dict[str, int]:
+        return {"rows": self.rows, "questions": self.questions, "columns": self.columns}
+
+
+class SurveyBuilder:
+    """
+    Сборка столбцов выгрузки вопрос за вопросом
+    """
+    def __init__(self, rows: int, seed: int, missing: float):
+        self.rows: int = rows
+        self.random: random.Random = random.Random(seed)
+        self.missing: float = missing
+        self.columns: List[SyntheticColumn] = []
+        self.questions: int = 0
+
+    def maybe(self, value: Callable[[int], Any]) -> Callable[[int], Any]:
+        """Значение с пропусками (доля missing)"""
+        return lambda index: None if self.random.random() < self.missing else value(index)
+
+    def add(self, name: str, question_type: QuestionType,
+            subheaders: Sequence[Tuple[Any, Any]], value: Callable[[int], Any]) -> None:
+        """
+        Вопрос из нескольких столбцов
+
+        Args:
+            name: название вопроса
+            question_type: тип вопроса (подпись в скобках)
+            subheaders: две строки заголовка для каждого столбца вопроса
+            value: генератор значения по номеру столбца внутри вопроса
+        """
+        self.questions += 1
+        for index, (first, second) in enumerate(subheaders):
+            label = f"{name} ({question_type.value})" if index == 0 else None
+            self.columns.append(SyntheticColumn(label, first, second, lambda index=index: value(index)))
+
+    def single(self, name: str, question_type: QuestionType, options: Sequence[Any]) -> None:
+        self.add(name, question_type, [(None, None)], self.maybe(lambda index: self.random.choice(options)))
+
+    def scale(self, name: str, low: int, high: int) -> None:
+        self.add(name, QuestionType.SCALE, [(None, None)], self.maybe(lambda index: self.random.randint(low, high)))
+
+    def multiple(self, name: str, question_type: QuestionType, options: Sequence[str]) -> None:
+        self.add(name, question_type, [(option, None) for option in options],
+                 lambda index: options[index] if self.random.random() < 0.4 else None)
+
+    def matrix(self, name: str, question_type: QuestionType, width: int, low: int, high: int) -> None:
+        subheaders = [(f"Параметр {index + 1}", "Оценка") for index in range(width)]
+        self.add(name, question_type, subheaders, self.maybe(lambda index: self.random.randint(low, high)))
+
+    def text(self, name: str, question_type: QuestionType, subheaders: Sequence[Tuple[Any, Any]]) -> None:
+        self.add(name, question_type, subheaders, self.maybe(lambda index: self.random.choice(FREE_ANSWERS)))
+
+    def filler(self, number: int, question_type: QuestionType, matrix_width: int, options: int) -> None:
+        """Вопрос из повторяющегося блока всех типов"""
+        name = f"Вопрос {number}"
+        labels = [f"Вариант {index + 1}" for index in range(options)]
+        if question_type == QuestionType.SCALE:
+            self.scale(name, 1, 10)
+        elif question_type == QuestionType.SINGLE:
+            self.single(name, question_type, labels)
+        elif question_type == QuestionType.DROPDOWN:
+            self.single(name, question_type, labels + ["Затрудняюсь ответить"])
+        elif question_type in (QuestionType.MULTIPLE, QuestionType.MULTIPLE_DROPDOWN, QuestionType.AREA):
+            self.multiple(name, question_type, labels)
+        elif question_type in (QuestionType.MATRIX, QuestionType.MATRIX_3D):
+            self.matrix(name, question_type, matrix_width, 1, 5)
+        elif question_type == QuestionType.FREE_ANSWER:
+            self.text(name, question_type, [(None, None)])
+        elif question_type in (QuestionType.FREE_ANSWER_MATRIX, QuestionType.FREE_ANSWER_GROUP):
+            self.text(name, question_type, [(f"Поле {index + 1}", "Текст") for index in range(2)])
+        elif question_type == QuestionType.NAME:
+            self.single(name, question_type, ["Иван", "Анна", "Мария"])
+        elif question_type == QuestionType.DATE:
+            self.single(name, question_type, ["01.01.2000", "15.06.1995"])
+        elif question_type == QuestionType.EMAIL:
+            self.single(name, question_type, ["user@example.com"])
+        elif question_type == QuestionType.PHONE:
+            self.single(name, question_type, ["+7 900 000-00-00"])
+        else:
+            self.single(name, question_type, ["https://example.com/file.pdf"])
+
+
+def generate_survey(
+        path: str,
+        rows: int = 1000,
+        questions: int = 32,
+        matrix_width: int = 5,
+        options: int = 5,
+        seed: int = 1,
+        missing: float = 0.1
+) -> SyntheticSurvey:
+    """
+    Генерация синтетической выгрузки Анкетолога в том виде, который ждут
+    read_file и table_validation: служебные столбцы до «Страница 1»,
+    строка с подписями вопросов «Название (Тип)», две строки заголовка
+    (строка матрицы, шкала) и строки ответов.
+
+    Первые 9 вопросов — признаки взвешивания (пол, возраст, школа),
+    настроение, NPS, TR, ROTI и пара матриц CSI; за ними questions вопросов
+    всех типов по кругу (FILLER_TYPES).
+
+    Args:
+        path: куда сохранить .xlsx
+        rows: число ответов
+        questions: число вопросов после обязательного блока
+        matrix_width: число строк в матрицах (в том числе CSI)
+        options: число вариантов в вопросах с выбором
+        seed: зерно генератора (одинаковые параметры — одинаковый файл)
+        missing: доля пропусков в ответах
+
+    Returns:
+        Описание выгрузки с номерами вопросов для анализа
+    """
+    builder = SurveyBuilder(rows, seed, missing)
+
+    builder.single("Ваш пол", QuestionType.SINGLE, GENDERS)
+    builder.single("Возраст", QuestionType.SINGLE, AGE_GROUPS)
+    builder.single("Школа", QuestionType.DROPDOWN, SCHOOLS)
+    builder.scale("Настроение", 1, 5)
+    builder.scale("Порекомендуете ли вы нас?", 0, 10)
+    builder.single("Достигли ли вы цели?", QuestionType.SINGLE, ["Да", "Нет", "Не знаю"])
+    builder.scale("ROTI", 1, 5)
+    builder.matrix("Важность параметров", QuestionType.MATRIX, matrix_width, 1, 5)
+    builder.matrix("Удовлетворенность параметрами", QuestionType.MATRIX, matrix_width, 1, 10)
+
+    for index in range(questions):
+        builder.filler(builder.questions + 1, FILLER_TYPES[index % len(FILLER_TYPES)], matrix_width, options)
+
+    _save_workbook(path, builder)
+    return SyntheticSurvey(path, rows, builder.questions, len(builder.columns))
+
+
+def _save_workbook(path: str, builder: SurveyBuilder) -> None:
+    """Потоковая запись листа (write_only), построчно"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+
+    columns = builder.columns
+    prefix = [None] * len(PREFIX_COLUMNS)
+    sheet.append(list(PREFIX_COLUMNS) + ["Страница 1"] + [None] * (len(columns) - 1))
+    sheet.append(prefix + [column.label for column in columns])
+    sheet.append(prefix + [column.first for column in columns])
+    sheet.append(prefix + [column.second for column in columns])
+
+    for row in range(builder.rows):
+        service = [row + 1, "2024-01-01 12:00:00", "127.0.0.1", 300]
+        sheet.append(service + [column.value() for column in columns])
+
+    workbook.save(path)
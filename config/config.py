@@ -2,7 +2,9 @@ import os
 import json
 import sqlite3
 from pathlib import Path
-from typing import List, Any, Optional
+from typing import List, Any, Optional, Tuple
+
+from src.utils.db import MonitoringDatabase
 
 
 class Config:
@@ -23,6 +25,9 @@ class Config:
             )
         )
         self.mini_app_url: str = os.getenv("MINI_APP_URL", "")
+        # Общая база: подключение на поток, кэш часто читаемых данных на MONITORING_CACHE_TTL секунд
+        self.monitoring_cache_ttl: float = max(0.0, self._get_float_env("MONITORING_CACHE_TTL", 5.0))
+        self.monitoring_db: MonitoringDatabase = MonitoringDatabase(self.monitoring_db_path, self.monitoring_cache_ttl)
         
         # Пути к JSON файлам
         self.allowed_users_file: str = str(self.project_root / "config" / "allowed_users.json")
@@ -32,7 +37,46 @@ class Config:
         # Создаем директорию для временных файлов если не существует
         self.download_dir: str = str(self.project_root / "downloads")
         os.makedirs(self.download_dir, exist_ok=True)
-        
+
+        # Пул обработки: число процессов, лимит задач на пользователя и глубина очереди
+        self.processing_workers: int = max(1, self._get_int_env("PROCESSING_WORKERS", 2))
+        self.processing_max_per_user: int = max(1, self._get_int_env("PROCESSING_MAX_PER_USER", 1))
+        self.processing_queue_size: int = max(1, self._get_int_env("PROCESSING_QUEUE_SIZE", 20))
+
+        # Лог этапов обработки (JSON Lines) и сколько последних записей учитывает /stage_stats
+        self.trace_log_path: str = os.path.abspath(
+            os.getenv("TRACE_LOG_PATH", str(self.project_root / "logs" / "trace.jsonl"))
+        )
+        self.trace_stats_records: int = max(1, self._get_int_env("TRACE_STATS_RECORDS", 5000))
+
+        # Очередь задач в базе мониторинга: срок аренды задачи процессом бота и число попыток
+        self.job_lease_seconds: int = max(15, self._get_int_env("JOB_LEASE_SECONDS", 60))
+        self.job_max_attempts: int = max(1, self._get_int_env("JOB_MAX_ATTEMPTS", 3))
+
+        # Кэш разобранных выгрузок (0 — отключен)
+        self.parsed_cache_dir: str = os.path.join(self.download_dir, "parsed_cache")
+        self.parsed_cache_max_bytes: int = max(0, self._get_int_env("PARSED_CACHE_MAX_MB", 256)) * 1024 * 1024
+
+        # Кэш посчитанных распределений по вопросам (0 вопросов — отключен, 0 МБ — только в памяти)
+        self.question_cache_dir: str = os.path.join(self.download_dir, "question_cache")
+        self.question_cache_max_entries: int = max(0, self._get_int_env("QUESTION_CACHE_MAX_ENTRIES", 10000))
+        self.question_cache_max_bytes: int = max(0, self._get_int_env("QUESTION_CACHE_MAX_MB", 64)) * 1024 * 1024
+
+        # Доверительные интервалы NPS и CSI (бутстреп; 0 повторов — интервалы не считаются)
+        self.bootstrap_replicates: int = max(0, self._get_int_env("BOOTSTRAP_REPLICATES", 2000))
+        self.bootstrap_workers: int = max(1, self._get_int_env("BOOTSTRAP_WORKERS", 1))
+        self.confidence_level: float = min(max(self._get_float_env("CONFIDENCE_LEVEL", 0.95), 0.5), 0.999)
+
+        # Границы весов при взвешивании в долях от среднего веса, например "0.3,3" (не задано — без обрезки)
+        self.raking_bounds: Optional[Tuple[float, float]] = self._get_bounds_env("RAKING_BOUNDS")
+
+        # API Anketolog: одновременные запросы, запросов в секунду и лимит анкет в пакетной выгрузке /batch
+        self.anketolog_max_concurrency: int = max(1, self._get_int_env("ANKETOLOG_MAX_CONCURRENCY", 4))
+        self.anketolog_rate_per_second: float = max(0.0, self._get_float_env("ANKETOLOG_RATE_PER_SECOND", 5.0))
+        self.batch_max_surveys: int = max(1, self._get_int_env("BATCH_MAX_SURVEYS", 30))
+        # Сколько секунд список анкет Anketolog берется из памяти (потом обновляется в фоне)
+        self.survey_directory_ttl: float = max(10.0, self._get_float_env("SURVEY_DIRECTORY_TTL", 300.0))
+
         # Загружаем списки пользователей и мусорных слов
         self.allowed_users: List[int] = self._load_json(self.allowed_users_file, [])
         self.admin_users: List[int] = self._load_json(self.admin_users_file, [])
@@ -60,6 +104,30 @@ class Config:
             # Если .env недоступен, продолжаем без него
             return
     
+    def _get_int_env(self, name: str, default: int) -> int:
+        """Чтение целого числа из переменной окружения"""
+        try:
+            return int(os.getenv(name, default))
+        except (TypeError, ValueError):
+            return default
+
+    def _get_float_env(self, name: str, default: float) -> float:
+        """Чтение дробного числа из переменной окружения"""
+        try:
+            return float(os.getenv(name, default))
+        except (TypeError, ValueError):
+            return default
+
+    def _get_bounds_env(self, name: str) -> Optional[Tuple[float, float]]:
+        """Чтение пары границ «нижняя,верхняя» (нижняя <= 1 <= верхняя) из переменной окружения"""
+        try:
+            lower, upper = (float(part) for part in os.getenv(name, "").split(","))
+        except ValueError:
+            return None
+        if not 0 <= lower <= 1 <= upper:
+            return None
+        return lower, upper
+
     def _load_token(self) -> str:
         """Загрузка токена из файла"""
         try:
@@ -90,15 +158,21 @@ class Config:
         self._save_allowed_users_to_db()
 
     def refresh_allowed_users(self) -> None:
-        """Обновление списка разрешенных пользователей из общей SQLite базы."""
+        """
+        Обновление списка разрешенных пользователей из общей SQLite базы.
+
+        Список берется из кэша monitoring_db (база перечитывается, только если
+        ее изменили), файл перезаписывается только при изменении списка.
+        """
         users = self._load_allowed_users_from_db()
         if users is None:
             return
 
         if users or not self.allowed_users:
-            self.allowed_users = users
-            with open(self.allowed_users_file, 'w', encoding='utf-8') as file:
-                json.dump(self.allowed_users, file, ensure_ascii=False, indent=4)
+            if users != self.allowed_users:
+                self.allowed_users = list(users)
+                with open(self.allowed_users_file, 'w', encoding='utf-8') as file:
+                    json.dump(self.allowed_users, file, ensure_ascii=False, indent=4)
         else:
             self._save_allowed_users_to_db()
     
@@ -112,53 +186,33 @@ class Config:
         with open(self.trash_list_file, 'w', encoding='utf-8') as file:
             json.dump(self.trash_list, file, ensure_ascii=False, indent=4)
 
-    def _connect_monitoring_db(self) -> sqlite3.Connection:
-        os.makedirs(os.path.dirname(self.monitoring_db_path), exist_ok=True)
-        conn = sqlite3.connect(self.monitoring_db_path, timeout=30)
-        conn.execute("PRAGMA journal_mode=WAL")
-        conn.execute("PRAGMA busy_timeout=5000")
-        return conn
-
-    def _ensure_allowed_users_table(self, conn: sqlite3.Connection) -> None:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS allowed_users (
-                id INTEGER PRIMARY KEY,
-                first_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """
-        )
-
     def _load_allowed_users_from_db(self) -> Optional[List[int]]:
+        def load() -> List[int]:
+            rows = self.monitoring_db.fetchall("SELECT id FROM allowed_users ORDER BY id")
+            return [int(row[0]) for row in rows]
+
         try:
-            conn = self._connect_monitoring_db()
-            self._ensure_allowed_users_table(conn)
-            rows = conn.execute("SELECT id FROM allowed_users ORDER BY id").fetchall()
-            conn.close()
+            return self.monitoring_db.cached("allowed_users", load)
         except sqlite3.Error:
             return None
 
-        return [int(row[0]) for row in rows]
-
     def _save_allowed_users_to_db(self) -> None:
         try:
-            conn = self._connect_monitoring_db()
-            self._ensure_allowed_users_table(conn)
-            with conn:
+            with self.monitoring_db.transaction() as conn:
                 conn.execute("DELETE FROM allowed_users")
                 conn.executemany(
                     "INSERT OR IGNORE INTO allowed_users (id) VALUES (?)",
                     [(int(user_id),) for user_id in self.allowed_users],
                 )
-            conn.close()
         except sqlite3.Error:
             return
+        finally:
+            self.monitoring_db.invalidate("allowed_users")
 
     def _sync_allowed_users_from_db_or_seed(self) -> None:
         users_from_db = self._load_allowed_users_from_db()
         if users_from_db:
-            self.allowed_users = users_from_db
+            self.allowed_users = list(users_from_db)
             with open(self.allowed_users_file, 'w', encoding='utf-8') as file:
                 json.dump(self.allowed_users, file, ensure_ascii=False, indent=4)
             return
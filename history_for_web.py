@@ -0,0 +1,58 @@
+import argparse
+import json
+from datetime import datetime
+from typing import Optional
+
+from src.data_processing.history import METRICS, PERIODS, report_history
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """Граница периода: Unix-время или дата «ГГГГ-ММ-ДД[ЧЧ:ММ:СС]» (локальное время)"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def history_for_web(argv=None):
+    parser = argparse.ArgumentParser(description="История отчетов для mini app (ответ — JSON)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("surveys", help="анкеты, по которым есть отчеты")
+
+    reports = commands.add_parser("reports", help="отчеты с показателями")
+    reports.add_argument("--survey")
+    reports.add_argument("--since")
+    reports.add_argument("--until")
+    reports.add_argument("--limit", type=int, default=100)
+
+    trend = commands.add_parser("trend", help="показатель по времени")
+    trend.add_argument("metric", choices=METRICS)
+    trend.add_argument("--survey")
+    trend.add_argument("--since")
+    trend.add_argument("--until")
+    trend.add_argument("--divider")
+    trend.add_argument("--period", choices=list(PERIODS))
+    trend.add_argument("--limit", type=int, default=1000)
+
+    calculations = commands.add_parser("calculations", help="сохраненные целевые распределения")
+    calculations.add_argument("--since")
+    calculations.add_argument("--until")
+    calculations.add_argument("--limit", type=int, default=100)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "surveys":
+        return report_history.surveys()
+    if args.command == "reports":
+        return report_history.reports(args.survey, parse_time(args.since), parse_time(args.until), args.limit)
+    if args.command == "trend":
+        return report_history.trend(args.metric, args.survey, parse_time(args.since), parse_time(args.until),
+                                    args.divider, args.period, args.limit)
+    return report_history.calculations(args.since, args.until, args.limit)
+
+
+if __name__ == "__main__":
+    print(json.dumps(history_for_web(), ensure_ascii=False))
@@ -2,7 +2,13 @@ import asyncio
 import logging
 from aiogram import Dispatcher
 from src.bot.bot_instance import bot
-from src.bot.handlers import router
+from src.bot.handlers import router, watch_interrupted_jobs
+from src.data_processing.executor import processing_executor
+from src.data_processing.job_queue import cleanup_stale_files, job_store
+from src.utils.anketolog import anketolog_client
+from src.utils.survey_directory import survey_directory
+from src.utils.tracing import configure_trace_log
+from config.config import config
 
 
 # Настройка логирования
@@ -29,9 +35,27 @@ async def main():
     # Подключение роутера с обработчиками
     dp.include_router(router)
     
+    # Время этапов обработки пишется в JSON-лог (статистика — команда /stage_stats)
+    configure_trace_log(config.trace_log_path)
+
+    # Удаляем файлы прерванных обработок, кроме исходников задач, которые будут запущены заново
+    cleanup_stale_files(keep=job_store.active_paths())
+
     # Удаление вебхука и запуск бота
     await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    # Прерванные перезапуском задачи запускаются заново
+    jobs_watcher = asyncio.create_task(watch_interrupted_jobs())
+    # Список анкет Anketolog держится в памяти и обновляется в фоне
+    directory_refresher = asyncio.create_task(survey_directory.run_refresher())
+    try:
+        await dp.start_polling(bot)
+    finally:
+        jobs_watcher.cancel()
+        directory_refresher.cancel()
+        # Останавливаем пул процессов обработки
+        processing_executor.shutdown()
+        # Закрываем соединения с Anketolog
+        await anketolog_client.close()
 
 
 if __name__ == "__main__":
@@ -14,27 +14,22 @@ from .keyboards import (
     get_back_keyboard,
     get_yandex_replace_keyboard,
     get_main_keyboard,
+    get_survey_suggestions_keyboard,
 )
 from .bot_instance import bot
 from src.data_processing.processor import process_data
 from src.data_processing.models import AnalysisError
+from src.data_processing.job_queue import JobRecord, job_dir, job_store, remove_job_dir, remove_job_files
+from src.data_processing.batch import BatchError, parse_batch_request, run_batch
+from src.utils.tracing import stage_percentiles, trace_stage, traced, with_trace
 from src.utils.yandex_disk import (
     YandexDiskError,
     build_timestamped_name,
     check_file_exists_on_yandex,
     upload_single_file_to_yandex,
 )
-from src.utils.anketolog import (
-    download_report_by_survey_name,
-    locate_survey_by_name,
-    create_report,
-    wait_until_report_ready,
-    download_file,
-    get_extension,
-    sanitize_filename,
-    REPORT_FORMAT,
-    AnketologError,
-)
+from src.utils.anketolog import anketolog_client, AnketologError
+from src.utils.survey_directory import SurveyLookupError, survey_directory
 from config.config import config
 from aiogram.types import CallbackQuery
 
@@ -53,6 +48,7 @@ def get_true_keys_iterator(state: dict[str, bool]):
             yield False
 
 
+@traced("telegram_upload")
 async def send_results_to_user(chat_id: int, file_paths: list[str]) -> None:
     """
     Отправляет файлы пользователю в Telegram.
@@ -66,6 +62,51 @@ async def send_results_to_user(chat_id: int, file_paths: list[str]) -> None:
         )
 
 
+@with_trace
+async def resume_processing_job(job: JobRecord) -> None:
+    """
+    Повторный запуск задачи, прерванной перезапуском бота.
+    Результат отправляется в чат, из которого задача была поставлена.
+    """
+    if job.chat_id is not None:
+        try:
+            await bot.send_message(
+                chat_id=job.chat_id,
+                text="Обработка файла была прервана перезапуском бота. Запускаю ее заново...",
+            )
+        except Exception:
+            pass
+
+    try:
+        excel_path, csv_path = await process_data(job.input_path, user_id=job.user_id, job_id=job.id, **job.params)
+    except AnalysisError as error:
+        if job.chat_id is not None:
+            await bot.send_message(chat_id=job.chat_id, text=f"{error}")
+        return
+    except Exception:
+        if job.chat_id is not None:
+            await bot.send_message(chat_id=job.chat_id, text="Произошла какая-то ошибка 😿\nНо ведь у меня лапки🐾")
+        return
+
+    file_paths = [excel_path, csv_path]
+    try:
+        if job.chat_id is not None:
+            await send_results_to_user(job.chat_id, file_paths)
+    finally:
+        remove_job_files(file_paths + [job.input_path])
+
+
+async def watch_interrupted_jobs() -> None:
+    """
+    Фоновая проверка очереди задач: задачи с истекшей арендой (бот был
+    перезапущен посреди обработки) запускаются заново
+    """
+    while True:
+        for job in await asyncio.to_thread(job_store.reclaim):
+            asyncio.create_task(resume_processing_job(job))
+        await asyncio.sleep(job_store.lease_seconds)
+
+
 async def start_uploaded_file_processing(
     state: FSMContext,
     message: Message,
@@ -99,6 +140,55 @@ async def start_uploaded_file_processing(
     await state.update_data(last_bot_message_id=msg.message_id, question_message_ids=ids)
 
 
+async def offer_survey_suggestions(message: Message, state: FSMContext, error: SurveyLookupError) -> None:
+    """
+    Анкета по названию не найдена однозначно: предлагаем выбрать из похожих
+    """
+    await state.set_state(MainState.survey_report_pick)
+    await message.answer(
+        f"{error}\n\nВыберите анкету из списка или нажмите «Назад», чтобы отправить название еще раз.",
+        reply_markup=get_survey_suggestions_keyboard(error.suggestions),
+    )
+
+
+async def fetch_anketolog_report(message: Message, state: FSMContext, survey: dict) -> None:
+    """
+    Формирование и скачивание отчета по найденной анкете, затем — обычный сценарий обработки файла
+    """
+    survey_real_name = (survey.get("settings") or {}).get("name") or str(survey.get("id"))
+    report_msg = await message.answer("Нужная анкета найдена. Начинаю формирование отчета в Anketolog...")
+    directory = job_dir()
+    handed_off_to_processing = False
+    try:
+        file_path = await anketolog_client.download_report(survey, directory)
+        await bot.send_document(
+            chat_id=message.chat.id,
+            document=FSInputFile(file_path),
+            caption=f"Отчет по анкете: {survey_real_name}",
+        )
+        await start_uploaded_file_processing(
+            state=state,
+            message=message,
+            file_path=file_path,
+            original_file_name=os.path.basename(file_path),
+            document=None,
+        )
+        handed_off_to_processing = True
+    except AnketologError as error:
+        await message.answer(f"Не удалось получить отчет: {error}")
+    except OSError as error:
+        await message.answer(f"Не удалось сохранить или отправить отчет: {error}")
+    finally:
+        try:
+            await report_msg.delete()
+        except Exception:
+            pass
+        if not handed_off_to_processing:
+            remove_job_dir(directory)
+            await state.clear()
+
+
+@traced("yandex_upload")
 async def upload_results_to_yandex_and_send_links(
     chat_id: int, file_paths: list[str], original_file_name: str | None = None
 ) -> None:
@@ -150,13 +240,25 @@ async def ask_yandex_upload_choice(state: FSMContext, message: Message) -> None:
     await state.update_data(last_bot_message_id=msg.message_id, question_message_ids=ids)
 
 
+@with_trace
 async def process_and_send_results(
     state: FSMContext, message: Message, chat_id: int, upload_to_yandex: bool
 ) -> None:
     proc_msg = await message.answer("Происходит обработка данных...", reply_markup=ReplyKeyboardRemove())
 
+    async def report_progress(position: int, elapsed: float) -> None:
+        # Показываем место в очереди, пока задача ждет свободный процесс, затем прошедшее время
+        if position > 0:
+            text = f"Файл в очереди на обработку, позиция: {position}\nПрошло: {int(elapsed)} с"
+        else:
+            text = f"Происходит обработка данных...\nПрошло: {int(elapsed)} с"
+        try:
+            await proc_msg.edit_text(text)
+        except Exception:
+            pass
+
     try:
-        excel_path, csv_path = await start_process_data(state, message)
+        excel_path, csv_path = await start_process_data(state, message, user_id=chat_id, on_progress=report_progress)
     except AnalysisError:
         try:
             await proc_msg.delete()
@@ -223,18 +325,23 @@ async def process_and_send_results(
         pass
 
     # Удаляем временные файлы
-    for file_path in file_paths:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    remove_job_files(file_paths)
     await state.clear()
 
-async def start_process_data(state: FSMContext, message: Message) -> tuple[str, str]:
+async def start_process_data(
+    state: FSMContext,
+    message: Message,
+    user_id: int | None = None,
+    on_progress=None,
+) -> tuple[str, str]:
     """
     Запуск процесса обработки данных
     
     Args:
         state: FSM контекст
         message: Сообщение пользователя
+        user_id: Идентификатор пользователя для лимита параллельных задач
+        on_progress: Корутина для отображения позиции в очереди и прошедшего времени
         
     Returns:
         Кортеж с путями к сгенерированным файлам
@@ -259,17 +366,19 @@ async def start_process_data(state: FSMContext, message: Message) -> tuple[str,
 
     # Если файл пришел из Telegram, сначала скачиваем его локально.
     if doc is not None:
-        await bot.download(file=doc, destination=path)
+        with trace_stage("download") as span:
+            await bot.download(file=doc, destination=path)
+            span.set(bytes=os.path.getsize(path))
 
     # Обрабатываем данные
     excel_path, csv_path = await process_data(path, mood, nps, csi,
                                               message,
                                               analyze_type,
-                                              question_numbers_weights, division, tr, roti)
+                                              question_numbers_weights, division, tr, roti,
+                                              user_id=user_id, on_progress=on_progress)
 
     # Удаляем исходный файл
-    if os.path.exists(path):
-        os.remove(path)
+    remove_job_files([path])
 
     return excel_path, csv_path
 
@@ -368,6 +477,89 @@ async def receive_survey_report_name(message: Message, state: FSMContext):
     )
 
 
+@router.message(Command("batch"))
+async def batch_command(message: Message, state: FSMContext):
+    """Запуск пакетной выгрузки: отчеты нескольких анкет одним архивом"""
+    await state.clear()
+
+    # Проверка прав пользователя
+    config.refresh_allowed_users()
+    if message.from_user.id not in config.allowed_users:
+        await message.answer("У вас нет доступа к этой функции.")
+        return
+
+    await state.set_state(MainState.batch_surveys)
+    await message.answer(
+        "Отправьте названия анкет из Anketolog, каждое с новой строки.\n"
+        "Чтобы выгрузить все анкеты папки, отправьте «Папка: название папки».\n"
+        "Отчеты будут обработаны стандартно и придут одним архивом.",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+
+
+@router.message(MainState.batch_surveys)
+async def receive_batch_surveys(message: Message, state: FSMContext):
+    survey_names, folder_name = parse_batch_request(message.text or "")
+    if not survey_names and folder_name is None:
+        await message.answer("Список анкет пуст. Отправьте названия анкет, каждое с новой строки.")
+        return
+    await state.clear()
+
+    total_text = f"папка «{folder_name}»" if folder_name is not None else f"анкет: {len(survey_names)}"
+    status_msg = await message.answer(f"Начинаю пакетную выгрузку ({total_text})...")
+
+    async def report_progress(done: int, total: int) -> None:
+        await status_msg.edit_text(f"Пакетная выгрузка: готово {done} из {total}")
+
+    try:
+        result = await run_batch(survey_names, folder_name, user_id=message.from_user.id,
+                                 on_progress=report_progress)
+    except BatchError as error:
+        await message.answer(f"{error}", reply_markup=get_main_keyboard())
+        return
+    except Exception:
+        await message.answer("Произошла какая-то ошибка 😿\nНо ведь у меня лапки🐾", reply_markup=get_main_keyboard())
+        return
+
+    # Полный список ошибок — в архиве, в сообщение попадает начало (лимит длины сообщения Telegram)
+    errors = result.errors_text()[:3000]
+    if result.archive_path is None:
+        await message.answer(f"Не удалось обработать ни одной анкеты:\n{errors}", reply_markup=get_main_keyboard())
+        return
+
+    try:
+        caption = f"Обработано анкет: {len(result.succeeded)} из {len(result.items)}"
+        await send_results_to_user(message.chat.id, [result.archive_path])
+        await message.answer(caption + (f"\nНе удалось обработать:\n{errors}" if errors else ""))
+    finally:
+        if os.path.exists(result.archive_path):
+            os.remove(result.archive_path)
+
+
+@router.callback_query(MainState.survey_report_pick, F.data.startswith("survey_pick__"))
+async def pick_suggested_survey(callback_query: CallbackQuery, state: FSMContext):
+    """Выбор анкеты из предложенных похожих"""
+    await callback_query.answer()
+    try:
+        await callback_query.message.delete()
+    except Exception:
+        pass
+
+    survey_id = callback_query.data.split("__", 1)[1]
+    try:
+        survey = await survey_directory.get(int(survey_id) if survey_id.isdigit() else survey_id)
+    except AnketologError as error:
+        await callback_query.message.answer(f"Не удалось получить отчет: {error}")
+        await state.clear()
+        return
+    if survey is None:
+        await state.set_state(MainState.survey_report_name)
+        await callback_query.message.answer("Эта анкета больше не найдена в Anketolog. Отправьте название еще раз.")
+        return
+
+    await fetch_anketolog_report(callback_query.message, state, survey)
+
+
 @router.message(F.document)
 async def get_doc(message: Message, state: FSMContext):
     """Обработчик получения документа"""
@@ -378,7 +570,7 @@ async def get_doc(message: Message, state: FSMContext):
         await message.answer("Проверьте отправленный файл, он должен соответствовать формату .xlsx")
         return
 
-    file_path = f'{config.download_dir}/{doc_name}'
+    file_path = os.path.join(job_dir(), doc_name)
     await start_uploaded_file_processing(
         state=state,
         message=message,
@@ -520,9 +712,7 @@ async def yes_quest(callback_query: CallbackQuery, state: FSMContext):
             except (YandexDiskError, OSError) as error:
                 await bot.send_message(chat_id=chat_id, text=f"Не удалось загрузить файл на Яндекс.Диск: {error}")
 
-        for file_path in file_paths:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        remove_job_files(file_paths)
         await state.clear()
         return
 
@@ -535,75 +725,26 @@ async def yes_quest(callback_query: CallbackQuery, state: FSMContext):
             return
 
         search_msg = await callback_query.message.answer("Начинаю поиск нужной анкеты в Anketolog...")
-        handed_off_to_processing = False
         try:
-            survey = await asyncio.to_thread(locate_survey_by_name, survey_name)
-            survey_id = survey.get("id")
-            survey_real_name = (survey.get("settings") or {}).get("name") or survey_name
-
-            report_msg = await callback_query.message.answer(
-                "Нужная анкета найдена. Начинаю формирование отчета в Anketolog..."
-            )
-
-            report = await asyncio.to_thread(create_report, survey_id)
-            report_id = report.get("id")
-            report_status = report.get("status")
-            report_url = report.get("url")
-
-            if report_status == "complete" and report_url:
-                ready_format = report.get("format", REPORT_FORMAT)
-                ext = get_extension(ready_format)
-                file_path = os.path.join(
-                    config.download_dir,
-                    f"{sanitize_filename(survey_real_name)}_{survey_id}.{ext}",
-                )
-                await asyncio.to_thread(download_file, report_url, file_path)
+            survey = await survey_directory.locate(survey_name)
+        except SurveyLookupError as error:
+            if error.suggestions:
+                await offer_survey_suggestions(callback_query.message, state, error)
             else:
-                ready_report = await asyncio.to_thread(wait_until_report_ready, survey_id, report_id)
-                ready_url = ready_report.get("url")
-                ready_format = ready_report.get("format", REPORT_FORMAT)
-
-                if not ready_url:
-                    raise AnketologError("Отчет помечен как готовый, но URL отсутствует.")
-
-                ext = get_extension(ready_format)
-                file_path = os.path.join(
-                    config.download_dir,
-                    f"{sanitize_filename(survey_real_name)}_{survey_id}.{ext}",
-                )
-                await asyncio.to_thread(download_file, ready_url, file_path)
-
-            await bot.send_document(
-                chat_id=callback_query.message.chat.id,
-                document=FSInputFile(file_path),
-                caption=f"Отчет по анкете: {survey_real_name}",
-            )
-            await start_uploaded_file_processing(
-                state=state,
-                message=callback_query.message,
-                file_path=file_path,
-                original_file_name=os.path.basename(file_path),
-                document=None,
-            )
-            handed_off_to_processing = True
+                await callback_query.message.answer(f"Не удалось получить отчет: {error}")
+                await state.clear()
+            return
         except AnketologError as error:
             await callback_query.message.answer(f"Не удалось получить отчет: {error}")
-        except OSError as error:
-            await callback_query.message.answer(f"Не удалось сохранить или отправить отчет: {error}")
+            await state.clear()
+            return
         finally:
             try:
                 await search_msg.delete()
             except Exception:
                 pass
-            if "report_msg" in locals():
-                try:
-                    await report_msg.delete()
-                except Exception:
-                    pass
-            if "file_path" in locals() and not handed_off_to_processing and os.path.exists(file_path):
-                os.remove(file_path)
-            if not handed_off_to_processing:
-                await state.clear()
+
+        await fetch_anketolog_report(callback_query.message, state, survey)
         return
 
 
@@ -651,9 +792,7 @@ async def no_quest(callback_query: CallbackQuery, state: FSMContext):
             text="Файл на Яндекс.Диск не сохранен. Исходный файл на диске оставлен без изменений.",
         )
 
-        for file_path in file_paths:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        remove_job_files(file_paths)
         await state.clear()
         return
 
@@ -701,9 +840,7 @@ async def save_renamed_to_yandex(callback_query: CallbackQuery, state: FSMContex
         except (YandexDiskError, OSError) as error:
             await bot.send_message(chat_id=chat_id, text=f"Не удалось загрузить файл на Яндекс.Диск: {error}")
 
-    for file_path in file_paths:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    remove_job_files(file_paths)
     await state.clear()
 
 @router.message(MainState.gender)
@@ -1110,7 +1247,7 @@ async def go_back(callback_query: CallbackQuery, state: FSMContext):
         await state.update_data(last_bot_message_id=bot_msg.message_id, question_message_ids=ids)
         return
 
-    if current_state == MainState.survey_report_confirm:
+    if current_state in (MainState.survey_report_confirm, MainState.survey_report_pick):
         await state.set_state(MainState.survey_report_name)
         bot_msg = await callback_query.message.answer(
             "Отправьте название анкеты из Anketolog.",
@@ -1264,6 +1401,25 @@ async def add_put_users_list(message: Message, state: FSMContext):
     await state.clear()
 
 
+@router.message(Command("stage_stats"))
+async def stage_stats(message: Message, state: FSMContext):
+    """Обработчик команды статистики времени этапов обработки"""
+    await state.clear()
+
+    # Проверка прав администратора
+    if message.from_user.id not in config.admin_users:
+        await message.answer("Вы не администратор, вам сюда нельзя!!!")
+        return
+
+    stats = await asyncio.to_thread(stage_percentiles, config.trace_log_path, config.trace_stats_records)
+    if not stats:
+        await message.answer("Пока нет данных о времени обработки.")
+        return
+
+    lines = [f"{stage}: p50 {p50:.2f} с, p95 {p95:.2f} с (n={count})" for stage, (count, p50, p95) in stats.items()]
+    await message.answer("Время этапов обработки:\n" + "\n".join(lines))
+
+
 @router.message(Command("get_my_id"))
 async def get_my_id(message: Message):
     """Обработчик команды получения ID пользователя"""
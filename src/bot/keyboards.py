@@ -20,6 +20,23 @@ def get_yes_no_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
+def get_survey_suggestions_keyboard(surveys: list[dict]) -> InlineKeyboardMarkup:
+    """
+    Инлайн-клавиатура с похожими анкетами Anketolog и кнопкой Назад
+    """
+    rows = [
+        [
+            InlineKeyboardButton(
+                text=((survey.get("settings") or {}).get("name") or str(survey.get("id")))[:60],
+                callback_data=f"survey_pick__{survey.get('id')}",
+            ),
+        ]
+        for survey in surveys
+    ]
+    rows.append([InlineKeyboardButton(text="Назад", callback_data="back")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
 def get_yandex_replace_keyboard() -> InlineKeyboardMarkup:
     """
     Клавиатура для конфликта имени файла на Яндекс.Диске.
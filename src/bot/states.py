@@ -30,6 +30,8 @@ class MainState(StatesGroup):
     yandex_replace = State()
     survey_report_name = State()
     survey_report_confirm = State()
+    survey_report_pick = State()
+    batch_surveys = State()
     
 
 class AdminState(StatesGroup):
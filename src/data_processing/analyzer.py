@@ -1,270 +1,57 @@
+import numpy as np
 import pandas as pd
 import re
-from typing import List, Tuple, Dict, Optional, Union
-from .models import Question, AnalysisError, AnalysisResult
+from typing import List, Tuple, Dict, Optional
+from .models import Question, AnalysisError, AnalysisResult, CI_LOWER_COLUMN, CI_UPPER_COLUMN
+from .question_types import DISTRIBUTION_TYPES, MULTIPLE_TYPES, SKIPPED_TYPES, QuestionType
+from .question_cache import context_key, question_cache
+from .metrics import (
+    answer_floats,
+    csi_means,
+    nps_counts,
+    percentile_interval,
+    ratio_replicates,
+    roti_counts,
+    tr_counts,
+    tr_outcomes,
+)
+from .engine import (
+    DistributionEngine,
+    MOOD_LABELS,
+    build_frame,
+    SCALE_LABELS,
+    no_repet_persent_index,
+    round_persent,
+)
 import sys
 import os
 
 # Добавление корневого каталога проекта в путь импорта
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
 from config.config import config
+from src.utils.division_df import process_result_with_divider
 
-def no_repet_persent_index(list_of_persent: List[float]) -> int:
+def answer_values(question: Question, rows: Optional[np.ndarray] = None) -> np.ndarray:
     """
-    Выбор индекса для корректировки процентов
+    Ответы респондентов без двух строк заголовка
 
     Args:
-        list_of_persent: список процентов
-
-    Returns:
-        Индекс для корректировки
-    """
-    if len(list_of_persent) == 1:
-        return 0
-
-    start = 0
-    current_index = 1
-
-    while start != len(list_of_persent):
-        if current_index == len(list_of_persent) - 1 and list_of_persent[current_index] != list_of_persent[start]:
-            return start
-
-        if list_of_persent[current_index] == list_of_persent[start]:
-            start += 1
-            current_index = 0
-
-        current_index += 1
-
-    return 0
-
-def round_persent(*args: int) -> Tuple[float, ...]:
-    """
-    Округление процентов с учетом их суммы в 100%
-
-    Args:
-        *args: Количества для каждой категории
-
-    Returns:
-        Кортеж процентов для каждой категории
-    """
-    if len(args) == 0:
-        return tuple([0])
-
-    summ = sum(args)
-    list_of_persent = [round((x / summ) * 100, 0) / 100 for x in args]
-    persent_summ = round(sum(list_of_persent), 2)
-
-    index_no_repet_persent = no_repet_persent_index(list_of_persent)
-
-    if persent_summ > 1:
-        list_of_persent[index_no_repet_persent] -= 0.01
-    elif persent_summ < 1:
-        list_of_persent[index_no_repet_persent] += 0.01
-
-    return tuple(list_of_persent)
-
-def create_typical_frame(
-        number: str,
-        name: str,
-        scale_l: str,
-        grade: Union[str, int],
-        quantity: int,
-        percent: float
-) -> pd.DataFrame:
-    """
-    Создание типичного фрейма
-
-    Args:
-        number: номер вопроса
-        name: название вопроса
-        scale_l: шкала
-        grade: оценка
-        quantity: количество
-        percent: процент
-
-    Returns:
-        DataFrame с данными
-    """
-    final_df = {
-        "Номер вопроса": [number],
-        "Вопрос": [name],
-        "Шкала": [scale_l],
-        "Оценка": [grade],
-        "Количество": [quantity],
-        "Процент": [percent]
-    }
-
-    return pd.DataFrame(final_df)
-
-def scale(
-        question: Question,
-        str_so_cool: str = "Идеально",
-        str_cool: str = "Нормально",
-        str_pure: str = "Требует улучшений",
-        weights = None
-) -> Optional[Question]:
-    """
-    Обработка вопроса с шкалой (с учетом весов).
-
-    Args:
-        question: вопрос для обработки
-        str_so_cool: текст для высокой оценки
-        str_cool: текст для средней оценки
-        str_pure: текст для низкой оценки
-
-    Returns:
-        Обработанный вопрос или None если нет данных
-    """
-    finals_dfs = []
-    values = question.data['value'].iloc[2:].reset_index(drop=True)
-    weights = weights['ones'].iloc[2:].reset_index(drop=True)
-    # Очищаем от NaN и строим таблицу
-    df = pd.DataFrame({'value': values, 'weight': weights}).dropna()
-
-    # Пробуем привести значения к числам
-    def safe_int(val):
-        try:
-            return int(val)
-        except (ValueError, TypeError):
-            return None
-
-    df['value'] = df['value'].apply(safe_int)
-    df = df.dropna(subset=['value'])
-
-    # После очистки — если данных нет, сразу выходим
-    if df.empty:
-        return None
-
-    grouped = df.groupby('value')['weight'].sum().to_dict()
-
-    for elem in config.trash_list:
-        if elem in grouped:
-            del grouped[elem]
-
-    if not grouped:
-        return None
-
-    max_scale = max(grouped.keys())
-
-    so_cool, cool, pure = 0, 0, 0
-
-    for val, weight_sum in grouped.items():
-        if max_scale > 5:
-            if val > 8:
-                so_cool += weight_sum
-            elif 7 <= val <= 8:
-                cool += weight_sum
-            else:
-                pure += weight_sum
-        else:
-            if val == 5:
-                so_cool += weight_sum
-            elif val == 4:
-                cool += weight_sum
-            else:
-                pure += weight_sum
-
-    total = so_cool + cool + pure
-
-    if total == 0:
-        return None
-
-    # нормализуем проценты в твоей старой логике
-    so_cool_p, cool_p, pure_p = round_persent(so_cool, cool, pure)
-
-    # Создаём итоговые блоки
-    if so_cool > 0:
-        finals_dfs.append(create_typical_frame(question.id, question.name, question.name, str_so_cool, round(so_cool, 2), so_cool_p))
-    if cool > 0:
-        finals_dfs.append(create_typical_frame(question.id, question.name, question.name, str_cool, round(cool, 2), cool_p))
-    if pure > 0:
-        finals_dfs.append(create_typical_frame(question.id, question.name, question.name, str_pure, round(pure, 2), pure_p))
-
-    if not finals_dfs:
-        return None
-
-    question.data = pd.concat(finals_dfs, ignore_index=True)
-    return question
-
-def single_selection(question: Question, weights) -> Optional[Question]:
+        question: вопрос
+        rows: номера строк подгруппы (None — все ответы)
     """
-    Обработка вопроса с одиночным выбором (с учетом весов).
-
-    Args:
-        question: вопрос для обработки
-
-    Returns:
-        Обработанный вопрос или None если нет данных
-    """
-    finals_dfs = []
-    values = question.data['value'].iloc[2:].reset_index(drop=True)
-    weights = weights['ones'].iloc[2:].reset_index(drop=True)
-
-    df = pd.DataFrame({'value': values, 'weight': weights}).dropna()
-
-    # Группировка с учетом весов
-    grouped = df.groupby('value')['weight'].sum().to_dict()
+    values = question.values
+    return values if rows is None else values[rows]
 
-    # Удаляем мусорные слова
-    for trash in config.trash_list:
-        if trash in grouped:
-            del grouped[trash]
-
-    total_weight = sum(grouped.values())
-
-    for key, weight_sum in grouped.items():
-        percent = round((weight_sum / total_weight) * 100, 2) if total_weight > 0 else 0
-        finals_dfs.append(
-            create_typical_frame(question.id, question.name, question.name, key, round(weight_sum, 2), percent / 100)
-        )
-
-    if not finals_dfs:
-        return None
-
-    question.data = pd.concat(finals_dfs, ignore_index=True)
-    return question
-
-def multiple_selection(question: Question, num_person, weights) -> Optional[Question]:
+def answer_weights(weights: pd.DataFrame, rows: Optional[np.ndarray] = None) -> np.ndarray:
     """
-    Обработка вопроса с множественным выбором (с учетом весов)
+    Веса респондентов без двух строк заголовка
 
     Args:
-        question: вопрос для обработки
-
-    Returns:
-        Обработанный вопрос или None если нет данных
+        weights: DataFrame с весами, колонка 'ones'
+        rows: номера строк подгруппы (None — все ответы)
     """
-    finals_dfs = []
-
-    values = question.data['value'].iloc[2:].reset_index(drop=True)
-    weights = weights['ones'].iloc[2:].reset_index(drop=True)
-
-
-    # Собираем DataFrame
-    df = pd.DataFrame({'value': values, 'weight': weights})
-    df = df.dropna()
-
-    # Суммируем веса по каждому уникальному ответу
-    grouped = df.groupby('value')['weight'].sum().to_dict()
-
-    # Удаляем мусор
-    for trash in config.trash_list:
-        if trash in grouped:
-            del grouped[trash]
-
-    total_weight = sum(grouped.values())
-
-    for key, count_weight in grouped.items():
-        percent = round((count_weight / num_person) * 100, 2) if total_weight > 0 else 0
-        finals_dfs.append(
-            create_typical_frame(question.id, question.name, question.name, key, count_weight, percent / 100)
-        )
-
-    if not finals_dfs:
-        return None
-
-    question.data = pd.concat(finals_dfs, ignore_index=True)
-    return question
+    values = weights['ones'].iloc[2:].to_numpy()
+    return values if rows is None else values[rows]
 
 def is_scale(dic: Dict) -> bool:
     """
@@ -282,102 +69,29 @@ def is_scale(dic: Dict) -> bool:
 
     return False
 
-def matrix(question: Question, weights) -> Optional[Question]:
+def matrix(engine: DistributionEngine, question: Question) -> None:
     """
     Обработка вопроса с матрицей (универсальная — с учетом весов).
 
     Args:
+        engine: движок расчета распределений
         question: вопрос для обработки
-
-    Returns:
-        Обработанный вопрос или None если нет данных
     """
-    finals_dfs = []
-    question_copy = question.copy()
     # Первая строка — это шкала внутри матрицы
-    matrix_scale = question_copy.data['value'].iloc[0]
-
-    # Оставляем только фактические ответы
-    values = question_copy.data['value'].iloc[2:].reset_index(drop=True)
-    weights_copy = weights['ones'].iloc[2:].reset_index(drop=True)
-    df = pd.DataFrame({'value': values, 'weight': weights_copy}).dropna()
-    if df.empty:
-        return None
-
-    # Проверяем является ли шкалой
-    def safe_int(val):
-        try:
-            return int(val)
-        except (ValueError, TypeError):
-            return None
-
-    df['int_value'] = df['value'].apply(safe_int)
-
-    if df['int_value'].dropna().empty:
-        # считаем это одиночным выбором
-        final_question = single_selection(question, weights)
-    else:
-        # для шкальных — заменяем value на int_value
-        final_question = scale(question, weights=weights)
-
-    if final_question is None:
-        return None
-
-    final_df = final_question.data
-    final_df['Шкала'] = matrix_scale
-    finals_dfs.append(final_df)
+    matrix_scale = question.header[0]
+    engine.add_matrix(question.id, question.name, matrix_scale, question.encoding)
 
-    question.data = pd.concat(finals_dfs, ignore_index=True)
-    return question
-
-def matrix_3d(question: Question, weights) -> Optional[Question]:
+def matrix_3d(engine: DistributionEngine, question: Question) -> None:
     """
     Обработка вопроса с 3D матрицей (универсальная — с учетом весов)
 
     Args:
+        engine: движок расчета распределений
         question: вопрос для обработки
-
-    Returns:
-        Обработанный вопрос или None если нет данных
     """
-    finals_dfs = []
-
     # Первые две строки — название и шкала
-    question.name = question.data['value'].iloc[0]
-    matrix_scale = question.data['value'].iloc[1]
-
-    # Оставляем только ответы
-    values = question.data['value'].iloc[2:].reset_index(drop=True)
-    df = pd.DataFrame({'value': values}).dropna()
-
-    if df.empty:
-        return None
-
-    # Проверяем тип шкалы
-    def safe_int(val):
-        try:
-            return int(val)
-        except (ValueError, TypeError):
-            return None
-
-    df['int_value'] = df['value'].apply(safe_int)
-
-    if df['int_value'].dropna().empty:
-        # одиночный выбор
-        final_question = single_selection(question, weights=weights)
-    else:
-        final_question = scale(question, weights=weights)
-
-    if final_question is None:
-        return None
-
-    final_df = final_question.data
-    final_df['Шкала'] = matrix_scale
-
-    finals_dfs.append(final_df)
-
-    question.data = pd.concat(finals_dfs, ignore_index=True)
-    return question
+    name, matrix_scale = question.header
+    engine.add_matrix(question.id, name, matrix_scale, question.encoding)
 
 def capitalize_after_punctuation(text: str) -> str:
     """
@@ -421,18 +135,20 @@ def format_free_answer(answer) -> Optional[str]:
 
     return f'«{answer[0].upper() + answer[1:]}»'
 
-def free_answer(question: Question) -> Tuple[str, List[str]]:
+def free_answer(question: Question, rows: Optional[np.ndarray] = None, name=None) -> Tuple[str, List[str]]:
     """
     Обработка вопроса со свободным ответом
 
     Args:
         question: вопрос для обработки
+        rows: номера строк подгруппы
+        name: название вопроса в отчете (по умолчанию question.name)
 
     Returns:
         Кортеж с названием вопроса и списком ответов
     """
-    result = [question.name, []]
-    answers = question.data["value"].iloc[2:]
+    result = [question.name if name is None else name, []]
+    answers = answer_values(question, rows)
 
     for answer in answers:
         formatted_answer = format_free_answer(answer)
@@ -440,13 +156,12 @@ def free_answer(question: Question) -> Tuple[str, List[str]]:
             result[1].append(formatted_answer)
     return result
 
-def matrix_free_answer(question: Question) -> Tuple[str, List[str]]:
+def matrix_free_answer(question: Question, rows: Optional[np.ndarray] = None) -> Tuple[str, List[str]]:
     """
     Обработка одной колонки матрицы свободных ответов.
     В выгрузке первые две строки содержат строку матрицы и поле ответа.
     """
-    matrix_row = question.data["value"].iloc[0]
-    matrix_column = question.data["value"].iloc[1]
+    matrix_row, matrix_column = question.header
 
     name_parts = [question.name.strip()]
     for part in (matrix_row, matrix_column):
@@ -456,7 +171,7 @@ def matrix_free_answer(question: Question) -> Tuple[str, List[str]]:
                 name_parts.append(part)
 
     result = [" | ".join(name_parts), []]
-    answers = question.data["value"].iloc[2:]
+    answers = answer_values(question, rows)
 
     for answer in answers:
         formatted_answer = format_free_answer(answer)
@@ -465,12 +180,49 @@ def matrix_free_answer(question: Question) -> Tuple[str, List[str]]:
 
     return result
 
-def nps_quest(question: Question, weights) -> pd.DataFrame:
+# Зерно бутстрепа: одни и те же данные всегда дают одни и те же интервалы
+BOOTSTRAP_SEED = 0
+
+def intervals_enabled() -> bool:
+    """Считаются ли доверительные интервалы NPS и CSI"""
+    return config.bootstrap_replicates > 0
+
+def bootstrap_replicates(metric: str, values: np.ndarray, weights: np.ndarray,
+                         groups: List[Optional[np.ndarray]]) -> List[np.ndarray]:
+    """Повторы бутстрепа показателя с параметрами из конфигурации"""
+    return ratio_replicates(metric, values, weights, groups, n_boot=config.bootstrap_replicates,
+                            seed=BOOTSTRAP_SEED, workers=config.bootstrap_workers)
+
+def interval_cells(interval, digits: Optional[int] = None) -> Tuple:
     """
-    Обработка NPS вопроса с учетом весов.
+    Границы интервала для ячеек отчета
 
     Args:
-        question: вопрос для обработки
+        interval: нижняя и верхняя граница (NaN — не определена)
+        digits: до скольких знаков округлять (None — без округления)
+
+    Returns:
+        Пара границ или пара пустых строк, если интервал не определен
+    """
+    low, high = (float(bound) for bound in interval)
+    if np.isnan(low) or np.isnan(high):
+        return "", ""
+    if digits is not None:
+        return round(low, digits), round(high, digits)
+    return low, high
+
+def metric_values(question: Question) -> np.ndarray:
+    """
+    Числовые ответы вопроса для NPS, CSI и ROTI (нечисловые ответы — NaN)
+    """
+    return answer_floats(question.encoding)
+
+def nps_frame(so_cool, cool, pure, interval=None) -> pd.DataFrame:
+    """
+    Таблица NPS по взвешенному числу приверженцев, нейтралов и критиков
+
+    Args:
+        interval: доверительный интервал NPS (None — без столбцов интервала)
 
     Returns:
         DataFrame с результатами NPS
@@ -481,33 +233,6 @@ def nps_quest(question: Question, weights) -> pd.DataFrame:
         "Процент": []
     }
 
-    values = question.data['value'].iloc[2:].astype(float).reset_index(drop=True)
-    weights = weights['ones'].iloc[2:].reset_index(drop=True)
-
-
-    # Проверка какой тип шкалы (5-бальная или 10-бальная)
-    max_value = values.max()
-
-    so_cool = 0
-    cool = 0
-    pure = 0
-
-    for val, weight in zip(values, weights):
-        if max_value > 5:
-            if val > 8:
-                so_cool += weight
-            elif 9 > val > 6:
-                cool += weight
-            elif val <= 6:
-                pure += weight
-        else:
-            if val == 5:
-                so_cool += weight
-            elif val == 4:
-                cool += weight
-            elif val < 4:
-                pure += weight
-
     total_weight = so_cool + cool + pure
 
     so_cool_precent = so_cool / total_weight if total_weight > 0 else 0
@@ -518,15 +243,56 @@ def nps_quest(question: Question, weights) -> pd.DataFrame:
     nps_df["Количество"] = [round(so_cool, 2), round(cool, 2), round(pure, 2), ""]
     nps_df["Процент"] = [so_cool_precent, cool_precent, pure_precent, result_procent]
 
+    if interval is not None:
+        low, high = interval_cells(interval)
+        nps_df[CI_LOWER_COLUMN] = ["", "", "", low]
+        nps_df[CI_UPPER_COLUMN] = ["", "", "", high]
+
     return pd.DataFrame(nps_df)
 
-def tr_quest(question: Union[pd.DataFrame, "Question"], weights: pd.DataFrame) -> pd.DataFrame:
+def nps_frames(questions: List[Question], weights, groups: List[Optional[np.ndarray]]) -> List[List[pd.DataFrame]]:
     """
-    Обработка TR (достижение цели) с учетом весов.
+    Расчет NPS сразу для нескольких вопросов и групп
 
     Args:
-        question: объект с данными вопроса (должен содержать колонку 'value')
+        questions: вопросы NPS
         weights: DataFrame с весами, колонка 'ones'
+        groups: номера строк каждой группы (None — все ответы)
+
+    Returns:
+        Для каждого вопроса — таблицы NPS по группам (с доверительным интервалом, если он включен)
+    """
+    values = np.column_stack([metric_values(question) for question in questions])
+    row_weights = answer_weights(weights)
+    counts = nps_counts(values, row_weights, groups)
+
+    intervals = [[None] * len(groups) for _ in questions]
+    if intervals_enabled():
+        replicates = bootstrap_replicates("nps", values, row_weights, groups)
+        intervals = np.stack([percentile_interval(group_replicates, config.confidence_level)
+                              for group_replicates in replicates], axis=1)
+
+    return [
+        [nps_frame(*group_counts, interval) for group_counts, interval in zip(question_counts, question_intervals)]
+        for question_counts, question_intervals in zip(counts, intervals)
+    ]
+
+def nps_quest(question: Question, weights, rows: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    Обработка NPS вопроса с учетом весов.
+
+    Args:
+        question: вопрос для обработки
+        rows: номера строк подгруппы
+
+    Returns:
+        DataFrame с результатами NPS
+    """
+    return nps_frames([question], weights, [rows])[0][0]
+
+def tr_frame(reached, not_reached) -> pd.DataFrame:
+    """
+    Таблица TR по взвешенному числу достигших и не достигших цели
 
     Returns:
         DataFrame с результатами TR
@@ -537,18 +303,6 @@ def tr_quest(question: Union[pd.DataFrame, "Question"], weights: pd.DataFrame) -
         "Процент": []
     }
 
-    values = question.data['value'].iloc[2:].reset_index(drop=True).astype(str).str.strip()
-    weights = weights['ones'].iloc[2:].reset_index(drop=True)
-
-    reached = 0
-    not_reached = 0
-
-    for val, weight in zip(values, weights):
-        if val.lower() == "да":
-            reached += weight
-        elif val.lower() == "нет":
-            not_reached += weight
-
     total = reached + not_reached
     tr_percent = (reached / total) if total > 0 else 0
 
@@ -561,16 +315,44 @@ def tr_quest(question: Union[pd.DataFrame, "Question"], weights: pd.DataFrame) -
 
     return pd.DataFrame(tr_df)
 
-def roti_quest(question: Union[pd.DataFrame, "Question"], weights: pd.DataFrame) -> pd.DataFrame:
+def tr_frames(question: Question, weights: pd.DataFrame, groups: List[Optional[np.ndarray]]) -> List[pd.DataFrame]:
     """
-    Расчёт ROTI (Return on Time Invested) с учётом весов.
+    Расчет TR (достижение цели) с учетом весов для всех групп
 
     Args:
-        question: объект с данными вопроса (с колонкой 'value')
-        weights: DataFrame с весами (с колонкой 'ones')
+        question: вопрос TR
+        weights: DataFrame с весами, колонка 'ones'
+        groups: номера строк каждой группы (None — все ответы)
 
     Returns:
-        DataFrame с частотным распределением, средним значением и ROTI
+        Таблица TR для каждой группы
+    """
+    counts = tr_counts(tr_outcomes(question.encoding), answer_weights(weights), groups)
+    return [tr_frame(*group_counts) for group_counts in counts[0]]
+
+def tr_quest(question: Question, weights: pd.DataFrame,
+             rows: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    Обработка TR (достижение цели) с учетом весов.
+
+    Args:
+        question: вопрос для обработки
+        weights: DataFrame с весами, колонка 'ones'
+        rows: номера строк подгруппы
+
+    Returns:
+        DataFrame с результатами TR
+    """
+    return tr_frames(question, weights, [rows])[0]
+
+def roti_frame(score_counts, total_weight, weighted_sum) -> pd.DataFrame:
+    """
+    Таблица ROTI: частотное распределение оценок, среднее значение и ROTI
+
+    Args:
+        score_counts: взвешенное число оценок 1..5
+        total_weight: сумма весов всех оценок
+        weighted_sum: сумма весов оценок 4 и 5
     """
     roti_df = {
         "Оценка": [],
@@ -578,23 +360,7 @@ def roti_quest(question: Union[pd.DataFrame, "Question"], weights: pd.DataFrame)
         "Процент": []
     }
 
-    values = question.data['value'].iloc[2:].reset_index(drop=True).astype(float)
-    weights = weights['ones'].iloc[2:].reset_index(drop=True)
-
-    score_counts = {i: 0 for i in range(1, 6)}
-    total_weight = 0
-    weighted_sum = 0
-
-    for val, weight in zip(values, weights):
-        val_int = int(round(val))
-        if 1 <= val_int <= 5:
-            score_counts[val_int] += weight
-            if val_int == 4 or val_int == 5:
-                weighted_sum += 1 * weight
-            total_weight += 1 * weight
-
-    for score in range(1, 6):
-        count = score_counts[score]
+    for score, count in enumerate(score_counts, start=1):
         percent = (count / total_weight) if total_weight > 0 else 0
         roti_df["Оценка"].append(str(score))
         roti_df["Количество"].append(round(count, 2))
@@ -607,35 +373,111 @@ def roti_quest(question: Union[pd.DataFrame, "Question"], weights: pd.DataFrame)
 
     return pd.DataFrame(roti_df)
 
-def csi_quest(question: Question, weights) -> float:
+def roti_frames(question: Question, weights: pd.DataFrame, groups: List[Optional[np.ndarray]]) -> List[pd.DataFrame]:
     """
-    Обработка CSI вопроса с учетом весов.
+    Расчёт ROTI (Return on Time Invested) с учётом весов для всех групп
+
+    Args:
+        question: вопрос ROTI
+        weights: DataFrame с весами (с колонкой 'ones')
+        groups: номера строк каждой группы (None — все ответы)
+
+    Returns:
+        Таблица ROTI для каждой группы
+    """
+    score_counts, totals, favourable = roti_counts(metric_values(question), answer_weights(weights), groups)
+    return [roti_frame(*group_values) for group_values in zip(score_counts[0], totals[0], favourable[0])]
+
+def roti_quest(question: Question, weights: pd.DataFrame,
+               rows: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    Расчёт ROTI (Return on Time Invested) с учётом весов.
 
     Args:
         question: вопрос для обработки
+        weights: DataFrame с весами (с колонкой 'ones')
+        rows: номера строк подгруппы
 
     Returns:
-        Средневзвешенное значение ответов
+        DataFrame с частотным распределением, средним значением и ROTI
+    """
+    return roti_frames(question, weights, [rows])[0]
+
+def csi_values(questions: List[Question], weights, groups: List[Optional[np.ndarray]]) -> List[List[float]]:
+    """
+    Средневзвешенные значения ответов вопросов CSI сразу для всех групп
+
+    Args:
+        questions: вопросы CSI
+        weights: DataFrame с весами, колонка 'ones'
+        groups: номера строк каждой группы (None — все ответы)
+
+    Returns:
+        Для каждого вопроса — значения по группам
+    """
+    values = np.column_stack([metric_values(question) for question in questions])
+    means = csi_means(values, answer_weights(weights), groups)
+    return [[round(float(average), 4) for average in question_means] for question_means in means.tolist()]
+
+def csi_intervals(questions: List[Question], weights, groups: List[Optional[np.ndarray]]) -> List[Dict]:
     """
-    values = question.data['value'].iloc[2:].astype(float).reset_index(drop=True)
-    weights = weights['ones'].iloc[2:].reset_index(drop=True)
+    Доверительные интервалы CSI по параметрам и итогового CSI для всех групп
 
+    На каждом повторе бутстрепа средние всех вопросов CSI считаются по одной
+    и той же выборке строк, из них — CSI параметра (важность × оценка) и итог.
 
-    weighted_sum = (values * weights).sum()
-    total_weight = weights.sum()
+    Args:
+        questions: вопросы CSI (строки матриц важности и оценки)
+        weights: DataFrame с весами, колонка 'ones'
+        groups: номера строк каждой группы (None — все ответы)
 
-    if total_weight == 0:
-        return 0.0
+    Returns:
+        Для каждой группы — {параметр: (нижняя, верхняя граница)}, итог — под ключом "Итого:"
+    """
+    values = np.column_stack([metric_values(question) for question in questions])
+    replicates = bootstrap_replicates("csi", values, answer_weights(weights), groups)
+
+    criteria = {}
+    for index, question in enumerate(questions):
+        criteria.setdefault(question.header[0], []).append(index)
+
+    result = []
+    for group_replicates in replicates:
+        products = {
+            criterion: group_replicates[:, indices[1]] * group_replicates[:, indices[0]]
+            for criterion, indices in criteria.items() if len(indices) >= 2
+        }
+        intervals = {
+            criterion: percentile_interval(product, config.confidence_level)
+            for criterion, product in products.items()
+        }
+        if products:
+            total = np.column_stack(list(products.values())).mean(axis=1)
+            intervals["Итого:"] = percentile_interval(total, config.confidence_level)
+        result.append(intervals)
 
-    average = weighted_sum / total_weight
-    return round(float(average), 4)
+    return result
 
-def create_csi_df(csi_dic: Dict[str, List[float]]) -> pd.DataFrame:
+def csi_quest(question: Question, weights, rows: Optional[np.ndarray] = None) -> float:
+    """
+    Обработка CSI вопроса с учетом весов.
+
+    Args:
+        question: вопрос для обработки
+        rows: номера строк подгруппы
+
+    Returns:
+        Средневзвешенное значение ответов
+    """
+    return csi_values([question], weights, [rows])[0][0]
+
+def create_csi_df(csi_dic: Dict[str, List[float]], intervals: Optional[Dict] = None) -> pd.DataFrame:
     """
     Создание DataFrame для CSI
 
     Args:
         csi_dic: словарь с данными CSI
+        intervals: доверительные интервалы CSI по параметрам и итога (None — без столбцов интервала)
 
     Returns:
         DataFrame с результатами CSI
@@ -670,6 +512,12 @@ def create_csi_df(csi_dic: Dict[str, List[float]]) -> pd.DataFrame:
     csi_df["Оценка параметра"].append("")
     csi_df["CSI по параметру"].append(average)
 
+    if intervals is not None:
+        bounds = [interval_cells(intervals[key], 2) if key in intervals else ("", "")
+                  for key in list(csi_dic.keys()) + ["Итого:"]]
+        csi_df[CI_LOWER_COLUMN] = [low for low, _ in bounds]
+        csi_df[CI_UPPER_COLUMN] = [high for _, high in bounds]
+
     return pd.DataFrame(csi_df)
 
 def analyze_questions(
@@ -680,7 +528,8 @@ def analyze_questions(
         num_person: int = 1,
         weights = None,
         tr: Optional[int] = None,
-        roti: Optional[int] = None
+        roti: Optional[int] = None,
+        rows: Optional[np.ndarray] = None
     ) -> AnalysisResult:
     """
     Анализ вопросов из анкеты
@@ -691,15 +540,65 @@ def analyze_questions(
         nps: номера вопросов NPS
         csi: номера вопросов CSI
         num_person: количество участников
+        rows: номера строк ответов подгруппы при делении (None — все ответы)
 
     Returns:
         Результат анализа
     """
-    skip_quest = ["Имя", "Дата", "Email", "Телефон", "Загрузка файла"]
-    result = AnalysisResult()
-    csi_pre = {}
+    return analyze_groups(questions_list, [rows], [num_person], mood, nps, csi, weights, tr, roti)[0]
 
-    free_answers = []
+def analyze_groups(
+        questions_list: List[Question],
+        groups: List[Optional[np.ndarray]],
+        num_persons: List[int],
+        mood: Optional[int] = None,
+        nps: Optional[List[int]] = None,
+        csi: Optional[List[int]] = None,
+        weights = None,
+        tr: Optional[int] = None,
+        roti: Optional[int] = None,
+        dividers: Optional[List] = None
+    ) -> List[AnalysisResult]:
+    """
+    Анализ вопросов из анкеты сразу для нескольких групп респондентов (деление)
+
+    Ответы каждого вопроса разбираются один раз, а распределения по всем
+    группам считаются одной группировкой в DistributionEngine. Строки
+    распределений запоминаются по вопросам (question_cache): при повторном
+    анализе той же выгрузки с теми же весами и делением пересчитываются
+    только вопросы, у которых сменилась роль (настроение, NPS, CSI, TR, ROTI).
+
+    Args:
+        questions_list: список вопросов
+        groups: номера строк ответов каждой группы (None — все ответы)
+        num_persons: количество участников каждой группы
+        mood: номер вопроса о настроении
+        nps: номера вопросов NPS
+        csi: номера вопросов CSI
+        dividers: подписи групп для колонки «Разделитель» (None — без подписи)
+
+    Returns:
+        Результат анализа для каждой группы, в порядке groups
+    """
+    results = [AnalysisResult() for _ in groups]
+    csi_pre = [{} for _ in groups]
+    respondent_weights = answer_weights(weights)
+    engine = DistributionEngine(respondent_weights, groups, num_persons)
+
+    # Кэш строк распределений: контекст — выгрузка, веса, деление и мусорные слова
+    cache_context = None
+    if question_cache.enabled and questions_list and questions_list[0].digest is not None:
+        cache_context = context_key(questions_list[0].digest, respondent_weights, groups, num_persons, config.trash_list)
+        question_cache.load(cache_context)
+    # Порядок вопросов в таблице распределений, строки из кэша и роли посчитанных вопросов
+    distribution_ids = []
+    cached_rows = {}
+    computed_roles = {}
+
+    free_answers = [[] for _ in groups]
+    # Вопросы NPS и CSI считаются после обхода одним вызовом на все вопросы и группы
+    nps_questions = []
+    csi_questions = []
 
     # Преобразуем номера вопросов в ID
     if mood:
@@ -724,129 +623,115 @@ def analyze_questions(
     for question in questions_list:
         # Обработка NPS вопросов (поддержка нескольких номеров)
         if nps_ids and question.id in nps_ids:
-            if question.type != "Шкала" and question.type != "Выпадающий список":
+            if question.type not in (QuestionType.SCALE, QuestionType.DROPDOWN):
                 error_nps = AnalysisError(
                     f"Ошибка в выборе номера вопроса NPS. NPS вcегда является Шкалой или Выпадающим списком!"
                     f"\nОшибка произошла при обработке вопроса номер {question.id}")
                 raise error_nps
 
-            nps_result = nps_quest(question, weights)
-            # Добавляем информацию о вопросе для каждого блока NPS
-            nps_result["Номер вопроса"] = question.id
-            nps_result["Вопрос"] = question.name
-
-            if result.nps_frame.empty:
-                result.nps_frame = nps_result
-            else:
-                result.nps_frame = pd.concat([result.nps_frame, nps_result], ignore_index=True)
+            nps_questions.append(question)
             continue
 
         if tr and tr == question.id:
-            if question.type != "Одиночный выбор":
+            if question.type != QuestionType.SINGLE:
                 error_nps = AnalysisError(
                     f"Ошибка в выборе номера вопроса TR. TR вcегда является Одиночным выбором!"
                     f"\nОшибка произошла при обработке вопроса номер {question.id}")
                 raise error_nps
 
-            result.tr_frame = tr_quest(question, weights)
+            for result, frame in zip(results, tr_frames(question, weights, groups)):
+                result.tr_frame = frame
             continue
         
         if roti and roti == question.id:
-            if question.type != "Шкала":
+            if question.type != QuestionType.SCALE:
                 error_nps = AnalysisError(
                     f"Ошибка в выборе номера вопроса ROTI. ROTI вcегда является Одиночным выбором!"
                     f"\nОшибка произошла при обработке вопроса номер {question.id}")
                 raise error_nps
 
-            result.roti_frame = roti_quest(question, weights)
+            for result, frame in zip(results, roti_frames(question, weights, groups)):
+                result.roti_frame = frame
             continue
               
 
         # Обработка CSI вопросов
         if csi and question.id in csi:
-            if question.type != "Матрица" and question.type != "Матрица 3D":
+            if question.type not in (QuestionType.MATRIX, QuestionType.MATRIX_3D):
                 error_csi = AnalysisError(
                     f"Ошибка в выборе номера вопросов CSI. CSI всегда является Матрицей "
                     f"или Матрицей 3D \nОшибка произошла при обработке вопроса номер {question.id}")
                 raise error_csi
 
-            criterion = question.data['value'].iloc[0]
-
-            if criterion in csi_pre:
-                csi_pre[criterion].append(csi_quest(question, weights))
-            else:
-                csi_pre[criterion] = [csi_quest(question, weights)]
+            csi_questions.append(question)
             continue
 
+        # Вопрос (все его столбцы) берется из кэша целиком
+        if question.type in DISTRIBUTION_TYPES and question.id not in computed_roles:
+            if question.id in cached_rows:
+                continue
+            distribution_ids.append(question.id)
+            role = "mood" if mood and mood == question.id else "distribution"
+            rows = question_cache.get(cache_context, question.id, role) if cache_context else None
+            if rows is not None:
+                cached_rows[question.id] = rows
+                continue
+            computed_roles[question.id] = role
+
         # Обработка шкалы
-        if question.type == "Шкала":
-            if mood and mood == question.id:
-                final_question = scale(question, "Отличное", "Хорошее", "Плохое", weights)
-            else:
-                final_question = scale(question, weights=weights)
-
-            if final_question is not None:
-                result.data_frames.append(final_question.data)
+        if question.type == QuestionType.SCALE:
+            labels = MOOD_LABELS if mood and mood == question.id else SCALE_LABELS
+            engine.add_scale(question.id, question.name, question.name, question.encoding, labels)
             continue
 
         # Обработка одиночного выбора
-        elif question.type == "Одиночный выбор":
-            final_question = single_selection(question, weights)
-
-            if final_question is not None:
-                result.data_frames.append(final_question.data)
+        elif question.type == QuestionType.SINGLE:
+            engine.add_single(question.id, question.name, question.name, question.encoding)
             continue
 
         # Обработка матрицы
-        elif question.type == "Матрица":
-            final_question = matrix(question, weights)
-
-            if final_question is not None:
-                result.data_frames.append(final_question.data)
+        elif question.type == QuestionType.MATRIX:
+            matrix(engine, question)
             continue
 
         # Обработка 3D матрицы
-        elif question.type == "Матрица 3D":
-            final_question = matrix_3d(question, weights)
-
-            if final_question is not None:
-                result.data_frames.append(final_question.data)
+        elif question.type == QuestionType.MATRIX_3D:
+            matrix_3d(engine, question)
             continue
 
         # Обработка свободного ответа
-        elif question.type == "Свободный ответ":
-            free_question = free_answer(question)
-            if free_question[1]:
-                free_answers.append(free_question)
+        elif question.type == QuestionType.FREE_ANSWER:
+            for group_answers, rows in zip(free_answers, groups):
+                free_question = free_answer(question, rows)
+                if free_question[1]:
+                    group_answers.append(free_question)
             continue
 
         # Обработка матрицы свободных ответов
-        elif question.type == "Матрица свободных ответов":
-            free_question = matrix_free_answer(question)
-            if free_question[1]:
-                free_answers.append(free_question)
+        elif question.type == QuestionType.FREE_ANSWER_MATRIX:
+            for group_answers, rows in zip(free_answers, groups):
+                free_question = matrix_free_answer(question, rows)
+                if free_question[1]:
+                    group_answers.append(free_question)
             continue
 
         # Пропуск специальных типов вопросов
-        elif question.type in skip_quest:
-            result.skipped_questions += f"\n {question.id} {question.type}: {question.name}"
+        elif question.type in SKIPPED_TYPES:
+            for result in results:
+                result.skipped_questions += f"\n {question.id} {question.type}: {question.name}"
             continue
 
         # Обработка группы свободных ответов
-        elif question.type == "Группа свободных ответов":
-            question.name = question.data["value"].iloc[0]
-            free_question_group = free_answer(question)
-            if free_question_group[1]:
-                free_answers.append(free_question_group)
+        elif question.type == QuestionType.FREE_ANSWER_GROUP:
+            for group_answers, rows in zip(free_answers, groups):
+                free_question_group = free_answer(question, rows, name=question.header[0])
+                if free_question_group[1]:
+                    group_answers.append(free_question_group)
             continue
 
         # Обработка множественного выбора
-        elif (question.type == "Множественный выбор" or question.type == "Выпадающий список"
-              or question.type == "Выбор области" or question.type == "Множественный выпадающий список"):
-            final_question = multiple_selection(question, num_person, weights)
-
-            if final_question is not None:
-                result.data_frames.append(final_question.data)
+        elif question.type in MULTIPLE_TYPES:
+            engine.add_multiple(question.id, question.name, question.encoding)
             continue
         else:
             error_quest = AnalysisError(
@@ -855,21 +740,60 @@ def analyze_questions(
                 f"\nОшибка произошла при обработке вопроса номер {question.id}")
             raise error_quest
 
-    # Создание CSI фрейма
-    if csi and csi_pre:
-        result.csi_frame = create_csi_df(csi_pre)
-
-    # Создание фрейма свободных ответов
-    free_answers_df = {
-        "Вопрос": [],
-        "Ответ": []
-    }
-
-    for answer in free_answers:
-        free_answers_df["Вопрос"].append(answer[0])
-        free_answers_df["Ответ"].append("\n".join(answer[1]))
-
-    if free_answers_df["Вопрос"]:
-        result.free_answers_frame = pd.DataFrame(free_answers_df)
-
-    return result
+    if nps_questions:
+        for question, frames in zip(nps_questions, nps_frames(nps_questions, weights, groups)):
+            for result, nps_result in zip(results, frames):
+                # Добавляем информацию о вопросе для каждого блока NPS
+                nps_result["Номер вопроса"] = question.id
+                nps_result["Вопрос"] = question.name
+
+                if result.nps_frame.empty:
+                    result.nps_frame = nps_result
+                else:
+                    result.nps_frame = pd.concat([result.nps_frame, nps_result], ignore_index=True)
+
+    group_csi_intervals = [None] * len(groups)
+    if csi_questions:
+        for question, averages in zip(csi_questions, csi_values(csi_questions, weights, groups)):
+            criterion = question.header[0]
+            for group_csi, average in zip(csi_pre, averages):
+                group_csi.setdefault(criterion, []).append(average)
+        if csi and intervals_enabled():
+            group_csi_intervals = csi_intervals(csi_questions, weights, groups)
+
+    # Распределения по всем посчитанным вопросам и группам — одним проходом
+    group_rows = engine.build_rows()
+    if cache_context:
+        for question_id, role in computed_roles.items():
+            question_cache.put(cache_context, question_id, role, [rows.get(question_id, []) for rows in group_rows])
+        question_cache.flush(cache_context)
+
+    for group_index, (result, rows) in enumerate(zip(results, group_rows)):
+        result.data_frames = build_frame([
+            row
+            for question_id in distribution_ids
+            for row in (cached_rows[question_id][group_index] if question_id in cached_rows else rows.get(question_id, []))
+        ])
+
+    for result, group_csi, group_answers, intervals in zip(results, csi_pre, free_answers, group_csi_intervals):
+        # Создание CSI фрейма
+        if csi and group_csi:
+            result.csi_frame = create_csi_df(group_csi, intervals)
+
+        # Создание фрейма свободных ответов
+        free_answers_df = {
+            "Вопрос": [],
+            "Ответ": []
+        }
+
+        for answer in group_answers:
+            free_answers_df["Вопрос"].append(answer[0])
+            free_answers_df["Ответ"].append("\n".join(answer[1]))
+
+        if free_answers_df["Вопрос"]:
+            result.free_answers_frame = pd.DataFrame(free_answers_df)
+
+    if dividers is not None:
+        results = [process_result_with_divider(result, key) for result, key in zip(results, dividers)]
+
+    return results
@@ -0,0 +1,341 @@
+import asyncio
+import os
+import time
+import zipfile
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from .job_queue import job_dir, remove_job_dir
+from .models import AnalysisError
+from .processor import process_data
+from src.utils.anketolog import (
+    AnketologClient,
+    AnketologError,
+    REPORT_FORMAT,
+    anketolog_client,
+    find_folder_ids,
+    flatten_folder_names,
+    get_extension,
+    get_survey_folder_id,
+    poll_delays,
+    sanitize_filename,
+)
+from src.utils.survey_directory import SurveyDirectory, survey_directory
+from src.utils.tracing import start_trace
+from config.config import config
+
+
+# Строка «Папка: название» выгружает все анкеты папки
+FOLDER_PREFIXES = ("папка:", "folder:")
+ERRORS_FILE_NAME = "ошибки.txt"
+
+# Пользователи, у которых сейчас идет пакетная выгрузка
+_active_users: Set[int] = set()
+
+
+class BatchError(Exception):
+    """Ошибка пакетной выгрузки, из-за которой не обрабатывается ни одна анкета"""
+
+
+class BatchItem:
+    """
+    Одна анкета пакетной выгрузки
+    """
+    def __init__(self, survey_name: str, survey_id: Optional[int] = None):
+        self.survey_name: str = survey_name
+        self.survey_id: Optional[int] = survey_id
+        self.report_id: Optional[int] = None
+        self.file_path: Optional[str] = None
+        self.excel_path: Optional[str] = None
+        self.csv_path: Optional[str] = None
+        self.error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.excel_path is not None
+
+
+class BatchResult:
+    """
+    Итог пакетной выгрузки: архив с отчетами и анкеты с ошибками
+    """
+    def __init__(self, items: List[BatchItem], archive_path: Optional[str]):
+        self.items: List[BatchItem] = items
+        self.archive_path: Optional[str] = archive_path
+
+    @property
+    def succeeded(self) -> List[BatchItem]:
+        return [item for item in self.items if item.ok]
+
+    @property
+    def failed(self) -> List[BatchItem]:
+        return [item for item in self.items if not item.ok]
+
+    def errors_text(self) -> str:
+        return format_errors(self.items)
+
+
+def format_errors(items: List[BatchItem]) -> str:
+    """Анкеты с ошибками, по одной на строку"""
+    return "\n".join(f"{item.survey_name}: {item.error}" for item in items if not item.ok)
+
+
+def parse_batch_request(text: str) -> Tuple[List[str], Optional[str]]:
+    """
+    Разбор сообщения со списком анкет
+
+    Args:
+        text: названия анкет, каждое с новой строки, или «Папка: название»
+
+    Returns:
+        (названия анкет без повторов, название папки или None)
+    """
+    lines = [line.strip() for line in (text or "").splitlines() if line.strip()]
+    if len(lines) == 1 and lines[0].lower().startswith(FOLDER_PREFIXES):
+        return [], lines[0].split(":", 1)[1].strip() or None
+    return list(dict.fromkeys(lines)), None
+
+
+class BatchRunner:
+    """
+    Пакетная выгрузка отчетов Anketolog с обработкой.
+
+    Отчеты по всем анкетам создаются одновременно (частоту запросов
+    ограничивает AnketologClient), затем один цикл опрашивает все
+    ожидающие отчеты: за раунд — один запрос списка отчетов на анкету,
+    паузы между раундами растут, как при ожидании одного отчета.
+    Готовый отчет сразу скачивается и отправляется в пул обработки, не
+    дожидаясь остальных. Одновременно обрабатывается не больше
+    PROCESSING_WORKERS файлов пакета, чтобы пакет не занял всю очередь.
+    """
+    def __init__(
+            self,
+            client: AnketologClient,
+            directory: SurveyDirectory,
+            on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None
+    ):
+        self.client: AnketologClient = client
+        self.directory: SurveyDirectory = directory
+        self.on_progress: Optional[Callable[[int, int], Awaitable[None]]] = on_progress
+        self._processing: asyncio.Semaphore = asyncio.Semaphore(config.processing_workers)
+        self._done: int = 0
+        self._total: int = 0
+
+    async def run(self, survey_names: List[str], folder_name: Optional[str] = None) -> List[BatchItem]:
+        """
+        Выгрузка и обработка анкет
+
+        Args:
+            survey_names: названия анкет
+            folder_name: папка, все анкеты которой нужно выгрузить (вместо названий)
+
+        Returns:
+            Анкеты с путями к результатам или текстом ошибки
+
+        Raises:
+            BatchError: если не удалось получить список анкет или анкет слишком много
+        """
+        items = await self._resolve(survey_names, folder_name)
+        self._total = len(items)
+        self._done = sum(1 for item in items if item.error is not None)
+
+        queued = [item for item in items if item.error is None]
+        reports = await asyncio.gather(*(self.client.create_report(item.survey_id) for item in queued),
+                                       return_exceptions=True)
+
+        tasks: List[asyncio.Task] = []
+        pending: Dict[Any, BatchItem] = {}
+        for item, report in zip(queued, reports):
+            if isinstance(report, Exception):
+                await self._fail(item, report)
+                continue
+            item.report_id = report.get("id")
+            if report.get("status") == "complete" and report.get("url"):
+                tasks.append(asyncio.create_task(self._download_and_process(item, report)))
+            else:
+                pending[item.report_id] = item
+
+        await self._poll(pending, tasks)
+        await asyncio.gather(*tasks)
+        return items
+
+    async def _resolve(self, survey_names: List[str], folder_name: Optional[str]) -> List[BatchItem]:
+        """Поиск анкет по названиям или по папке в кэше списка анкет (SurveyDirectory)"""
+        try:
+            index = await self.directory.index()
+        except AnketologError as error:
+            raise BatchError(f"Не удалось получить список анкет: {error}")
+
+        if folder_name is not None:
+            try:
+                folder_tree = await self.directory.folders()
+            except AnketologError as error:
+                raise BatchError(f"Не удалось получить список папок: {error}")
+            folder_ids = find_folder_ids(folder_tree, folder_name)
+            if not folder_ids:
+                folder_names = flatten_folder_names(folder_tree)
+                hint = f" Доступные папки: {', '.join(folder_names[:20])}." if folder_names else ""
+                raise BatchError(f'Папка "{folder_name}" не найдена.{hint}')
+            found = [survey for survey in index.surveys.values() if get_survey_folder_id(survey) in folder_ids]
+            if not found:
+                raise BatchError(f'В папке "{folder_name}" нет анкет.')
+            items = [BatchItem((survey.get("settings") or {}).get("name") or str(survey.get("id")), survey.get("id"))
+                     for survey in found]
+        else:
+            items, seen = [], set()
+            for name in survey_names:
+                try:
+                    survey = await self.directory.locate(name)
+                except AnketologError as error:
+                    item = BatchItem(name)
+                    item.error = str(error)
+                    items.append(item)
+                    continue
+                if survey.get("id") in seen:
+                    continue
+                seen.add(survey.get("id"))
+                items.append(BatchItem((survey.get("settings") or {}).get("name") or name, survey.get("id")))
+
+        if len(items) > config.batch_max_surveys:
+            raise BatchError(
+                f"Слишком много анкет: {len(items)}. За один раз можно выгрузить не больше {config.batch_max_surveys}."
+            )
+        return items
+
+    async def _poll(self, pending: Dict[Any, BatchItem], tasks: List[asyncio.Task]) -> None:
+        """
+        Общий цикл опроса ожидающих отчетов
+
+        За раунд список отчетов запрашивается один раз на анкету, а не на
+        каждый отчет; готовые отчеты сразу уходят на скачивание и обработку.
+        """
+        for delay in poll_delays():
+            if not pending:
+                return
+            await asyncio.sleep(delay)
+
+            survey_ids = list({item.survey_id for item in pending.values()})
+            report_lists = await asyncio.gather(*(self.client.report_list(survey_id) for survey_id in survey_ids),
+                                                return_exceptions=True)
+            for report_list in report_lists:
+                if isinstance(report_list, Exception):
+                    # Список не получен — анкета опрашивается в следующем раунде
+                    continue
+                for report in report_list:
+                    item = pending.get(report.get("id"))
+                    if item is None:
+                        continue
+                    if report.get("status") == "complete" and report.get("url"):
+                        del pending[item.report_id]
+                        tasks.append(asyncio.create_task(self._download_and_process(item, report)))
+                    elif report.get("status") == "fail":
+                        del pending[item.report_id]
+                        await self._fail(item, "Формирование отчета завершилось с ошибкой.")
+
+        for item in list(pending.values()):
+            await self._fail(item, "Отчет не стал готовым за отведенное время.")
+        pending.clear()
+
+    async def _download_and_process(self, item: BatchItem, report: Dict[str, Any]) -> None:
+        """
+        Скачивание готового отчета и стандартная обработка (своя трасса на анкету)
+
+        Задача обработки не запускается заново после перезапуска бота: ее
+        результат нужен только для архива этого пакета.
+        """
+        ext = get_extension(report.get("format", REPORT_FORMAT))
+        item.file_path = os.path.join(job_dir(), f"{sanitize_filename(item.survey_name)}_{item.survey_id}.{ext}")
+        with start_trace():
+            try:
+                await self.client.download(report["url"], item.file_path)
+                async with self._processing:
+                    item.excel_path, item.csv_path = await process_data(item.file_path, resumable=False)
+            except (AnketologError, AnalysisError) as error:
+                await self._fail(item, error)
+                return
+            except Exception as error:
+                await self._fail(item, repr(error))
+                return
+        await self._report_progress()
+
+    async def _fail(self, item: BatchItem, error: Any) -> None:
+        item.error = str(error)
+        await self._report_progress()
+
+    async def _report_progress(self) -> None:
+        self._done += 1
+        if self.on_progress is not None:
+            try:
+                await self.on_progress(self._done, self._total)
+            except Exception:
+                pass
+
+
+def build_archive(items: List[BatchItem], archive_path: str) -> Optional[str]:
+    """
+    Архив с результатами обработки и списком ошибок
+
+    Returns:
+        Путь к архиву или None, если ни одна анкета не обработана
+    """
+    succeeded = [item for item in items if item.ok]
+    if not succeeded:
+        return None
+
+    with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for item in succeeded:
+            for path in (item.excel_path, item.csv_path):
+                if path and os.path.exists(path):
+                    archive.write(path, arcname=os.path.basename(path))
+        errors = format_errors(items)
+        if errors:
+            archive.writestr(ERRORS_FILE_NAME, errors)
+    return archive_path
+
+
+def remove_item_files(items: List[BatchItem]) -> None:
+    """Удаление каталогов задач с выгрузками и результатами (после упаковки в архив)"""
+    for item in items:
+        if item.file_path:
+            remove_job_dir(os.path.dirname(item.file_path))
+
+
+async def run_batch(
+        survey_names: List[str],
+        folder_name: Optional[str] = None,
+        user_id: Optional[int] = None,
+        on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None
+) -> BatchResult:
+    """
+    Пакетная выгрузка: отчеты всех анкет, обработанные стандартно, в одном архиве
+
+    Args:
+        survey_names: названия анкет
+        folder_name: папка, все анкеты которой нужно выгрузить (вместо названий)
+        user_id: пользователь (одновременно — одна пакетная выгрузка на пользователя)
+        on_progress: корутина (обработано анкет, всего анкет)
+
+    Returns:
+        BatchResult; архив удаляет вызывающий код после отправки
+
+    Raises:
+        BatchError: если выгрузку нельзя начать
+    """
+    if user_id is not None and user_id in _active_users:
+        raise BatchError("У вас уже идет пакетная выгрузка. Дождитесь архива.")
+    if not survey_names and folder_name is None:
+        raise BatchError("Не указаны анкеты.")
+
+    if user_id is not None:
+        _active_users.add(user_id)
+    try:
+        items = await BatchRunner(anketolog_client, survey_directory, on_progress).run(survey_names, folder_name)
+
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        archive_path = os.path.join(config.download_dir, f"batch_{user_id or 0}_{stamp}.zip")
+        try:
+            archive_path = await asyncio.to_thread(build_archive, items, archive_path)
+        finally:
+            await asyncio.to_thread(remove_item_files, items)
+        return BatchResult(items, archive_path)
+    finally:
+        _active_users.discard(user_id)
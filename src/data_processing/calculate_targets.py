@@ -1,47 +1,13 @@
-import os
 from .models import Question
+import numpy as np
 import pandas as pd
-from typing import List, Dict
+from typing import Any, List, Dict, Optional, Tuple
 
-import sqlite3
 import json
 
 from config.config import config
 
 
-def _connect_monitoring_db() -> sqlite3.Connection:
-    os.makedirs(os.path.dirname(config.monitoring_db_path), exist_ok=True)
-    conn = sqlite3.connect(config.monitoring_db_path, timeout=30)
-    conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA busy_timeout=5000")
-    return conn
-
-
-def _ensure_form_data_table(cursor: sqlite3.Cursor) -> None:
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS form_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            menCount TEXT,
-            womenCount TEXT,
-            artSchools TEXT,
-            ageGroups TEXT
-        )
-    ''')
-
-
-def _ensure_calculation_results_table(cursor: sqlite3.Cursor) -> None:
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS calculation_results (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sampleSize INTEGER,
-            targetPol TEXT,
-            targetAge TEXT,
-            targetArt TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-
 def _normalize_weight_value(value, dimension_index: int) -> str:
     text = "" if pd.isna(value) else str(value).strip().lower()
     if dimension_index == 0:
@@ -52,87 +18,205 @@ def _normalize_weight_value(value, dimension_index: int) -> str:
     return text
 
 
+class RakingDiagnostics:
+    """
+    Итоги итеративного взвешивания (raking)
+    """
+    def __init__(self, iterations: int, converged: bool, max_deviation: Dict[str, float],
+                 design_effect: float, effective_sample_size: float, trimmed: int = 0):
+        """
+        Args:
+            iterations: число выполненных итераций
+            converged: достигнута ли точность tolerance
+            max_deviation: максимальное отклонение доли от целевой по каждому признаку
+            design_effect: эффект дизайна Киша n * sum(w^2) / sum(w)^2
+            effective_sample_size: эффективный размер выборки sum(w)^2 / sum(w^2)
+            trimmed: сколько раз веса были обрезаны границами
+        """
+        self.iterations: int = iterations
+        self.converged: bool = converged
+        self.max_deviation: Dict[str, float] = max_deviation
+        self.design_effect: float = design_effect
+        self.effective_sample_size: float = effective_sample_size
+        self.trimmed: int = trimmed
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Диагностика в виде, пригодном для JSON (история отчетов)"""
+        return {
+            "iterations": self.iterations,
+            "converged": self.converged,
+            "max_deviation": self.max_deviation,
+            "design_effect": self.design_effect,
+            "effective_sample_size": self.effective_sample_size,
+            "trimmed": self.trimmed,
+        }
+
+    def __repr__(self) -> str:
+        return (f"RakingDiagnostics(iterations={self.iterations}, converged={self.converged}, "
+                f"max_deviation={self.max_deviation}, design_effect={self.design_effect:.4f}, "
+                f"effective_sample_size={self.effective_sample_size:.2f}, trimmed={self.trimmed})")
+
+
+def _margin_shares(weights: np.ndarray, rows: np.ndarray, codes: np.ndarray, size: int, total: float) -> np.ndarray:
+    """Текущие доли категорий признака"""
+    return np.bincount(codes, weights=weights[rows], minlength=size) / total
+
+
+def _trim_weights(weights: np.ndarray, bounds: Tuple[float, float], tolerance: float = 1e-9) -> int:
+    """
+    Обрезка весов границами с сохранением суммы (на месте)
+
+    Границы — доли от среднего положительного веса; среднее при сохранении
+    суммы не меняется, поэтому границы в весах постоянны. Веса за границами
+    приравниваются к границе, а разница суммы распределяется между весами
+    внутри границ; это повторяется, пока после перераспределения все веса
+    не окажутся в границах. Нулевые веса (респонденты вне распределений)
+    не меняются.
+
+    Args:
+        weights: веса респондентов
+        bounds: нижняя и верхняя граница в долях от среднего веса (нижняя <= 1 <= верхняя)
+        tolerance: допустимое относительное расхождение суммы весов
+
+    Returns:
+        Сколько весов было за границами до обрезки
+    """
+    positive = weights > 0
+    count = np.count_nonzero(positive)
+    if not count:
+        return 0
+    total_weight = weights[positive].sum()
+    mean_weight = total_weight / count
+    lower, upper = bounds[0] * mean_weight, bounds[1] * mean_weight
+
+    values = weights[positive]
+    outside = np.count_nonzero((values < lower) | (values > upper))
+    if not outside:
+        return 0
+
+    # Каждый раунд хотя бы один вес встает на границу, поэтому раундов не больше числа весов
+    for _ in range(count):
+        np.clip(values, lower, upper, out=values)
+        deficit = total_weight - values.sum()
+        if abs(deficit) <= tolerance * total_weight:
+            break
+        free = (values > lower) & (values < upper)
+        free_sum = values[free].sum()
+        if free_sum <= 0:
+            break
+        values[free] *= 1 + deficit / free_sum
+    np.clip(values, lower, upper, out=values)
+
+    weights[positive] = values
+    return outside
+
+
 def rake_weights(
     df: pd.DataFrame,
     targets: Dict[str, Dict[str, float]],
     sample_size,
     max_iterations: int = 50,
-    tolerance: float = 1e-4
-) -> pd.DataFrame:
+    tolerance: float = 1e-4,
+    bounds: Optional[Tuple[float, float]] = None
+) -> Tuple[pd.DataFrame, RakingDiagnostics]:
     """
     Выполняет итеративное взвешивание (raking) по заданным признакам.
 
+    Категории каждого признака заранее кодируются целыми числами, доли
+    считаются через np.bincount, а коэффициенты применяются одним
+    индексированием массива весов.
+
     Args:
         df (pd.DataFrame): DataFrame с колонками признаков и колонкой 'Вес'
         targets (Dict[str, Dict[str, float]]): словарь, где ключ — название признака, а значение — target distribution
         max_iterations (int): максимум итераций
         tolerance (float): порог отклонения для завершения
+        bounds (Tuple[float, float]): нижняя и верхняя граница веса в долях от среднего веса
+            (обрезка весов после каждой итерации, см. _trim_weights); None — без обрезки
 
     Returns:
-        pd.DataFrame с обновлённой колонкой 'Вес'
+        pd.DataFrame с обновлённой колонкой 'Вес' и диагностика взвешивания
     """
-    weights = df['Вес'].copy()
+    weights = df['Вес'].to_numpy(dtype=float, copy=True)
+
+    margins = []
+    for col, target_dist in targets.items():
+        categories = list(target_dist)
+        codes = pd.Index(categories).get_indexer(df[col])
+        rows = np.flatnonzero(codes >= 0)
+        shares = np.array([target_dist[category] for category in categories], dtype=float)
+        margins.append((col, rows, codes[rows], shares))
+
+    iterations = 0
+    converged = False
+    trimmed = 0
 
     for iteration in range(max_iterations):
         prev_weights = weights.copy()
+        iterations = iteration + 1
 
-        for col, target_dist in targets.items():
+        for col, rows, codes, shares in margins:
             total_weight = weights.sum()
             if total_weight == 0:
                 raise ValueError("Сумма весов равна нулю. Проверьте совпадение групп на сайте и в выгрузке.")
             # Текущие доли
-            actuals = weights.groupby(df[col]).sum() / total_weight
-            for category, target_share in target_dist.items():
-                actual_share = actuals.get(category, 0)
-                if actual_share == 0:
-                    multiplier = 0
-                else:
-                    multiplier = target_share / actual_share
-                # Применяем коэффициент к нужным строкам
-                weights[df[col] == category] *= multiplier
+            actuals = _margin_shares(weights, rows, codes, len(shares), total_weight)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                multipliers = np.where(actuals == 0, 0.0, shares / actuals)
+            # Применяем коэффициент к нужным строкам
+            weights[rows] *= multipliers[codes]
 
+        if bounds is not None:
+            # Обрезаем веса относительно среднего, сохраняя их сумму
+            trimmed += _trim_weights(weights, bounds)
 
         # Проверка сходимости
-        max_diff = (weights - prev_weights).abs().max()
+        max_diff = np.abs(weights - prev_weights).max() if len(weights) else 0.0
         if max_diff < tolerance:
-            print(f"Сошлось за {iteration + 1} итераций (max_diff = {max_diff:.6f})")
+            converged = True
             break
-    else:
-        print("Предупреждение: достигнут максимум итераций без полной сходимости.")
 
-    df['Вес'] = weights
-    return df
+    total_weight = weights.sum()
+    max_deviation = {}
+    for col, rows, codes, shares in margins:
+        actuals = _margin_shares(weights, rows, codes, len(shares), total_weight) if total_weight else np.zeros(len(shares))
+        max_deviation[col] = float(np.abs(actuals - shares).max()) if len(shares) else 0.0
 
+    squares_sum = float(np.square(weights).sum())
+    effective_sample_size = float(total_weight) ** 2 / squares_sum if squares_sum else 0.0
+    design_effect = len(weights) / effective_sample_size if effective_sample_size else 0.0
 
-def save_calculation_results(sample_size, target_pol, target_age, target_art):
-    conn = _connect_monitoring_db()
-    cursor = conn.cursor()
+    diagnostics = RakingDiagnostics(iterations, converged, max_deviation, design_effect,
+                                    effective_sample_size, trimmed)
 
-    _ensure_calculation_results_table(cursor)
+    df['Вес'] = weights
+    return df, diagnostics
 
-    cursor.execute('''
-        INSERT INTO calculation_results (sampleSize, targetPol, targetAge, targetArt)
-        VALUES (?, ?, ?, ?)
-    ''', (
-        sample_size,
-        json.dumps(target_pol, ensure_ascii=False),
-        json.dumps(target_age, ensure_ascii=False),
-        json.dumps(target_art, ensure_ascii=False)
-    ))
 
-    conn.commit()
-    conn.close()
+def save_calculation_results(sample_size, target_pol, target_age, target_art) -> int:
+    """Сохранение целевых распределений; возвращает номер записи в calculation_results"""
+    with config.monitoring_db.transaction() as conn:
+        cursor = conn.execute('''
+            INSERT INTO calculation_results (sampleSize, targetPol, targetAge, targetArt)
+            VALUES (?, ?, ?, ?)
+        ''', (
+            sample_size,
+            json.dumps(target_pol, ensure_ascii=False),
+            json.dumps(target_age, ensure_ascii=False),
+            json.dumps(target_art, ensure_ascii=False)
+        ))
+    return cursor.lastrowid
 
 
-# Подключение к базе и чтение данных
-def fetch_form_data():
-    conn = _connect_monitoring_db()
-    cursor = conn.cursor()
+def _load_form_data_row():
+    row = config.monitoring_db.fetchone(
+        "SELECT menCount, womenCount, artSchools, ageGroups FROM form_data ORDER BY id DESC LIMIT 1")
+    return tuple(row) if row else None
 
-    _ensure_form_data_table(cursor)
-    cursor.execute("SELECT menCount, womenCount, artSchools, ageGroups FROM form_data ORDER BY id DESC LIMIT 1")
-    row = cursor.fetchone()
-    conn.close()
+
+# Чтение последней формы из базы (из кэша, пока форму не изменили в mini app)
+def fetch_form_data():
+    row = config.monitoring_db.cached("form_data", _load_form_data_row)
 
     if not row:
         return None
@@ -155,27 +239,50 @@ def fetch_form_data():
     return men_count, women_count, art_school_labels, art_school_distribution, age_group_labels, age_group_distribution
 
 
+def _normalized_values(question: Question, dimension_index: int) -> np.ndarray:
+    """
+    Нормализованные ответы вопроса; каждое уникальное значение нормализуется один раз
+
+    Args:
+        question: вопрос-признак взвешивания
+        dimension_index: номер признака (для первого признака распознается пол)
+
+    Returns:
+        Массив нормализованных строк по всем строкам вопроса
+    """
+    codes, uniques = pd.factorize(question.column)
+    # Последний элемент — для пропусков (код -1)
+    lookup = np.array([_normalize_weight_value(value, dimension_index) for value in uniques] + [""], dtype=object)
+    return lookup[codes]
+
+
+def _target_codes(normalized: np.ndarray, target_distribution: Dict[str, float]) -> np.ndarray:
+    """Номер категории целевого распределения для каждой строки (-1, если категории нет)"""
+    return pd.Index(list(target_distribution)).get_indexer(normalized)
+
+
+def _category_counts(codes: np.ndarray, target_distribution: Dict[str, float]) -> np.ndarray:
+    """Количество строк в каждой категории целевого распределения"""
+    return np.bincount(codes[codes >= 0], minlength=len(target_distribution))
+
+
 def count_matches_against_targets(question_dfs: List[Question], target_distributions: List[Dict[str, float]]) -> \
 List[Dict[str, int]]:
     """
     Подсчитывает количество записей в каждом вопросе, соответствующих ключам из словаря target_distributions.
 
     Args:
-        question_dfs (List[pd.DataFrame]): список DataFrame'ов, каждый из которых представляет отдельный вопрос
+        question_dfs (List[Question]): вопросы-признаки взвешивания, в том же порядке, что и распределения
         target_distributions (List[Dict[str, float]]): список словарей с возможными значениями и их долями
 
     Returns:
         List[Dict[str, int]]: список словарей с количеством соответствий по каждому значению
     """
     result = []
-    question_dfs = [q.data for q in question_dfs]
-    for idx, (df, target_dict) in enumerate(zip(question_dfs, target_distributions)):
-        
-        counts = {}
-        series = df.squeeze().apply(lambda value: _normalize_weight_value(value, idx))
-        for key in target_dict:
-            counts[key] = (series == key).sum()
-        result.append(counts)
+    for idx, (question, target_dict) in enumerate(zip(question_dfs, target_distributions)):
+        codes = _target_codes(_normalized_values(question, idx), target_dict)
+        counts = _category_counts(codes, target_dict)
+        result.append(dict(zip(target_dict, counts.tolist())))
 
     return result
 
@@ -185,36 +292,43 @@ def calculate_raw_weights_from_questions(
         question_numbers: List[int],
         targets: List[Dict[str, float]], sample_size
 ):
-    real_count = count_matches_against_targets(questions, targets)
+    """
+    Расчет весов респондентов по произвольному числу признаков
+
+    Args:
+        questions: все вопросы анкеты
+        question_numbers: номера вопросов-признаков, в том же порядке, что и targets
+        targets: целевые распределения признаков
+        sample_size: размер выборки, к которому нормируется сумма весов
+
+    Returns:
+        DataFrame с колонкой 'ones' (вес каждой строки вопроса)
+    """
     question_map = {int(q.id.split("_")[1]): q for q in questions}
     missing_questions = [num for num in question_numbers if num not in question_map]
     if missing_questions:
         raise ValueError(f"В выгрузке не найдены вопросы для взвешивания: {missing_questions}")
+    if len(question_numbers) != len(targets):
+        raise ValueError("Количество вопросов для взвешивания не совпадает с количеством распределений.")
 
     selected_questions = [question_map[num] for num in question_numbers]
-    df = pd.DataFrame({'ID_ответа': selected_questions[0].data.index})
-
-    for idx, q in enumerate(selected_questions):
-        df[q.name] = q.data["value"].apply(lambda value: _normalize_weight_value(value, idx)).values
-
-    def calc_row_weight(row):
-        weight = 1.0
-        for i, q in enumerate(selected_questions):
-            val = row[q.name]
+    df = pd.DataFrame({'ID_ответа': np.arange(len(selected_questions[0]))})
+
+    # Шаг 1: начальные веса — произведение target / actual по всем признакам
+    weights = np.ones(len(df))
+    for idx, (q, target_dict) in enumerate(zip(selected_questions, targets)):
+        normalized = _normalized_values(q, idx)
+        df[q.id] = normalized
+
+        codes = _target_codes(normalized, target_dict)
+        actual = _category_counts(codes, target_dict)
+        target = np.array(list(target_dict.values()), dtype=float) * sample_size
+        with np.errstate(divide='ignore', invalid='ignore'):
+            local_weights = np.where((actual == 0) | (target == 0), 0.0, target / actual)
+        # Значения вне распределения (код -1) получают нулевой вес
+        weights *= np.append(local_weights, 0.0)[codes]
 
-            target = targets[i].get(val, 0) * sample_size
-            actual = real_count[i].get(val, 1)
-
-            if actual == 0 or target == 0:
-                local_weight = 0
-            else:
-                local_weight = target / actual
-            weight *= local_weight
-        return weight
-
-    # Шаг 1: начальные веса
-    df['Вес'] = df.apply(calc_row_weight, axis=1)
-    df['Вес'] = pd.to_numeric(df['Вес'], errors='coerce').fillna(0).astype(float)
+    df['Вес'] = weights
 
     # Шаг 2: нормализуем сумму весов до sample_size
     weight_sum = df['Вес'].sum()
@@ -223,14 +337,11 @@ def calculate_raw_weights_from_questions(
     df['Вес'] *= sample_size / weight_sum
 
     # Шаг 3: применяем итеративное взвешивание (RAKING)
-    rake_targets = {
-        selected_questions[0].name: targets[0],
-        selected_questions[1].name: targets[1],
-        selected_questions[2].name: targets[2],
-    }
+    rake_targets = {q.id: target_dict for q, target_dict in zip(selected_questions, targets)}
 
-    df = rake_weights(df, rake_targets, sample_size)
+    df, diagnostics = rake_weights(df, rake_targets, sample_size, bounds=config.raking_bounds)
 
     # Шаг 4: сохранить в том формате, как ждет дальнейший код
     shifted_weights_df = df[['Вес']].rename(columns={'Вес': 'ones'})
+    shifted_weights_df.attrs['raking'] = diagnostics
     return shifted_weights_df
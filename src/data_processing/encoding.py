@@ -0,0 +1,66 @@
+from typing import Any, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+def safe_int(val: Any) -> Optional[int]:
+    """
+    Приведение ответа к целому числу
+
+    Returns:
+        Целое число или None, если значение не является числом
+    """
+    try:
+        return int(val)
+    except (ValueError, TypeError):
+        return None
+
+
+class ColumnEncoding:
+    """
+    Закодированные ответы одного вопроса.
+
+    Значения разбираются один раз на уникальное значение, а не на ячейку:
+    коды ответов, целочисленное значение (для шкал) и признак мусорного
+    слова. Анализаторы работают только с кодами и масками.
+    """
+    __slots__ = ("codes", "keys", "trash", "int_codes", "int_keys", "int_trash")
+
+    def __init__(self, values: np.ndarray, trash_list: Iterable[Any]):
+        """
+        Args:
+            values: ответы респондентов
+            trash_list: мусорные ответы, которые не попадают в распределения
+        """
+        # Проверка через множество — то же сравнение, что при удалении ключа из словаря
+        trash_set = set(trash_list)
+
+        # Код ответа по строкам (-1 для пропуска), ключи отсортированы как в groupby
+        codes, uniques = pd.factorize(values, sort=True)
+        self.codes: np.ndarray = codes
+        self.keys: List[Any] = uniques.tolist()
+        self.trash: np.ndarray = np.array([key in trash_set for key in self.keys], dtype=bool)
+
+        # Целочисленное значение каждого ключа (-1 — не число)
+        parsed = [safe_int(value) for value in uniques]
+        self.int_keys: List[int] = sorted({value for value in parsed if value is not None})
+        positions = {value: index for index, value in enumerate(self.int_keys)}
+        to_int = np.array([-1 if value is None else positions[value] for value in parsed] + [-1], dtype=np.intp)
+        self.int_codes: np.ndarray = to_int[codes]
+        self.int_trash: np.ndarray = np.array([key in trash_set for key in self.int_keys], dtype=bool)
+
+    def selection_codes(self) -> np.ndarray:
+        """Коды ответов, где мусорные ответы заменены пропуском (-1)"""
+        return _without_trash(self.codes, self.trash)
+
+    def scale_codes(self) -> np.ndarray:
+        """Коды целочисленных значений, где мусорные значения заменены пропуском (-1)"""
+        return _without_trash(self.int_codes, self.int_trash)
+
+
+def _without_trash(codes: np.ndarray, trash: np.ndarray) -> np.ndarray:
+    if not trash.any():
+        return codes
+    lookup = np.append(np.where(trash, -1, np.arange(len(trash))), -1)
+    return lookup[codes]
@@ -0,0 +1,318 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .encoding import ColumnEncoding
+
+
+FRAME_COLUMNS = ["Номер вопроса", "Вопрос", "Шкала", "Оценка", "Количество", "Процент"]
+
+SCALE_LABELS = ("Идеально", "Нормально", "Требует улучшений")
+MOOD_LABELS = ("Отличное", "Хорошее", "Плохое")
+
+
+def build_frame(rows: List[Tuple]) -> List[pd.DataFrame]:
+    """
+    Итоговая таблица распределений из строк
+
+    Args:
+        rows: строки (номер вопроса, вопрос, шкала, оценка, количество, процент)
+
+    Returns:
+        Список из одного DataFrame или пустой список, если строк нет
+    """
+    if not rows:
+        return []
+
+    return [pd.DataFrame(dict(zip(FRAME_COLUMNS, map(list, zip(*rows)))))]
+
+
+def no_repet_persent_index(list_of_persent: List[float]) -> int:
+    """
+    Выбор индекса для корректировки процентов
+
+    Args:
+        list_of_persent: список процентов
+
+    Returns:
+        Индекс для корректировки
+    """
+    if len(list_of_persent) == 1:
+        return 0
+
+    start = 0
+    current_index = 1
+
+    while start != len(list_of_persent):
+        if current_index == len(list_of_persent) - 1 and list_of_persent[current_index] != list_of_persent[start]:
+            return start
+
+        if list_of_persent[current_index] == list_of_persent[start]:
+            start += 1
+            current_index = 0
+
+        current_index += 1
+
+    return 0
+
+def round_persent(*args: int) -> Tuple[float, ...]:
+    """
+    Округление процентов с учетом их суммы в 100%
+
+    Args:
+        *args: Количества для каждой категории
+
+    Returns:
+        Кортеж процентов для каждой категории
+    """
+    if len(args) == 0:
+        return tuple([0])
+
+    summ = sum(args)
+    list_of_persent = [round((x / summ) * 100, 0) / 100 for x in args]
+    persent_summ = round(sum(list_of_persent), 2)
+
+    index_no_repet_persent = no_repet_persent_index(list_of_persent)
+
+    if persent_summ > 1:
+        list_of_persent[index_no_repet_persent] -= 0.01
+    elif persent_summ < 1:
+        list_of_persent[index_no_repet_persent] += 0.01
+
+    return tuple(list_of_persent)
+
+class _Block:
+    """
+    Вопрос, зарегистрированный в движке: закодированные ответы и параметры вывода
+    """
+    def __init__(self, kind: str, number: str, name: str, scale_name: Any,
+                 rows: np.ndarray, codes: np.ndarray, keys: List[Any],
+                 labels: Sequence[str] = SCALE_LABELS, enabled: Optional[np.ndarray] = None):
+        self.kind = kind
+        self.number = number
+        self.name = name
+        self.scale_name = scale_name
+        self.rows = rows
+        self.codes = codes
+        self.keys = keys
+        self.labels = labels
+        # Для каких групп вопрос выводится (строка матрицы — либо шкалой, либо выбором)
+        self.enabled = enabled
+
+
+class DistributionEngine:
+    """
+    Колоночный расчет распределений ответов.
+
+    Вопросы регистрируются методами add_scale / add_single / add_multiple / add_matrix
+    в порядке вывода по готовой кодировке ответов (ColumnEncoding): числа и мусорные
+    ответы уже разобраны, движок только отбирает строки по кодам.
+    build_groups() считает взвешенные количества сразу по всем вопросам и всем группам
+    деления одной группировкой длинной таблицы (группа + блок вопроса + код ответа)
+    и собирает для каждой группы фрейм «Номер вопроса/Вопрос/Шкала/Оценка/Количество/Процент».
+    build_rows() отдает те же строки с разбивкой по вопросам (для кэша результатов).
+    """
+    def __init__(self, weights: np.ndarray, groups: Optional[List[Optional[np.ndarray]]] = None,
+                 num_persons: Optional[List[Any]] = None):
+        """
+        Args:
+            weights: веса респондентов (только строки с ответами, без двух строк заголовка)
+            groups: номера строк каждой группы деления (None — одна группа из всех строк)
+            num_persons: число участников каждой группы (база процентов множественного выбора)
+        """
+        self._weights = weights
+        self._weight_missing = pd.isna(weights)
+        self._groups = [np.arange(len(weights)) if rows is None else rows for rows in (groups or [None])]
+        self._num_persons = num_persons if num_persons is not None else [1] * len(self._groups)
+        self._blocks: List[_Block] = []
+
+    def _answered(self, codes: np.ndarray) -> np.ndarray:
+        return np.flatnonzero((codes >= 0) & ~self._weight_missing)
+
+    def _add(self, kind: str, number: str, name: str, scale_name: Any,
+             codes: np.ndarray, keys: List[Any], **kwargs: Any) -> None:
+        rows = self._answered(codes)
+        self._blocks.append(_Block(kind, number, name, scale_name, rows, codes[rows], keys, **kwargs))
+
+    def add_scale(self, number: str, name: str, scale_name: Any, encoding: ColumnEncoding,
+                  labels: Sequence[str] = SCALE_LABELS) -> None:
+        """
+        Регистрация шкального вопроса
+
+        Args:
+            number: номер вопроса
+            name: название вопроса
+            scale_name: значение колонки «Шкала»
+            encoding: закодированные ответы респондентов
+            labels: подписи для высокой, средней и низкой оценки
+        """
+        self._add("scale", number, name, scale_name, encoding.scale_codes(), encoding.int_keys, labels=labels)
+
+    def add_single(self, number: str, name: str, scale_name: Any, encoding: ColumnEncoding) -> None:
+        """
+        Регистрация вопроса с одиночным выбором
+        """
+        self._add("single", number, name, scale_name, encoding.selection_codes(), encoding.keys)
+
+    def add_multiple(self, number: str, name: str, encoding: ColumnEncoding) -> None:
+        """
+        Регистрация вопроса с множественным выбором (проценты считаются от числа участников группы)
+        """
+        self._add("multiple", number, name, name, encoding.selection_codes(), encoding.keys)
+
+    def add_matrix(self, number: str, name: str, scale_name: Any, encoding: ColumnEncoding) -> None:
+        """
+        Регистрация строки матрицы: в группе, где среди ответов есть числа, она
+        считается шкалой, иначе — одиночным выбором
+
+        Args:
+            number: номер вопроса
+            name: название вопроса
+            scale_name: значение колонки «Шкала» для строки матрицы
+            encoding: закодированные ответы респондентов
+        """
+        has_ints = (encoding.int_codes >= 0) & ~self._weight_missing
+        as_scale = np.array([has_ints[group].any() for group in self._groups], dtype=bool)
+
+        self._add("scale", number, name, scale_name, encoding.scale_codes(), encoding.int_keys, enabled=as_scale)
+        self._add("single", number, name, scale_name, encoding.selection_codes(), encoding.keys, enabled=~as_scale)
+
+    def _grouped_counts(self) -> List[List[dict]]:
+        """
+        Взвешенные количества {ответ: сумма весов} для каждой группы и каждого блока
+        """
+        counts: List[List[dict]] = [[{} for _ in self._blocks] for _ in self._groups]
+
+        sizes = [len(block.keys) for block in self._blocks]
+        offsets = np.cumsum([0] + sizes[:-1])
+        stride = sum(sizes)
+        if stride == 0:
+            return counts
+
+        group_ids, rows = [], []
+        in_group = np.zeros(len(self._weights), dtype=bool)
+        for group_index, group_rows in enumerate(self._groups):
+            in_group[:] = False
+            in_group[group_rows] = True
+            for block, offset in zip(self._blocks, offsets):
+                selected = in_group[block.rows]
+                rows.append(block.rows[selected])
+                group_ids.append(block.codes[selected] + (group_index * stride + offset))
+
+        rows = np.concatenate(rows)
+        group_ids = np.concatenate(group_ids)
+        # Одна группировка по всем группам и вопросам; внутри группы порядок строк сохраняется
+        sums = pd.Series(self._weights[rows]).groupby(group_ids, sort=True).sum()
+
+        keys = sums.index.to_numpy()
+        block_ids = np.searchsorted(offsets, keys % stride, side="right") - 1
+        for key, block_id, weight_sum in zip(keys.tolist(), block_ids.tolist(), sums.tolist()):
+            group_index, code = divmod(key, stride)
+            block = self._blocks[block_id]
+            counts[group_index][block_id][block.keys[code - offsets[block_id]]] = weight_sum
+
+        return counts
+
+    def build(self) -> List[pd.DataFrame]:
+        """
+        Расчет всех зарегистрированных вопросов для первой (единственной) группы
+
+        Returns:
+            Список из одного итогового DataFrame или пустой список, если данных нет
+        """
+        return self.build_groups()[0]
+
+    def build_groups(self) -> List[List[pd.DataFrame]]:
+        """
+        Расчет всех зарегистрированных вопросов по всем группам
+
+        Returns:
+            Для каждой группы — список из одного итогового DataFrame или пустой список
+        """
+        return [
+            build_frame([row for rows in question_rows.values() for row in rows])
+            for question_rows in self.build_rows()
+        ]
+
+    def build_rows(self) -> List[Dict[str, List[Tuple]]]:
+        """
+        Строки итоговой таблицы по всем группам с разбивкой по вопросам
+
+        Returns:
+            Для каждой группы — {номер вопроса: строки} в порядке регистрации вопросов
+        """
+        if not self._blocks:
+            return [{} for _ in self._groups]
+
+        grouped_counts = self._grouped_counts()
+        return [
+            self._build_rows(counts, group_index, self._num_persons[group_index])
+            for group_index, counts in enumerate(grouped_counts)
+        ]
+
+    def _build_rows(self, counts: List[dict], group_index: int, num_person: Any) -> Dict[str, List[Tuple]]:
+        question_rows: Dict[str, List[Tuple]] = {}
+
+        def add_row(block: _Block, grade: Any, quantity: Any, percent: float) -> None:
+            question_rows.setdefault(block.number, []).append(
+                (block.number, block.name, block.scale_name, grade, quantity, percent))
+
+        for block, grouped in zip(self._blocks, counts):
+            if block.enabled is not None and not block.enabled[group_index]:
+                continue
+
+            if block.kind == "scale":
+                self._emit_scale(block, grouped, add_row)
+            elif block.kind == "single":
+                total_weight = sum(grouped.values())
+                for key, weight_sum in grouped.items():
+                    percent = round((weight_sum / total_weight) * 100, 2) if total_weight > 0 else 0
+                    add_row(block, key, round(weight_sum, 2), percent / 100)
+            else:
+                total_weight = sum(grouped.values())
+                for key, count_weight in grouped.items():
+                    percent = round((count_weight / num_person) * 100, 2) if total_weight > 0 else 0
+                    add_row(block, key, count_weight, percent / 100)
+
+        return question_rows
+
+    @staticmethod
+    def _emit_scale(block: _Block, grouped: dict, add_row) -> None:
+        if not grouped:
+            return
+
+        max_scale = max(grouped.keys())
+
+        so_cool, cool, pure = 0, 0, 0
+
+        for val, weight_sum in grouped.items():
+            if max_scale > 5:
+                if val > 8:
+                    so_cool += weight_sum
+                elif 7 <= val <= 8:
+                    cool += weight_sum
+                else:
+                    pure += weight_sum
+            else:
+                if val == 5:
+                    so_cool += weight_sum
+                elif val == 4:
+                    cool += weight_sum
+                else:
+                    pure += weight_sum
+
+        total = so_cool + cool + pure
+
+        if total == 0:
+            return
+
+        so_cool_p, cool_p, pure_p = round_persent(so_cool, cool, pure)
+        str_so_cool, str_cool, str_pure = block.labels
+
+        if so_cool > 0:
+            add_row(block, str_so_cool, round(so_cool, 2), so_cool_p)
+        if cool > 0:
+            add_row(block, str_cool, round(cool, 2), cool_p)
+        if pure > 0:
+            add_row(block, str_pure, round(pure, 2), pure_p)
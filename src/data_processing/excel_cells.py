@@ -0,0 +1,126 @@
+import sys
+from typing import Any, List
+
+import numpy as np
+import pandas as pd
+from openpyxl.cell.cell import ERROR_CODES
+
+
+# Строки, которые pandas по умолчанию считает пропуском (na_values в read_excel)
+NA_STRINGS = frozenset([
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+])
+
+# Сколько значений столбца копится в списке, прежде чем перейти в компактный вид
+CHUNK_ROWS = 10000
+# Целые числа, которые float64 хранит точно
+_MAX_EXACT_INT = 2 ** 53
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def convert_cell(value: Any) -> Any:
+    """
+    Приведение значения ячейки к виду, который дает pd.read_excel
+
+    Args:
+        value: значение ячейки из openpyxl
+
+    Returns:
+        Целое число для целых float, NaN для пустых ячеек, ошибок и строк-пропусков
+    """
+    if value is None:
+        return np.nan
+    if isinstance(value, str):
+        if value in NA_STRINGS or value in ERROR_CODES:
+            return np.nan
+        return value
+    if isinstance(value, float) and value == int(value):
+        return int(value)
+    return value
+
+
+def build_column(values: List[Any]) -> pd.Series:
+    """
+    Сборка столбца с тем же выводом типа, что и у парсера pd.read_excel
+
+    Args:
+        values: значения столбца
+
+    Returns:
+        Числовая Series, если все значения числовые, иначе Series типа object
+    """
+    column = pd.Series(values, dtype=object)
+    try:
+        return pd.to_numeric(column)
+    except (ValueError, TypeError):
+        return column
+
+
+class ColumnBuffer:
+    """
+    Значения одного столбца при потоковом чтении листа.
+
+    Значения (после convert_cell) копятся в списке и каждые CHUNK_ROWS
+    строк переходят в компактный вид: часть только из чисел и пропусков —
+    в массив int64 или float64, в остальных частях одинаковые строки
+    (варианты ответов) хранятся одним объектом. Целые float convert_cell
+    уже превратил в int, поэтому часть float64 восстанавливается точно:
+    build_column в finish() выводит тип так же, как по исходным значениям.
+    """
+    def __init__(self, missing: int = 0):
+        self._chunks: List[Any] = []
+        self._values: List[Any] = []
+        self.extend_missing(missing)
+
+    def append(self, value: Any) -> None:
+        if isinstance(value, str):
+            value = sys.intern(value)
+        self._values.append(value)
+        if len(self._values) >= CHUNK_ROWS:
+            self._flush()
+
+    def extend_missing(self, count: int) -> None:
+        """Добавление count пустых значений (NaN)"""
+        if count:
+            self._values.extend([np.nan] * count)
+            if len(self._values) >= CHUNK_ROWS:
+                self._flush()
+
+    def finish(self) -> pd.Series:
+        """Столбец с выводом типа как у build_column (буфер после этого пуст)"""
+        self._flush()
+        chunks, self._chunks = self._chunks, []
+        if chunks and all(isinstance(chunk, np.ndarray) for chunk in chunks):
+            # Только числа и пропуски: int64, если нет ни одного float, иначе float64
+            return pd.Series(np.concatenate(chunks))
+        return build_column([value for chunk in chunks for value in _chunk_values(chunk)])
+
+    def _flush(self) -> None:
+        values, self._values = self._values, []
+        if values:
+            self._chunks.append(_compact_chunk(values))
+
+
+def _compact_chunk(values: List[Any]) -> Any:
+    """Массив int64/float64 для части из чисел и пропусков, иначе сам список"""
+    kinds = {type(value) for value in values}
+    if not kinds <= {int, float}:
+        return values
+    ints = [value for value in values if type(value) is int]
+    if float not in kinds:
+        if min(ints) >= _INT64_MIN and max(ints) <= _INT64_MAX:
+            return np.array(values, dtype=np.int64)
+        return values
+    if ints and max(abs(value) for value in ints) > _MAX_EXACT_INT:
+        return values
+    return np.array(values, dtype=np.float64)
+
+
+def _chunk_values(chunk: Any) -> List[Any]:
+    """Исходные значения части столбца"""
+    if not isinstance(chunk, np.ndarray):
+        return chunk
+    if chunk.dtype == np.int64:
+        return chunk.tolist()
+    return [np.nan if value != value else int(value) if value.is_integer() else value for value in chunk.tolist()]
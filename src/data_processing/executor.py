@@ -0,0 +1,185 @@
+import asyncio
+import functools
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .models import AnalysisError
+from config.config import config
+
+
+PROGRESS_INTERVAL = 5
+
+
+class ProcessingQueueError(AnalysisError):
+    """
+    Исключение при переполнении очереди обработки или превышении лимита задач пользователя
+    """
+    pass
+
+
+class ProcessingJob:
+    """
+    Задача обработки, поставленная в пул
+    """
+    def __init__(self, user_id: Optional[int]):
+        self.user_id: Optional[int] = user_id
+        self.created_at: float = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def elapsed(self) -> float:
+        """Время с момента постановки задачи в очередь, в секундах"""
+        return time.monotonic() - self.created_at
+
+    def queue_time(self) -> float:
+        """Время ожидания свободного процесса, в секундах"""
+        end = self.started_at if self.started_at is not None else time.monotonic()
+        return end - self.created_at
+
+
+class ProcessingExecutor:
+    """
+    Пул процессов для тяжелой обработки анкет.
+
+    Держит не больше `max_workers` задач в работе одновременно, не больше
+    `max_per_user` задач на одного пользователя и не больше `max_queue`
+    задач в системе (в работе и в ожидании) суммарно.
+    """
+    def __init__(self, max_workers: int, max_per_user: int, max_queue: int):
+        self.max_workers: int = max_workers
+        self.max_per_user: int = max_per_user
+        self.max_queue: int = max_queue
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._waiting: List[ProcessingJob] = []
+        self._running: List[ProcessingJob] = []
+        self._jobs_by_user: Dict[int, int] = {}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn вместо fork: родительский процесс держит event loop и сетевые сессии
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        return self._slots
+
+    def queue_size(self) -> int:
+        """Количество задач в работе и в ожидании"""
+        return len(self._waiting) + len(self._running)
+
+    def position(self, job: ProcessingJob) -> int:
+        """
+        Позиция задачи в очереди ожидания
+
+        Returns:
+            Номер в очереди, начиная с 1, или 0 если задача уже выполняется
+        """
+        try:
+            return self._waiting.index(job) + 1
+        except ValueError:
+            return 0
+
+    def submit(self, user_id: Optional[int], func: Callable[..., Any], *args: Any, **kwargs: Any) -> ProcessingJob:
+        """
+        Постановка задачи в очередь
+
+        Args:
+            user_id: идентификатор пользователя для ограничения параллельных задач
+            func: функция уровня модуля, выполняемая в рабочем процессе
+            *args, **kwargs: аргументы функции (должны сериализоваться pickle)
+
+        Returns:
+            Поставленная задача
+        """
+        if self.queue_size() >= self.max_queue:
+            raise ProcessingQueueError(
+                "Сейчас обрабатывается слишком много файлов 😿\nПопробуйте отправить файл чуть позже."
+            )
+        if user_id is not None and self._jobs_by_user.get(user_id, 0) >= self.max_per_user:
+            raise ProcessingQueueError(
+                "У вас уже идет обработка файла. Дождитесь результата и отправьте следующий файл."
+            )
+
+        job = ProcessingJob(user_id)
+        self._waiting.append(job)
+        if user_id is not None:
+            self._jobs_by_user[user_id] = self._jobs_by_user.get(user_id, 0) + 1
+
+        job.task = asyncio.create_task(self._run(job, functools.partial(func, *args, **kwargs)))
+        return job
+
+    async def _run(self, job: ProcessingJob, call: Callable[[], Any]) -> Any:
+        try:
+            async with self._get_slots():
+                self._waiting.remove(job)
+                self._running.append(job)
+                job.started_at = time.monotonic()
+                loop = asyncio.get_running_loop()
+                pool = self._get_pool()
+                try:
+                    return await loop.run_in_executor(pool, call)
+                except BrokenProcessPool:
+                    # Рабочий процесс упал (например, по памяти): сломанный пул останавливается,
+                    # следующая задача получит новый. Остальные задачи того же пула падают
+                    # следом и не должны сбросить пул, созданный после него
+                    if self._pool is pool:
+                        self._pool = None
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+        finally:
+            if job in self._waiting:
+                self._waiting.remove(job)
+            if job in self._running:
+                self._running.remove(job)
+            if job.user_id is not None:
+                left = self._jobs_by_user.get(job.user_id, 1) - 1
+                if left > 0:
+                    self._jobs_by_user[job.user_id] = left
+                else:
+                    self._jobs_by_user.pop(job.user_id, None)
+
+    async def wait(
+        self,
+        job: ProcessingJob,
+        on_progress: Optional[Callable[[int, float], Awaitable[None]]] = None,
+        interval: float = PROGRESS_INTERVAL,
+    ) -> Any:
+        """
+        Ожидание результата задачи с периодическим сообщением о ходе обработки
+
+        Args:
+            job: задача
+            on_progress: корутина, получающая позицию в очереди и прошедшее время
+            interval: период вызова on_progress в секундах
+
+        Returns:
+            Результат функции задачи
+        """
+        while True:
+            done, _ = await asyncio.wait({job.task}, timeout=interval)
+            if done:
+                return job.task.result()
+            if on_progress is not None:
+                await on_progress(self.position(job), job.elapsed())
+
+    def shutdown(self) -> None:
+        """Остановка пула процессов"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+processing_executor = ProcessingExecutor(
+    max_workers=config.processing_workers,
+    max_per_user=config.processing_max_per_user,
+    max_queue=config.processing_queue_size,
+)
@@ -1,21 +1,28 @@
+import numpy as np
 import pandas as pd
-from typing import List
-from .models import Question
+from openpyxl import load_workbook
+from typing import Any, Iterable, List, Optional
+from .excel_cells import ColumnBuffer, convert_cell
+from .models import ColumnStore, Question
+from .question_types import parse_header
+from .parsed_cache import file_digest, parsed_cache
+from .question_cache import question_cache
+from src.utils.tracing import trace_stage
 
 
-def get_columns_to_drop(df: pd.DataFrame) -> int:
+def get_columns_to_drop(columns: Iterable[Any]) -> int:
     """
     Получение количества столбцов для удаления
     
     Args:
-        df: DataFrame с данными
+        columns: заголовки столбцов (первая строка листа)
         
     Returns:
         Количество столбцов для удаления
     """
     counter = -1
     
-    for elem in df.columns:
+    for elem in columns:
         counter += 1
         if str(elem).split(" ")[0] == "Страница":
             return counter
@@ -25,7 +32,14 @@ def get_columns_to_drop(df: pd.DataFrame) -> int:
 
 def read_file(path: str) -> pd.DataFrame:
     """
-    Чтение Excel таблицы
+    Потоковое чтение Excel таблицы
+    
+    Лист читается построчно в режиме read_only: служебные столбцы до
+    «Страница N» отбрасываются сразу, остальные значения складываются
+    по столбцам в ColumnBuffer, который каждые несколько тысяч строк
+    переводит их в компактный вид (числа — в массивы, повторяющиеся
+    ответы — в один объект). В памяти не держится ни весь лист, ни
+    списки Python-объектов на каждую ячейку.
     
     Args:
         path: путь к файлу
@@ -33,14 +47,50 @@ def read_file(path: str) -> pd.DataFrame:
     Returns:
         DataFrame с данными из файла
     """
-    df = pd.read_excel(path, engine="openpyxl")
-    
-    num_colum_to_drop = get_columns_to_drop(df)
-    
-    if num_colum_to_drop > 0:
-        columns_to_drop = df.columns[:num_colum_to_drop]
-        df = df.drop(columns=columns_to_drop)
-    
+    workbook = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[0]
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+
+        offset = get_columns_to_drop(header)
+        # Ширина таблицы — до последней непустой ячейки по всем строкам, как в pd.read_excel
+        width = _filled_length(header)
+        columns: List[ColumnBuffer] = []
+        rows_count = 0
+        pending_empty = 0
+
+        for row in rows:
+            filled = _filled_length(row)
+            if filled == 0:
+                # Пустые строки оставляем, только если после них есть данные
+                pending_empty += 1
+                continue
+
+            width = max(width, filled)
+            while len(columns) < width - offset:
+                columns.append(ColumnBuffer(rows_count))
+
+            for column in columns:
+                column.extend_missing(pending_empty)
+            rows_count += pending_empty + 1
+            pending_empty = 0
+
+            for index, column in enumerate(columns):
+                position = offset + index
+                column.append(convert_cell(row[position]) if position < len(row) else np.nan)
+    finally:
+        workbook.close()
+
+    data = {}
+    for index, column in enumerate(columns):
+        data[index] = column.finish()
+    df = pd.DataFrame(data)
+
     new_names = df.iloc[0]
     df.columns = new_names
     df = df.drop(0)
@@ -48,95 +98,139 @@ def read_file(path: str) -> pd.DataFrame:
     return df
 
 
+def _filled_length(row: tuple) -> int:
+    """Длина строки без хвостовых пустых ячеек"""
+    length = len(row)
+    while length and (row[length - 1] is None or row[length - 1] == ""):
+        length -= 1
+    return length
+
+
 def table_validation(df: pd.DataFrame) -> pd.DataFrame:
     """
     Валидация исходной таблицы
     
+    Столбцы без подписи (NaN) относятся к вопросу слева: им дается та же
+    подпись с порядковым номером вопроса, а пустые ячейки первой строки
+    заголовка заполняются значением слева в пределах вопроса. Группы и
+    заполнение считаются массивами, меняются только затронутые столбцы.
+    
     Args:
         df: DataFrame с данными
         
     Returns:
         Проверенный и обработанный DataFrame
     """
-    i = 0
-    current_number = 1
-    
-    while i < len(df.columns):
-        name = str(df.columns[i])
-        if name == "nan":
-            i += 1
-            continue
-        
-        df.columns.values[i] = f"{name} {current_number}"
-        
-        while True:
-            if i + 1 >= len(df.columns):
-                break
-            
-            if str(df.columns[i + 1]) != "nan":
-                break
-            df.columns.values[i + 1] = f"{name} {current_number}"
-            
-            current = df.iloc[0, i]
-            if pd.isna(df.iloc[0, i + 1]):
-                df.iloc[0, i + 1] = current
-            
-            i += 1
-        
-        i += 1
-        current_number += 1
+    count = len(df.columns)
+    if count == 0:
+        return df
+
+    positions = np.arange(count)
+    labels = np.array([str(label) for label in df.columns], dtype=object)
+    starts = labels != "nan"
+
+    # Начало вопроса для каждого столбца (-1 для столбцов до первого вопроса) и номер вопроса
+    group_start = np.maximum.accumulate(np.where(starts, positions, -1))
+    grouped = group_start >= 0
+    numbers = np.cumsum(starts)
+
+    new_labels = df.columns.to_numpy(dtype=object).copy()
+    new_labels[grouped] = [
+        f"{labels[start]} {number}" for start, number in zip(group_start[grouped], numbers[grouped])
+    ]
+
+    # Протягивание первой строки заголовка вправо внутри вопроса
+    header = df.iloc[0].to_numpy(dtype=object)
+    missing = pd.isna(header)
+    anchors = ~missing | starts | ~grouped
+    source = np.maximum.accumulate(np.where(anchors, positions, 0))
+    filled = header[source]
+    changed = np.flatnonzero(~anchors & ~pd.isna(filled))
+
+    # Столбцы object заполняются одним присваиванием, числовые (редкость) — по одному с приведением типа
+    is_object = (df.dtypes == object).to_numpy()
+    object_changed = changed[is_object[changed]]
+    if len(object_changed):
+        df.iloc[0, object_changed] = filled[object_changed]
+    for position in changed[~is_object[changed]].tolist():
+        df.isetitem(position, _with_first_value(df.iloc[:, position], filled[position]))
+
+    df.columns = pd.Index(new_labels, dtype=object, name=df.columns.name)
     
     return df
 
 
-def create_questions_list(df: pd.DataFrame) -> List[Question]:
+def _with_first_value(column: pd.Series, value) -> np.ndarray:
+    """Столбец с замененным значением первой строки (тип столбца меняется так же, как при df.iloc[0, i] = value)"""
+    is_number = isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_))
+    if column.dtype.kind == "f" and is_number:
+        values = column.to_numpy(copy=True)
+    else:
+        values = column.to_numpy(dtype=object, copy=True)
+    values[0] = value
+    return values
+
+
+def create_questions_list(df: pd.DataFrame, digest: Optional[str] = None) -> List[Question]:
     """
     Создание готового массива вопросов
     
+    Заголовки всех столбцов разбираются одним регулярным выражением, тип
+    вопроса определяется по реестру QuestionType (неизвестный тип — ошибка
+    сразу, до анализа). Вопросы ссылаются на столбцы общего ColumnStore
+    без копирования данных.
+    
     Args:
         df: DataFrame с данными
+        digest: хеш файла выгрузки (ключ кэша результатов по вопросам)
         
     Returns:
         Список вопросов
-    """
-    questions_list = []
-    i = 0
-    
-    while i < len(df.columns):
-        name = str(df.columns[i])
-        
-        first = 0
-        last = 0
-        
-        number = int(name.split()[-1])
-        
-        id_quest = f"D1_{number}"
         
-        for j in range(len(name) - 1, -1, -1):
-            if name[j] == "(":
-                first = j
-            if name[j] == ")":
-                last = j
-            
-            if first != 0 and last != 0:
-                break
-        
-        if first != 0 and last != 0:
-            type_q = "".join(name[first + 1:last])
-            name = "".join(name[0:first])
-        else:
-            type_q = "Неизвестный"
-            
-        df.columns.values[i] = name
-
-        data_series = df.iloc[:, i].reset_index(drop=True)
-        data = pd.DataFrame({
-            'value': data_series
-        }, index=data_series.index)
-        
-        new_question = Question(name, type_q, data, id_quest)
-        questions_list.append(new_question)
-        
-        i += 1
-    
-    return questions_list 
\ No newline at end of file
+    Raises:
+        AnalysisError: если заголовок не разбирается или тип вопроса неизвестен
+    """
+    headers = [parse_header(str(label)) for label in df.columns]
+    store = ColumnStore.from_frame(df, digest)
+
+    return [
+        Question(name, type_q, store, index, f"D1_{number}")
+        for index, (name, type_q, number) in enumerate(headers)
+    ]
+
+
+def load_questions_list(path: str) -> List[Question]:
+    """
+    Чтение выгрузки и создание списка вопросов с использованием кэша
+
+    Повторная обработка того же файла (с другими NPS/CSI/делением) берет
+    разобранные вопросы из кэша по хешу содержимого и не читает Excel.
+    Хеш сохраняется в вопросах — по нему кэшируются результаты анализа.
+
+    Args:
+        path: путь к файлу
+
+    Returns:
+        Список вопросов
+    """
+    digest = file_digest(path) if parsed_cache.enabled or question_cache.enabled else None
+    if digest is not None:
+        with trace_stage("parsed_cache") as span:
+            questions_list = parsed_cache.get(digest)
+            span.set(hit=questions_list is not None)
+        if questions_list is not None:
+            return questions_list
+
+    with trace_stage("read_file") as span:
+        df = read_file(path)
+        span.set(rows=df.shape[0], columns=df.shape[1])
+    with trace_stage("table_validation", columns=df.shape[1]):
+        df = table_validation(df)
+    with trace_stage("create_questions") as span:
+        questions_list = create_questions_list(df, digest)
+        span.set(questions=len(questions_list))
+
+    if digest is not None:
+        parsed_cache.put(digest, questions_list)
+
+    return questions_list
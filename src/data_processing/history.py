@@ -0,0 +1,296 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config.config import config
+from src.utils.db import MonitoringDatabase
+
+
+# Показатели, которые сохраняются в истории (как в краткой сводке)
+METRICS = ("NPS", "TR", "ROTI", "CSI")
+
+# Группировка точек тренда: формат strftime периода
+PERIODS = {
+    "day": "%Y-%m-%d",
+    "week": "%Y-W%W",
+    "month": "%Y-%m",
+}
+
+
+def survey_key(path: str) -> str:
+    """
+    Идентификатор анкеты в истории — имя файла выгрузки без расширения
+
+    Для отчетов из Anketolog это «Название_номер анкеты», поэтому все
+    выгрузки одной анкеты попадают в одну историю.
+    """
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class ReportHistory:
+    """
+    История обработанных отчетов в базе мониторинга.
+
+    Для каждого отчета сохраняются анкета, тип обработки, размер выборки,
+    диагностика взвешивания и ссылка на запись calculation_results, а
+    основные показатели (NPS/TR/ROTI/CSI, в том числе по группам деления) —
+    отдельными строками в report_metrics. Таблицы проиндексированы по
+    (показатель, анкета, время), поэтому тренды за месяцы читаются
+    диапазоном индекса, без просмотра всей истории.
+
+    Ошибки базы не мешают обработке: отчет просто не попадает в историю.
+    """
+    def __init__(self, database: MonitoringDatabase):
+        self.database: MonitoringDatabase = database
+
+    def record(
+            self,
+            survey: str,
+            metrics: Iterable[Dict[str, Any]],
+            job_id: Optional[int] = None,
+            type_analyze: Optional[str] = None,
+            respondents: Optional[int] = None,
+            sample_size: Optional[int] = None,
+            calculation_id: Optional[int] = None,
+            raking: Optional[Dict[str, Any]] = None,
+            created_at: Optional[float] = None
+    ) -> Optional[int]:
+        """
+        Сохранение отчета и его показателей
+
+        Args:
+            survey: идентификатор анкеты (survey_key)
+            metrics: показатели из AnalysisResult.key_metrics
+            job_id: задача обработки
+            type_analyze: standard или weighted
+            respondents: число ответов в выгрузке
+            sample_size: размер выборки при взвешивании
+            calculation_id: запись calculation_results с целевыми распределениями
+            raking: диагностика взвешивания (RakingDiagnostics.as_dict)
+            created_at: время отчета (по умолчанию — сейчас)
+
+        Returns:
+            Номер отчета в истории или None, если база недоступна
+        """
+        created_at = time.time() if created_at is None else created_at
+        try:
+            with self.database.transaction() as conn:
+                cursor = conn.execute(
+                    """
+                    INSERT INTO report_history
+                        (created_at, survey, job_id, type_analyze, respondents, sample_size, calculation_id, raking)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (created_at, survey, job_id, type_analyze, respondents, sample_size, calculation_id,
+                     json.dumps(raking, ensure_ascii=False) if raking is not None else None),
+                )
+                report_id = cursor.lastrowid
+                conn.executemany(
+                    """
+                    INSERT INTO report_metrics
+                        (report_id, created_at, survey, metric, question, divider, value, ci_lower, ci_upper)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (report_id, created_at, survey, metric["metric"], metric["question"], metric["group"],
+                         metric["value"], metric["ci_lower"], metric["ci_upper"])
+                        for metric in metrics
+                    ],
+                )
+        except sqlite3.Error:
+            return None
+        return report_id
+
+    def surveys(self) -> List[Dict[str, Any]]:
+        """
+        Анкеты, по которым есть отчеты
+
+        Returns:
+            Список словарей: survey, reports, first_at, last_at (последние — первыми)
+        """
+        rows = self.database.fetchall(
+            """
+            SELECT survey, COUNT(*) AS reports, MIN(created_at) AS first_at, MAX(created_at) AS last_at
+            FROM report_history
+            GROUP BY survey
+            ORDER BY last_at DESC
+            """
+        )
+        return [dict(row) for row in rows]
+
+    def reports(
+            self,
+            survey: Optional[str] = None,
+            since: Optional[float] = None,
+            until: Optional[float] = None,
+            limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        """
+        Отчеты за период вместе с показателями (последние — первыми)
+
+        Args:
+            survey: только эта анкета (None — все)
+            since, until: границы периода, Unix-время (включительно)
+            limit: максимум отчетов
+
+        Returns:
+            Список словарей отчетов; raking — словарь диагностики, metrics — показатели отчета
+        """
+        conditions, params = self._range(survey, since, until)
+        rows = self.database.fetchall(
+            f"""
+            SELECT * FROM report_history
+            {conditions}
+            ORDER BY created_at DESC
+            LIMIT ?
+            """,
+            params + [limit],
+        )
+        reports = [dict(row) for row in rows]
+        if not reports:
+            return reports
+
+        by_id = {report["id"]: report for report in reports}
+        for report in reports:
+            report["raking"] = json.loads(report["raking"]) if report["raking"] else None
+            report["metrics"] = []
+
+        metric_rows = self.database.fetchall(
+            f"""
+            SELECT report_id, metric, question, divider, value, ci_lower, ci_upper
+            FROM report_metrics
+            WHERE report_id IN ({', '.join('?' * len(by_id))})
+            ORDER BY id
+            """,
+            list(by_id),
+        )
+        for row in metric_rows:
+            metric = dict(row)
+            by_id[metric.pop("report_id")]["metrics"].append(metric)
+        return reports
+
+    def trend(
+            self,
+            metric: str,
+            survey: Optional[str] = None,
+            since: Optional[float] = None,
+            until: Optional[float] = None,
+            divider: Optional[str] = None,
+            period: Optional[str] = None,
+            limit: int = 1000
+    ) -> List[Dict[str, Any]]:
+        """
+        Значения показателя по времени
+
+        Args:
+            metric: NPS, TR, ROTI или CSI
+            survey: только эта анкета (None — все)
+            since, until: границы периода, Unix-время (включительно)
+            divider: значение разделителя (None — отчеты без деления и итог «Общее»)
+            period: day, week или month — среднее по периодам (None — каждая точка отдельно)
+            limit: максимум точек (последние)
+
+        Returns:
+            Без period — точки created_at, survey, question, value, ci_lower, ci_upper;
+            с period — period, value (среднее), min, max, reports. По возрастанию времени.
+
+        Raises:
+            ValueError: если показатель или период неизвестны
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Неизвестный показатель: {metric}")
+        if period is not None and period not in PERIODS:
+            raise ValueError(f"Неизвестный период: {period}")
+
+        conditions, params = self._range(survey, since, until, [("metric = ?", metric)])
+        if divider is None:
+            conditions += " AND (divider IS NULL OR divider = ?)"
+            params.append("Общее")
+        else:
+            conditions += " AND divider = ?"
+            params.append(divider)
+
+        if period is None:
+            rows = self.database.fetchall(
+                f"""
+                SELECT * FROM (
+                    SELECT created_at, survey, question, value, ci_lower, ci_upper
+                    FROM report_metrics
+                    {conditions}
+                    ORDER BY created_at DESC
+                    LIMIT ?
+                ) ORDER BY created_at
+                """,
+                params + [limit],
+            )
+        else:
+            rows = self.database.fetchall(
+                f"""
+                SELECT * FROM (
+                    SELECT strftime(?, created_at, 'unixepoch', 'localtime') AS period,
+                           AVG(value) AS value, MIN(value) AS min, MAX(value) AS max,
+                           COUNT(DISTINCT report_id) AS reports, MAX(created_at) AS last_at
+                    FROM report_metrics
+                    {conditions}
+                    GROUP BY period
+                    ORDER BY last_at DESC
+                    LIMIT ?
+                ) ORDER BY last_at
+                """,
+                [PERIODS[period]] + params + [limit],
+            )
+        return [dict(row) for row in rows]
+
+    def calculations(self, since: Optional[str] = None, until: Optional[str] = None,
+                     limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Сохраненные целевые распределения (calculation_results) за период
+
+        Args:
+            since, until: границы периода в формате created_at («ГГГГ-ММ-ДД ЧЧ:ММ:СС», UTC)
+            limit: максимум записей (последние — первыми)
+        """
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("created_at <= ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        rows = self.database.fetchall(
+            f"SELECT * FROM calculation_results {where} ORDER BY created_at DESC, id DESC LIMIT ?",
+            params + [limit],
+        )
+        results = []
+        for row in rows:
+            result = dict(row)
+            for key in ("targetPol", "targetAge", "targetArt"):
+                result[key] = json.loads(result[key]) if result[key] else None
+            results.append(result)
+        return results
+
+    @staticmethod
+    def _range(survey: Optional[str], since: Optional[float], until: Optional[float],
+               extra: Iterable = ()) -> Tuple[str, List[Any]]:
+        """Условие WHERE по анкете и периоду"""
+        conditions, params = [], []
+        for condition, value in extra:
+            conditions.append(condition)
+            params.append(value)
+        if survey is not None:
+            conditions.append("survey = ?")
+            params.append(survey)
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("created_at <= ?")
+            params.append(until)
+        return (f"WHERE {' AND '.join(conditions)}" if conditions else "WHERE 1"), params
+
+
+report_history = ReportHistory(config.monitoring_db)
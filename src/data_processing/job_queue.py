@@ -0,0 +1,312 @@
+import glob
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from config.config import config
+from src.utils.db import MonitoringDatabase
+
+
+# Статусы задачи: queued (ждет процесс пула) -> running -> done | failed;
+# задача queued/running с истекшей арендой снова берется в работу, пока не исчерпаны попытки
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+# Шаблоны итоговых файлов обработки прежних версий (писались в рабочий каталог)
+OUTPUT_PATTERNS = ("*_modified.xlsx", "*_modified.csv")
+
+# Каталоги задач в downloads/: у каждого файла свой, поэтому одинаковые имена
+# выгрузок разных пользователей и пакетной выгрузки не перезаписывают друг друга.
+# Итоговые *_modified.xlsx/csv пишутся в каталог исходного файла.
+JOB_DIR_PREFIX = "job_"
+
+
+class JobRecord:
+    """
+    Задача обработки, сохраненная в базе
+    """
+    def __init__(self, row: sqlite3.Row):
+        self.id: int = row["id"]
+        self.user_id: Optional[int] = row["user_id"]
+        self.chat_id: Optional[int] = row["chat_id"]
+        self.status: str = row["status"]
+        self.input_path: str = row["input_path"]
+        self.params: Dict[str, Any] = json.loads(row["params"] or "{}")
+        self.attempts: int = row["attempts"]
+        self.stage_timings: Dict[str, float] = json.loads(row["stage_timings"] or "{}")
+
+
+class JobStore:
+    """
+    Очередь задач обработки в базе мониторинга (SQLite).
+
+    Процесс бота берет задачу в аренду (lease_owner, lease_until) и продлевает
+    ее, пока задача ждет пул (queued) или считается (running). Если бот
+    перезапустился посреди обработки, аренда истекает и reclaim() возвращает
+    задачу в работу — до max_attempts попыток. Задачи, созданные с
+    resumable=False (анкеты пакетной выгрузки, результат которых собирается
+    в архив), заново не запускаются: reclaim() помечает их как завершенные
+    с ошибкой. Для каждой задачи сохраняется время этапов.
+
+    Ошибки базы не мешают обработке: задача просто не сохраняется.
+    """
+    def __init__(self, database: MonitoringDatabase, lease_seconds: int, max_attempts: int):
+        self.database: MonitoringDatabase = database
+        self.lease_seconds: int = lease_seconds
+        self.max_attempts: int = max_attempts
+        self.owner: str = f"{socket.gethostname()}:{os.getpid()}"
+
+    def create(self, user_id: Optional[int], chat_id: Optional[int], input_path: str,
+               params: Dict[str, Any], resumable: bool = True) -> Optional[int]:
+        """
+        Сохранение новой задачи, сразу взятой в аренду текущим процессом (статус queued)
+
+        Args:
+            user_id: идентификатор пользователя
+            chat_id: чат, куда отправляется результат
+            input_path: путь к исходному файлу
+            params: параметры обработки (аргументы process_data, сериализуемые в JSON)
+            resumable: запускать ли задачу заново, если ее прервал перезапуск бота
+
+        Returns:
+            Идентификатор задачи или None, если база недоступна
+        """
+        now = time.time()
+        try:
+            with self.database.transaction() as conn:
+                cursor = conn.execute(
+                    """
+                    INSERT INTO processing_jobs
+                        (user_id, chat_id, status, input_path, params, attempts,
+                         lease_owner, lease_until, created_at, started_at, resumable)
+                    VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?)
+                    """,
+                    (user_id, chat_id, STATUS_QUEUED, input_path, json.dumps(params, ensure_ascii=False),
+                     self.owner, now + self.lease_seconds, now, None, int(resumable)),
+                )
+        except sqlite3.Error:
+            return None
+        return cursor.lastrowid
+
+    def renew(self, job_id: Optional[int]) -> None:
+        """Продление аренды задачи текущим процессом"""
+        if job_id is None:
+            return
+        self._execute(
+            "UPDATE processing_jobs SET lease_until = ? WHERE id = ? AND lease_owner = ? AND status IN (?, ?)",
+            (time.time() + self.lease_seconds, job_id, self.owner, *ACTIVE_STATUSES),
+        )
+
+    def start(self, job_id: Optional[int]) -> None:
+        """Задача дождалась процесса пула и считается"""
+        if job_id is None:
+            return
+        self._execute(
+            "UPDATE processing_jobs SET status = ?, started_at = ?, lease_until = ? WHERE id = ? AND lease_owner = ?",
+            (STATUS_RUNNING, time.time(), time.time() + self.lease_seconds, job_id, self.owner),
+        )
+
+    def finish(self, job_id: Optional[int], excel_path: str, csv_path: str, stage_timings: Dict[str, float]) -> None:
+        """Задача выполнена: пути к результатам и время этапов"""
+        if job_id is None:
+            return
+        self._execute(
+            """
+            UPDATE processing_jobs
+            SET status = ?, excel_path = ?, csv_path = ?, stage_timings = ?, error = NULL,
+                finished_at = ?, lease_owner = NULL, lease_until = NULL
+            WHERE id = ?
+            """,
+            (STATUS_DONE, excel_path, csv_path, json.dumps(stage_timings), time.time(), job_id),
+        )
+
+    def fail(self, job_id: Optional[int], error: str, stage_timings: Optional[Dict[str, float]] = None) -> None:
+        """Задача завершилась ошибкой (повторно не запускается)"""
+        if job_id is None:
+            return
+        self._execute(
+            """
+            UPDATE processing_jobs
+            SET status = ?, error = ?, stage_timings = ?, finished_at = ?, lease_owner = NULL, lease_until = NULL
+            WHERE id = ?
+            """,
+            (STATUS_FAILED, error, json.dumps(stage_timings or {}), time.time(), job_id),
+        )
+
+    def reclaim(self) -> List[JobRecord]:
+        """
+        Взятие в аренду прерванных задач — в очереди или в работе, но с истекшей арендой
+
+        Задачи, у которых исчерпаны попытки или пропал исходный файл, и
+        задачи, которые нельзя запускать заново (resumable=False), помечаются
+        как завершенные с ошибкой.
+
+        Returns:
+            Задачи, которые текущий процесс должен запустить заново
+        """
+        now = time.time()
+        try:
+            with self.database.transaction() as conn:
+                rows = conn.execute(
+                    """
+                    SELECT * FROM processing_jobs
+                    WHERE status IN (?, ?) AND (lease_until IS NULL OR lease_until < ?)
+                    ORDER BY id
+                    """,
+                    (*ACTIVE_STATUSES, now),
+                ).fetchall()
+
+                reclaimed = []
+                for row in rows:
+                    if not row["resumable"]:
+                        error = "Обработка прервана перезапуском бота"
+                    elif row["attempts"] >= self.max_attempts:
+                        error = "Обработка прерывалась слишком много раз"
+                    elif not os.path.exists(row["input_path"]):
+                        error = "Исходный файл не найден после перезапуска"
+                    else:
+                        error = None
+
+                    if error is not None:
+                        conn.execute(
+                            """
+                            UPDATE processing_jobs
+                            SET status = ?, error = ?, finished_at = ?, lease_owner = NULL, lease_until = NULL
+                            WHERE id = ?
+                            """,
+                            (STATUS_FAILED, error, now, row["id"]),
+                        )
+                        continue
+
+                    conn.execute(
+                        """
+                        UPDATE processing_jobs
+                        SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_until = ?, started_at = NULL
+                        WHERE id = ?
+                        """,
+                        (STATUS_QUEUED, self.owner, now + self.lease_seconds, row["id"]),
+                    )
+                    reclaimed.append(row["id"])
+
+            records = [
+                JobRecord(row)
+                for row in self.database.fetchall(
+                    f"SELECT * FROM processing_jobs WHERE id IN ({', '.join('?' * len(reclaimed))}) ORDER BY id",
+                    reclaimed,
+                )
+            ] if reclaimed else []
+        except sqlite3.Error:
+            return []
+        return records
+
+    def active_paths(self) -> Set[str]:
+        """Исходные файлы задач, которые еще в работе или будут запущены заново"""
+        try:
+            rows = self.database.fetchall(
+                f"SELECT input_path FROM processing_jobs "
+                f"WHERE status IN ({', '.join('?' * len(ACTIVE_STATUSES))}) AND resumable = 1",
+                ACTIVE_STATUSES,
+            )
+        except sqlite3.Error:
+            return set()
+        return {os.path.abspath(row["input_path"]) for row in rows}
+
+    def _execute(self, query: str, params: Iterable[Any]) -> None:
+        try:
+            with self.database.transaction() as conn:
+                conn.execute(query, tuple(params))
+        except sqlite3.Error:
+            return
+
+
+def job_dir() -> str:
+    """Путь к новому каталогу задачи в downloads/ (создается при записи первого файла)"""
+    return os.path.join(config.download_dir, f"{JOB_DIR_PREFIX}{uuid.uuid4().hex}")
+
+
+def _is_job_dir(path: str) -> bool:
+    path = os.path.abspath(path)
+    return (os.path.basename(path).startswith(JOB_DIR_PREFIX)
+            and os.path.dirname(path) == os.path.abspath(config.download_dir))
+
+
+def remove_job_files(paths: Iterable[Optional[str]]) -> None:
+    """Удаление файлов задачи и ее каталога, если в нем больше ничего нет"""
+    directories = set()
+    for path in paths:
+        if not path:
+            continue
+        if os.path.exists(path):
+            os.remove(path)
+        directories.add(os.path.dirname(os.path.abspath(path)))
+    for directory in directories:
+        if _is_job_dir(directory):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+
+def remove_job_dir(directory: str) -> None:
+    """Удаление каталога задачи вместе со всеми файлами (другие каталоги не трогаются)"""
+    if _is_job_dir(directory):
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def cleanup_stale_files(keep: Iterable[str] = (), output_dir: str = ".") -> List[str]:
+    """
+    Удаление файлов, оставшихся от прерванных обработок: каталогов задач
+    downloads/job_* (выгрузка и итоговые *_modified.xlsx/csv), файлов
+    в самом downloads/ и итоговых файлов прежних версий в рабочем каталоге
+
+    Остальные каталоги внутри downloads/ (кэши разбора и результатов) не трогаются.
+
+    Args:
+        keep: файлы, которые нужно сохранить (исходники задач, запускаемых заново);
+            каталоги задач с этими файлами сохраняются целиком
+        output_dir: каталог, куда прежние версии писали итоговые файлы
+
+    Returns:
+        Удаленные файлы и каталоги задач
+    """
+    keep = {os.path.abspath(path) for path in keep}
+    keep_dirs = {os.path.dirname(path) for path in keep}
+
+    candidates, job_dirs = [], []
+    try:
+        for entry in os.scandir(config.download_dir):
+            if entry.is_file():
+                candidates.append(entry.path)
+            elif entry.is_dir() and entry.name.startswith(JOB_DIR_PREFIX):
+                job_dirs.append(entry.path)
+    except OSError:
+        pass
+    for pattern in OUTPUT_PATTERNS:
+        candidates.extend(glob.glob(os.path.join(output_dir, pattern)))
+
+    removed = []
+    for path in candidates:
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        removed.append(path)
+    for directory in job_dirs:
+        if os.path.abspath(directory) in keep_dirs:
+            continue
+        shutil.rmtree(directory, ignore_errors=True)
+        removed.append(directory)
+    return removed
+
+
+job_store = JobStore(config.monitoring_db, config.job_lease_seconds, config.job_max_attempts)
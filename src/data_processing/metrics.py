@@ -0,0 +1,461 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.stats import norm
+
+from .encoding import ColumnEncoding
+
+
+# Показатели, для которых считаются доверительные интервалы
+METRICS = ("nps", "csi", "tr", "roti")
+INTERVAL_METHODS = ("analytic", "bootstrap")
+
+# Размер порции бутстрепа: элементов матрицы «повтор × строка» (ограничивает память)
+BOOTSTRAP_CHUNK_ELEMENTS = 2 ** 21
+# Во сколько раз строк должно быть больше, чем их различных типов, чтобы
+# повторы строились по типам
+BOOTSTRAP_TYPE_RATIO = 4
+
+
+def answer_floats(encoding: ColumnEncoding) -> np.ndarray:
+    """
+    Ответы как числа: каждое уникальное значение приводится к float один раз
+
+    Args:
+        encoding: закодированные ответы вопроса
+
+    Returns:
+        Массив float по строкам ответов, NaN для пропусков и нечисловых ответов
+    """
+    return _lookup(encoding, [_safe_float(key) for key in encoding.keys])
+
+
+def tr_outcomes(encoding: ColumnEncoding) -> np.ndarray:
+    """
+    Ответы вопроса TR: 1 — «да», 0 — «нет», NaN — остальные ответы и пропуски
+    """
+    outcomes = {"да": 1.0, "нет": 0.0}
+    return _lookup(encoding, [outcomes.get(str(key).strip().lower(), np.nan) for key in encoding.keys])
+
+
+def _lookup(encoding: ColumnEncoding, per_key: List[float]) -> np.ndarray:
+    # Последний элемент — для пропусков (код -1)
+    return np.array(per_key + [np.nan], dtype=float)[encoding.codes]
+
+
+def _safe_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+
+class _Batch:
+    """
+    Все группы деления одной длинной таблицей: строки групп подряд и номер группы каждой строки
+    """
+    def __init__(self, values: np.ndarray, weights: np.ndarray, groups: Sequence[Optional[np.ndarray]]):
+        values = np.asarray(values, dtype=float)
+        self.matrix: np.ndarray = values.reshape(len(values), -1)
+        self.weights: np.ndarray = np.asarray(weights)
+        all_rows = np.arange(len(values))
+        group_rows = [all_rows if rows is None else np.asarray(rows, dtype=np.intp) for rows in groups]
+
+        self.group_count: int = len(group_rows)
+        self.question_count: int = self.matrix.shape[1]
+        self.group_rows: List[np.ndarray] = group_rows
+        self.rows: np.ndarray = np.concatenate(group_rows) if group_rows else all_rows[:0]
+        self.group_ids: np.ndarray = np.repeat(np.arange(self.group_count), [len(rows) for rows in group_rows])
+        # Ответы строк групп: строка таблицы — строка группы, столбец — вопрос
+        self.values: np.ndarray = self.matrix[self.rows]
+
+    def totals(self, categories: np.ndarray, size: int) -> np.ndarray:
+        """
+        Суммы весов по (вопрос, группа, категория)
+
+        Веса складываются по порядку строк, как при сложении в цикле, поэтому
+        суммы совпадают до бита. Суммы — числа Python (int для целых весов),
+        пустая категория дает 0.
+
+        Args:
+            categories: номер категории для каждого ответа (строка × вопрос), -1 — не учитывается
+            size: число категорий
+
+        Returns:
+            Массив object формы (вопрос, группа, категория)
+        """
+        question_ids = np.broadcast_to(np.arange(self.question_count), categories.shape)
+        keys = (question_ids * self.group_count + self.group_ids[:, None]) * size + categories
+        weights = np.broadcast_to(self.weights[self.rows][:, None], categories.shape)
+
+        selected = categories >= 0
+        keys, weights = keys[selected], weights[selected]
+        length = self.question_count * self.group_count * size
+
+        sums = np.bincount(keys, weights=weights, minlength=length)
+        if self.weights.dtype.kind in "biu":
+            sums = sums.astype(np.int64)
+        present = np.bincount(keys, minlength=length) > 0
+
+        result = np.zeros(length, dtype=object)
+        for index, value in zip(np.flatnonzero(present).tolist(), sums[present].tolist()):
+            result[index] = value
+        return result.reshape(self.question_count, self.group_count, size)
+
+
+def _nps_categories(batch: _Batch) -> np.ndarray:
+    """Приверженцы (0), нейтралы (1), критики (2); шкала определяется максимумом ответа в группе"""
+    maxima = np.full((batch.group_count, batch.question_count), -np.inf)
+    np.fmax.at(maxima, batch.group_ids, batch.values)
+    ten_point = maxima[batch.group_ids] > 5
+
+    values = batch.values
+    with np.errstate(invalid="ignore"):
+        categories = np.where(
+            ten_point,
+            np.select([values > 8, (values > 6) & (values < 9), values <= 6], [0, 1, 2], -1),
+            np.select([values == 5, values == 4, values < 4], [0, 1, 2], -1),
+        )
+    return categories
+
+
+def _roti_scores(batch: _Batch) -> np.ndarray:
+    """Оценка ROTI (1..5) как номер категории 0..4, -1 для остальных ответов"""
+    with np.errstate(invalid="ignore"):
+        scores = np.rint(batch.values)
+        valid = (scores >= 1) & (scores <= 5)
+    return np.where(valid, np.nan_to_num(scores) - 1, -1).astype(np.intp)
+
+
+def nps_counts(values: np.ndarray, weights: np.ndarray, groups: Sequence[Optional[np.ndarray]]) -> np.ndarray:
+    """
+    Взвешенное число приверженцев, нейтралов и критиков
+
+    Шкала считается 10-балльной, если максимум ответа в группе больше 5
+    (приверженцы 9–10, нейтралы 7–8, критики 0–6), иначе 5-балльной
+    (5, 4 и ниже 4). Нечисловые ответы (NaN) не учитываются.
+
+    Args:
+        values: числовые ответы, одна строка на респондента; несколько вопросов — по столбцам
+        weights: веса респондентов
+        groups: номера строк каждой группы (None — все строки)
+
+    Returns:
+        Массив формы (вопрос, группа, 3)
+    """
+    batch = _Batch(values, weights, groups)
+    return batch.totals(_nps_categories(batch), 3)
+
+
+def tr_counts(outcomes: np.ndarray, weights: np.ndarray, groups: Sequence[Optional[np.ndarray]]) -> np.ndarray:
+    """
+    Взвешенное число достигших и не достигших цели
+
+    Args:
+        outcomes: 1 — «да», 0 — «нет», NaN — не учитывается (см. tr_outcomes)
+        weights: веса респондентов
+        groups: номера строк каждой группы (None — все строки)
+
+    Returns:
+        Массив формы (вопрос, группа, 2)
+    """
+    batch = _Batch(outcomes, weights, groups)
+    categories = np.select([batch.values == 1, batch.values == 0], [0, 1], -1)
+    return batch.totals(categories, 2)
+
+
+def roti_counts(values: np.ndarray, weights: np.ndarray,
+                groups: Sequence[Optional[np.ndarray]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Взвешенное распределение оценок ROTI
+
+    Ответ округляется до целого; учитываются оценки от 1 до 5.
+
+    Args:
+        values: числовые ответы, одна строка на респондента; несколько вопросов — по столбцам
+        weights: веса респондентов
+        groups: номера строк каждой группы (None — все строки)
+
+    Returns:
+        Суммы весов по оценкам (вопрос, группа, 5), сумма весов всех оценок
+        и сумма весов оценок 4–5 (вопрос, группа)
+    """
+    batch = _Batch(values, weights, groups)
+    scores = _roti_scores(batch)
+    valid = np.where(scores >= 0, 0, -1)
+    favourable = np.where(scores >= 3, 0, -1)
+    return (batch.totals(scores, 5),
+            batch.totals(valid, 1)[:, :, 0],
+            batch.totals(favourable, 1)[:, :, 0])
+
+
+def csi_means(values: np.ndarray, weights: np.ndarray, groups: Sequence[Optional[np.ndarray]]) -> np.ndarray:
+    """
+    Средневзвешенная оценка для CSI
+
+    Нечисловые ответы не входят в числитель, а знаменатель — сумма весов
+    всех строк группы (как при расчете по столбцу с пропусками).
+
+    Args:
+        values: числовые ответы, одна строка на респондента; несколько вопросов — по столбцам
+        weights: веса респондентов
+        groups: номера строк каждой группы (None — все строки)
+
+    Returns:
+        Массив формы (вопрос, группа), 0.0 для группы с нулевым весом
+    """
+    batch = _Batch(values, weights, groups)
+    numerator, denominator = _csi_parts(batch)
+    row_weights = batch.weights[batch.rows].astype(float)[:, None]
+    weighted = _group_sums(batch, numerator * row_weights)
+    total = _group_sums(batch, denominator * row_weights)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total == 0, 0.0, weighted / total)
+
+
+def _group_sums(batch: _Batch, values: np.ndarray) -> np.ndarray:
+    """Суммы по группам для каждого вопроса, форма (вопрос, группа)"""
+    question_ids = np.broadcast_to(np.arange(batch.question_count), values.shape)
+    keys = question_ids * batch.group_count + batch.group_ids[:, None]
+    sums = np.bincount(keys.ravel(), weights=values.ravel(), minlength=batch.question_count * batch.group_count)
+    return sums.reshape(batch.question_count, batch.group_count)
+
+
+def _csi_parts(batch: _Batch) -> Tuple[np.ndarray, np.ndarray]:
+    values = batch.values
+    return np.nan_to_num(values, nan=0.0), np.ones_like(values)
+
+
+def _nps_parts(batch: _Batch) -> Tuple[np.ndarray, np.ndarray]:
+    categories = _nps_categories(batch)
+    return (np.select([categories == 0, categories == 2], [1.0, -1.0], 0.0),
+            (categories >= 0).astype(float))
+
+
+def _tr_parts(batch: _Batch) -> Tuple[np.ndarray, np.ndarray]:
+    values = batch.values
+    return (values == 1).astype(float), ~np.isnan(values) * 1.0
+
+
+def _roti_parts(batch: _Batch) -> Tuple[np.ndarray, np.ndarray]:
+    scores = _roti_scores(batch)
+    return (scores >= 3).astype(float), (scores >= 0).astype(float)
+
+
+# Каждый показатель — отношение взвешенных сумм: sum(w * a) / sum(w * b)
+_RATIO_PARTS = {
+    "nps": _nps_parts,
+    "csi": _csi_parts,
+    "tr": _tr_parts,
+    "roti": _roti_parts,
+}
+
+
+def _weighted_parts(metric: str, batch: _Batch) -> Tuple[np.ndarray, np.ndarray]:
+    """Взвешенные слагаемые числителя и знаменателя показателя для каждой строки групп"""
+    if metric not in _RATIO_PARTS:
+        raise ValueError(f"Неизвестный показатель: {metric}")
+    numerator, denominator = _RATIO_PARTS[metric](batch)
+    row_weights = batch.weights[batch.rows].astype(float)[:, None]
+    return numerator * row_weights, denominator * row_weights
+
+
+def metric_intervals(
+        metric: str,
+        values: np.ndarray,
+        weights: np.ndarray,
+        groups: Sequence[Optional[np.ndarray]],
+        method: str = "analytic",
+        level: float = 0.95,
+        n_boot: int = 1000,
+        seed: Optional[int] = None,
+        workers: int = 1
+    ) -> np.ndarray:
+    """
+    Доверительные интервалы показателя
+
+    NPS — доля приверженцев минус доля критиков, TR — доля достигших цели,
+    ROTI — доля оценок 4–5, CSI — средняя оценка. Все они считаются как
+    отношение взвешенных сумм, поэтому "analytic" — линеаризованная
+    дисперсия отношения, а "bootstrap" — перцентильный интервал по
+    повторным выборкам строк группы с возвращением (веса сохраняются).
+
+    Args:
+        metric: "nps", "csi", "tr" или "roti"
+        values: числовые ответы (для TR — tr_outcomes), несколько вопросов — по столбцам
+        weights: веса респондентов
+        groups: номера строк каждой группы (None — все строки)
+        method: "analytic" или "bootstrap"
+        level: уровень доверия
+        n_boot: число повторов бутстрепа
+        seed: зерно генератора случайных чисел для бутстрепа
+        workers: число процессов для бутстрепа
+
+    Returns:
+        Массив формы (вопрос, группа, 2): нижняя и верхняя граница, NaN — если
+        интервал не определен (нет ответов)
+    """
+    if method not in INTERVAL_METHODS:
+        raise ValueError(f"Неизвестный метод доверительного интервала: {method}")
+
+    if method == "bootstrap":
+        replicates = ratio_replicates(metric, values, weights, groups, n_boot, seed, workers)
+        return np.stack([percentile_interval(group_replicates, level) for group_replicates in replicates], axis=1)
+
+    batch = _Batch(values, weights, groups)
+    weighted_numerator, weighted_denominator = _weighted_parts(metric, batch)
+    intervals = np.full((batch.question_count, batch.group_count, 2), np.nan)
+    for group_index in range(batch.group_count):
+        in_group = batch.group_ids == group_index
+        intervals[:, group_index] = _analytic_interval(
+            weighted_numerator[in_group], weighted_denominator[in_group], level)
+
+    return intervals
+
+
+def _analytic_interval(a: np.ndarray, b: np.ndarray, level: float) -> np.ndarray:
+    """Интервал по линеаризованной дисперсии отношения sum(a) / sum(b)"""
+    count = len(a)
+    total = b.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = a.sum(axis=0) / total
+        residuals = a - ratio * b
+        variance = (residuals ** 2).sum(axis=0) / total ** 2 * count / (count - 1) if count > 1 else np.nan
+    half_width = norm.ppf(0.5 + level / 2) * np.sqrt(variance)
+    interval = np.stack([ratio - half_width, ratio + half_width], axis=-1)
+    interval[~(total > 0)] = np.nan
+    return interval
+
+
+def ratio_replicates(
+        metric: str,
+        values: np.ndarray,
+        weights: np.ndarray,
+        groups: Sequence[Optional[np.ndarray]],
+        n_boot: int = 1000,
+        seed: Optional[int] = None,
+        workers: int = 1
+    ) -> List[np.ndarray]:
+    """
+    Значения показателя на повторных выборках (взвешенный бутстреп)
+
+    Повторы каждой группы делятся на порции; у каждой порции свое зерно,
+    выведенное из seed, поэтому результат не зависит от числа процессов.
+    При workers > 1 порции всех групп считаются в пуле процессов.
+
+    Args:
+        metric: "nps", "csi", "tr" или "roti"
+        values: числовые ответы (для TR — tr_outcomes), несколько вопросов — по столбцам
+        weights: веса респондентов
+        groups: номера строк каждой группы (None — все строки)
+        n_boot: число повторов
+        seed: зерно генератора случайных чисел
+        workers: число процессов
+
+    Returns:
+        Для каждой группы — массив формы (повтор, вопрос); NaN, если в повторе нет ответов
+    """
+    batch = _Batch(values, weights, groups)
+    weighted_numerator, weighted_denominator = _weighted_parts(metric, batch)
+
+    tasks, owners = [], []
+    group_seeds = np.random.SeedSequence(seed).spawn(batch.group_count)
+    for group_index, group_seed in enumerate(group_seeds):
+        in_group = batch.group_ids == group_index
+        a, b = weighted_numerator[in_group], weighted_denominator[in_group]
+        frequencies = None
+        if len(a):
+            # Одинаковые строки (ответ и вес) объединяются в типы: выбор строк
+            # с возвращением равносилен полиномиальному распределению по типам
+            types, frequencies = np.unique(np.hstack([a, b]), axis=0, return_counts=True)
+            if len(types) * BOOTSTRAP_TYPE_RATIO <= len(a):
+                a, b = types[:, :a.shape[1]], types[:, a.shape[1]:]
+            else:
+                frequencies = None
+        # Порция ограничена числом элементов матрицы «повтор × строка»
+        chunk = max(1, BOOTSTRAP_CHUNK_ELEMENTS // max(len(a), 1))
+        sizes = [min(chunk, n_boot - start) for start in range(0, n_boot, chunk)]
+        for size, chunk_seed in zip(sizes, group_seed.spawn(len(sizes))):
+            tasks.append((a, b, size, chunk_seed, frequencies))
+            owners.append(group_index)
+
+    if workers > 1 and len(tasks) > 1:
+        chunks = list(_bootstrap_pool(workers).map(_bootstrap_chunk, *zip(*tasks)))
+    else:
+        chunks = [_bootstrap_chunk(*task) for task in tasks]
+
+    replicates = [[] for _ in range(batch.group_count)]
+    for group_index, chunk_replicates in zip(owners, chunks):
+        replicates[group_index].append(chunk_replicates)
+    return [
+        np.concatenate(parts) if parts else np.empty((0, batch.question_count))
+        for parts in replicates
+    ]
+
+
+def _bootstrap_chunk(
+        a: np.ndarray,
+        b: np.ndarray,
+        size: int,
+        seed: np.random.SeedSequence,
+        frequencies: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+    """
+    Порция повторов бутстрепа: отношение sum(a) / sum(b) считается умножением
+    матрицы кратностей строк на a и b. Кратности — либо число выборов каждой
+    строки, либо (если заданы frequencies) полиномиальные числа строк каждого типа
+    """
+    count = len(a)
+    if count == 0:
+        return np.full((size, a.shape[1]), np.nan)
+
+    rng = np.random.default_rng(seed)
+    if frequencies is not None:
+        total = int(frequencies.sum())
+        multiplicity = rng.multinomial(total, frequencies / total, size=size).astype(float)
+    else:
+        draws = rng.integers(0, count, size=(size, count), dtype=np.int32)
+        draws += (np.arange(size, dtype=np.int32) * count)[:, None]
+        multiplicity = np.bincount(draws.ravel(), minlength=size * count).reshape(size, count).astype(float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = (multiplicity @ a) / (multiplicity @ b)
+    ratios[~np.isfinite(ratios)] = np.nan
+    return ratios
+
+
+def percentile_interval(replicates: np.ndarray, level: float) -> np.ndarray:
+    """
+    Перцентильный интервал по повторам бутстрепа
+
+    Args:
+        replicates: массив формы (повтор, ...)
+        level: уровень доверия
+
+    Returns:
+        Массив формы (..., 2), NaN — если нет ни одного определенного повтора
+    """
+    tail = (1 - level) / 2
+    replicates = np.asarray(replicates, dtype=float)
+    interval = np.full(replicates.shape[1:] + (2,), np.nan)
+    defined = ~np.all(np.isnan(replicates), axis=0) if len(replicates) else np.zeros(replicates.shape[1:], dtype=bool)
+    if defined.any():
+        interval[defined] = np.nanquantile(replicates[:, defined], [tail, 1 - tail], axis=0).T
+    return interval
+
+
+_pools: Dict[int, ProcessPoolExecutor] = {}
+
+
+def _bootstrap_pool(workers: int) -> ProcessPoolExecutor:
+    """Пул процессов для бутстрепа: создается один раз и переиспользуется между отчетами"""
+    pool = _pools.get(workers)
+    if pool is None:
+        pool = _pools[workers] = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return pool
@@ -1,37 +1,141 @@
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, TYPE_CHECKING
+import numpy as np
 import pandas as pd
-from copy import deepcopy
+
+from .encoding import ColumnEncoding
+from .report_writer import ReportWriter, renumber_questions, write_csv
+from config.config import config
+
+if TYPE_CHECKING:
+    from .question_types import QuestionType
+
+
+# Столбцы доверительного интервала в листах NPS и CSI
+CI_LOWER_COLUMN = "Нижняя граница ДИ"
+CI_UPPER_COLUMN = "Верхняя граница ДИ"
+
+
+class ColumnStore:
+    """
+    Общее хранилище столбцов выгрузки.
+
+    Для каждого вопроса хранится один массив NumPy (две строки заголовка и
+    ответы) — представление столбца исходной таблицы без копирования.
+    Массивы доступны только для чтения: изменения делаются через
+    Question.replace_column и не затрагивают хранилище.
+    """
+    __slots__ = ("_columns", "digest")
+
+    def __init__(self, columns: List[np.ndarray], digest: Optional[str] = None):
+        """
+        Args:
+            columns: столбцы выгрузки
+            digest: хеш файла выгрузки (None — неизвестен, результаты не кэшируются)
+        """
+        self._columns: List[np.ndarray] = [_read_only(column) for column in columns]
+        self.digest: Optional[str] = digest
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, digest: Optional[str] = None) -> 'ColumnStore':
+        """Хранилище из столбцов DataFrame (массивы — представления его блоков)"""
+        return cls([df.iloc[:, index].to_numpy() for index in range(df.shape[1])], digest)
+
+    def __len__(self) -> int:
+        return len(self._columns)
+
+    def column(self, index: int) -> np.ndarray:
+        return self._columns[index]
+
+
+def _read_only(values: np.ndarray) -> np.ndarray:
+    """Представление массива, запрещающее запись"""
+    view = np.asarray(values).view()
+    view.flags.writeable = False
+    return view
 
 
 class Question:
     """
     Класс для представления вопроса и его данных из анкеты
+
+    Ответы не копируются: вопрос ссылается на столбец общего ColumnStore.
+    Первые две строки выгрузки (подзаголовки: строка матрицы, шкала и т.п.)
+    вынесены в поле header, ответы респондентов доступны через values.
     """
-    def __init__(self, name: str, type_q: str, data: pd.Series, id: str):
+    __slots__ = ("name", "type", "id", "header", "_store", "_index", "_column", "_encoding")
+
+    # Число строк подзаголовка над ответами в выгрузке
+    HEADER_ROWS = 2
+
+    def __init__(self, name: str, type_q: "QuestionType", store: ColumnStore, index: int, id: str):
         """
         Инициализация вопроса
         
         Args:
             name: название вопроса
             type_q: тип вопроса
-            data: данные вопроса
+            store: общее хранилище столбцов
+            index: номер столбца вопроса в хранилище
             id: идентификатор вопроса
         """
         self.name: str = name
-        self.type: str = type_q
-        self.data: pd.Series = data
+        self.type: "QuestionType" = type_q
         self.id: str = id
+        self._store: ColumnStore = store
+        self._index: int = index
+        # Собственный столбец появляется только после replace_column
+        self._column: Optional[np.ndarray] = None
+        self._encoding: Optional[ColumnEncoding] = None
+        self.header: Tuple[Any, ...] = tuple(self.column[:self.HEADER_ROWS])
+
+    @property
+    def column(self) -> np.ndarray:
+        """Весь столбец вопроса: строки подзаголовка и ответы (только для чтения)"""
+        return self._store.column(self._index) if self._column is None else self._column
+
+    @property
+    def digest(self) -> Optional[str]:
+        """Хеш файла выгрузки, из которой взят вопрос"""
+        return self._store.digest
+
+    @property
+    def values(self) -> np.ndarray:
+        """Ответы респондентов без строк подзаголовка"""
+        return self.column[self.HEADER_ROWS:]
+
+    @property
+    def encoding(self) -> ColumnEncoding:
+        """
+        Закодированные ответы: коды, целочисленные значения и маска мусорных слов.
+        Считаются один раз при первом обращении (с текущим config.trash_list)
+        """
+        if self._encoding is None:
+            self._encoding = ColumnEncoding(self.values, config.trash_list)
+        return self._encoding
+
+    def __len__(self) -> int:
+        return len(self.column)
+
+    def replace_column(self, column: Any) -> None:
+        """
+        Замена столбца вопроса (копирование при записи): общее хранилище
+        и копии вопроса, сделанные раньше, не меняются
+
+        Args:
+            column: новые значения всего столбца, включая строки подзаголовка
+        """
+        self._column = _read_only(column)
+        self._encoding = None
+        self.header = tuple(self._column[:self.HEADER_ROWS])
 
     def copy(self) -> 'Question':
         """
-        Создает полную копию объекта Question.
+        Копия вопроса; данные общие до replace_column у одной из копий
         """
-        return Question(
-            name=self.name,
-            type_q=self.type,
-            data=deepcopy(self.data),
-            id=self.id
-        )
+        question = Question.__new__(Question)
+        for slot in Question.__slots__:
+            setattr(question, slot, getattr(self, slot))
+        return question
 
 class AnalysisError(Exception):
     """
@@ -40,6 +144,73 @@ class AnalysisError(Exception):
     pass
 
 
+def _interval_bounds(row: pd.Series, scale: float) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Доверительный интервал строки итога NPS или CSI
+
+    Args:
+        row: строка итога
+        scale: множитель границ (100 — доли в проценты)
+
+    Returns:
+        Нижняя и верхняя граница или (None, None), если интервал не посчитан
+    """
+    low, high = row.get(CI_LOWER_COLUMN), row.get(CI_UPPER_COLUMN)
+    if not isinstance(low, (int, float)) or not isinstance(high, (int, float)):
+        return None, None
+    if pd.isna(low) or pd.isna(high):
+        return None, None
+    return float(low) * scale, float(high) * scale
+
+
+def _interval_text(metric: Dict[str, Any], percent: bool) -> str:
+    """
+    Доверительный интервал показателя для сводки
+
+    Args:
+        metric: показатель из key_metrics
+        percent: границы в процентах (NPS)
+
+    Returns:
+        Текст вида " (ДИ 95%: 10.0–20.0%)" или пустая строка, если интервала нет
+    """
+    low, high = metric["ci_lower"], metric["ci_upper"]
+    if low is None or high is None:
+        return ""
+
+    level = f"{config.confidence_level * 100:g}"
+    if percent:
+        return f" (ДИ {level}%: {low:.1f}–{high:.1f}%)"
+    return f" (ДИ {level}%: {low:.2f}–{high:.2f})"
+
+
+def _metric(name: str, value: Any, row: pd.Series, scale: float = 1.0, question: Any = None,
+            group: Any = None, interval: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Показатель из строки итога (None, если значение не число)
+
+    Args:
+        name: NPS, TR, ROTI или CSI
+        value: значение из строки итога
+        row: строка итога (для доверительного интервала)
+        scale: множитель значения (100 — доли в проценты)
+        question: номер вопроса (если показателей несколько)
+        group: значение разделителя (при делении)
+        interval: брать ли доверительный интервал
+    """
+    if not isinstance(value, (int, float)):
+        return None
+    low, high = _interval_bounds(row, scale) if interval else (None, None)
+    return {
+        "metric": name,
+        "question": None if question is None else f"{question}",
+        "group": None if group is None else f"{group}",
+        "value": float(value) * scale,
+        "ci_lower": low,
+        "ci_upper": high,
+    }
+
+
 class AnalysisResult:
     """
     Результаты анализа анкеты
@@ -57,12 +228,34 @@ class AnalysisResult:
         """Проверка наличия данных в результате анализа"""
         return len(self.data_frames) > 0
     
-    def build_summary(self) -> str:
+    def main_frame(self, renumber: bool = True) -> pd.DataFrame:
         """
-        Формирует краткую текстовую сводку по основным показателям (NPS, CSI, TR, ROTI),
-        с учетом возможного деления (колонки 'Разделитель').
+        Основной лист отчета: все распределения одним DataFrame
+
+        Args:
+            renumber: перенумеровать вопросы подряд (D1_1, D1_2, ...)
+
+        Returns:
+            Объединенный DataFrame
         """
-        lines: List[str] = []
+        final_frame = pd.concat(self.data_frames, ignore_index=True)
+        if renumber:
+            final_frame.iloc[:, 0] = renumber_questions(final_frame.iloc[:, 0].tolist())
+        return final_frame
+
+    def key_metrics(self) -> List[Dict[str, Any]]:
+        """
+        Основные показатели отчета (NPS, TR, ROTI, CSI) — для сводки и истории отчетов
+
+        NPS и TR — в процентах, CSI — в процентах (как в листе CSI), ROTI — средний балл.
+        При делении показатель считается для каждого значения разделителя,
+        при нескольких вопросах NPS — для каждого вопроса.
+
+        Returns:
+            Список словарей: metric, question, group, value, ci_lower, ci_upper
+            (отсутствующие question/group/границы интервала — None)
+        """
+        metrics: List[Optional[Dict[str, Any]]] = []
 
         # NPS
         if not self.nps_frame.empty:
@@ -76,32 +269,22 @@ class AnalysisResult:
                     if "Номер вопроса" in group.columns:
                         for qid, q_group in group.groupby("Номер вопроса"):
                             last_row = q_group.iloc[-1]
-                            value = last_row.get("Процент")
-                            if isinstance(value, (int, float)):
-                                percent = round(float(value) * 100, 1)
-                                lines.append(f"NPS {qid} {divider}: {percent:.1f}%")
+                            metrics.append(_metric("NPS", last_row.get("Процент"), last_row, 100,
+                                                   question=qid, group=divider, interval=True))
                     else:
                         last_row = group.iloc[-1]
-                        value = last_row.get("Процент")
-                        if isinstance(value, (int, float)):
-                            percent = round(float(value) * 100, 1)
-                            lines.append(f"NPS {divider}: {percent:.1f}%")
+                        metrics.append(_metric("NPS", last_row.get("Процент"), last_row, 100,
+                                               group=divider, interval=True))
             else:
                 # Если есть несколько NPS-вопросов без деления — выводим каждый
                 if "Номер вопроса" in df.columns:
                     for _, group in df.groupby("Номер вопроса"):
                         last_row = group.iloc[-1]
-                        value = last_row.get("Процент")
-                        if isinstance(value, (int, float)):
-                            percent = round(float(value) * 100, 1)
-                            qid = last_row.get("Номер вопроса")
-                            lines.append(f"NPS {qid}: {percent:.1f}%")
+                        metrics.append(_metric("NPS", last_row.get("Процент"), last_row, 100,
+                                               question=last_row.get("Номер вопроса"), interval=True))
                 else:
                     last_row = df.iloc[-1]
-                    value = last_row.get("Процент")
-                    if isinstance(value, (int, float)):
-                        percent = round(float(value) * 100, 1)
-                        lines.append(f"NPS: {percent:.1f}%")
+                    metrics.append(_metric("NPS", last_row.get("Процент"), last_row, 100, interval=True))
 
         # TR
         if not self.tr_frame.empty:
@@ -112,18 +295,12 @@ class AnalysisResult:
                     if row.empty:
                         continue
                     row = row.iloc[0]
-                    value = row.get("Процент")
-                    if isinstance(value, (int, float)):
-                        percent = round(float(value) * 100, 1)
-                        lines.append(f"TR {divider}: {percent:.1f}%")
+                    metrics.append(_metric("TR", row.get("Процент"), row, 100, group=divider))
             else:
                 row = df[df.get("Категория") == "TR (%)"]
                 if not row.empty:
                     row = row.iloc[0]
-                    value = row.get("Процент")
-                    if isinstance(value, (int, float)):
-                        percent = round(float(value) * 100, 1)
-                        lines.append(f"TR: {percent:.1f}%")
+                    metrics.append(_metric("TR", row.get("Процент"), row, 100))
 
         # ROTI
         if not self.roti_frame.empty:
@@ -134,16 +311,12 @@ class AnalysisResult:
                     if row.empty:
                         continue
                     row = row.iloc[0]
-                    value = row.get("Процент")
-                    if isinstance(value, (int, float)):
-                        lines.append(f"ROTI {divider}: {float(value):.2f}")
+                    metrics.append(_metric("ROTI", row.get("Процент"), row, group=divider))
             else:
                 row = df[df.get("Оценка") == "Среднее ROTI"]
                 if not row.empty:
                     row = row.iloc[0]
-                    value = row.get("Процент")
-                    if isinstance(value, (int, float)):
-                        lines.append(f"ROTI: {float(value):.2f}")
+                    metrics.append(_metric("ROTI", row.get("Процент"), row))
 
         # CSI
         if not self.csi_frame.empty:
@@ -154,16 +327,34 @@ class AnalysisResult:
                     if row.empty:
                         continue
                     row = row.iloc[0]
-                    value = row.get("CSI по параметру")
-                    if isinstance(value, (int, float)):
-                        lines.append(f"CSI {divider}: {float(value):.2f}%")
+                    metrics.append(_metric("CSI", row.get("CSI по параметру"), row, group=divider, interval=True))
             else:
                 row = df[df.get("Параметр") == "Итого:"]
                 if not row.empty:
                     row = row.iloc[0]
-                    value = row.get("CSI по параметру")
-                    if isinstance(value, (int, float)):
-                        lines.append(f"CSI: {float(value):.2f}%")
+                    metrics.append(_metric("CSI", row.get("CSI по параметру"), row, interval=True))
+
+        return [metric for metric in metrics if metric is not None]
+
+    def build_summary(self) -> str:
+        """
+        Формирует краткую текстовую сводку по основным показателям (NPS, CSI, TR, ROTI),
+        с учетом возможного деления (колонки 'Разделитель').
+        Для NPS и CSI добавляется доверительный интервал, если он посчитан.
+        """
+        lines: List[str] = []
+        for metric in self.key_metrics():
+            label = " ".join(part for part in (metric["metric"], metric["question"], metric["group"])
+                             if part is not None)
+            value = metric["value"]
+            if metric["metric"] == "NPS":
+                lines.append(f"{label}: {round(value, 1):.1f}%{_interval_text(metric, True)}")
+            elif metric["metric"] == "TR":
+                lines.append(f"{label}: {round(value, 1):.1f}%")
+            elif metric["metric"] == "ROTI":
+                lines.append(f"{label}: {value:.2f}")
+            else:
+                lines.append(f"{label}: {value:.2f}%{_interval_text(metric, False)}")
 
         return "\n".join(lines)
         
@@ -174,104 +365,53 @@ class AnalysisResult:
         Args:
             excel_path: путь к файлу Excel
         """
+        self._write_excel(excel_path, renumber=True)
+
+    def _write_excel(self, excel_path: str, renumber: bool) -> None:
+        """
+        Запись всех листов отчета за одно сохранение файла
+
+        Args:
+            excel_path: путь к файлу Excel
+            renumber: перенумеровать вопросы основного листа подряд (D1_1, D1_2, ...)
+        """
+        writer = ReportWriter(excel_path)
+
         if not self.has_data():
-            # Создаем пустой DataFrame если нет данных
-            pd.DataFrame().to_excel(excel_path, index=False)
+            # Пустая книга, если нет данных
+            writer.save()
             return
-            
-        # Объединяем все DataFrame в один
-        final_frame = pd.concat(self.data_frames, ignore_index=True)
-        final_frame.to_excel(excel_path, index=False)
-        
-        # Добавляем дополнительные листы если есть данные
-        with pd.ExcelWriter(excel_path, engine='openpyxl', mode='a') as writer:
-            # Форматируем проценты в основном листе
-            workbook = writer.book
-            worksheet = workbook['Sheet1']
-            
-            # Обновляем номера в первом столбце
-            new_num = 1
-            if worksheet.max_row > 1:
-                previous_num = int(worksheet['A2'].value.split("_")[1])
-                
-                for i in range(2, worksheet.max_row + 1):
-                    current_cell = worksheet[f'A{i}']
-                    current_num = int(current_cell.value.split("_")[1])
-                    if previous_num == current_num:
-                        current_cell.value = f"D1_{new_num}"
-                    else:
-                        previous_num = current_num
-                        new_num += 1
-                        current_cell.value = f"D1_{new_num}"
-            
-            # Форматируем проценты
-            for cell in worksheet['F']:
-                if cell.row > 1:
-                    if cell.value is not None and isinstance(cell.value, (int, float)):
-                        cell.number_format = '0%'
-        
-        # Добавляем NPS если есть
-        if not self.nps_frame.empty:
-            with pd.ExcelWriter(excel_path, engine='openpyxl', mode='a') as writer:
-                self.nps_frame.to_excel(writer, sheet_name='NPS', index=False)
-                
-                # Форматируем проценты
-                workbook = writer.book
-                worksheet = workbook['NPS']
-                for cell in worksheet['C']:
-                    if cell.row > 1:
-                        if cell.value is not None and isinstance(cell.value, (int, float)):
-                            cell.number_format = '0.00%'
-        
-        # Добавляем TR если есть
-        if not self.tr_frame.empty:
-            with pd.ExcelWriter(excel_path, engine='openpyxl', mode='a') as writer:
-                self.tr_frame.to_excel(writer, sheet_name='TR', index=False)
 
-                workbook = writer.book
-                worksheet = workbook['TR']
-                for cell in worksheet['C']:  # колонка "Процент"
-                    if cell.row > 1:
-                        if cell.value is not None and isinstance(cell.value, (int, float)):
-                            cell.number_format = '0.00%'
+        # Проценты в основном листе (столбец F)
+        writer.add_sheet('Sheet1', self.main_frame(renumber), {5: '0%'})
 
-        # Добавляем ROTI если есть
+        # Проценты в столбце C дополнительных листов (в NPS — и границы интервала в D и E)
+        if not self.nps_frame.empty:
+            writer.add_sheet('NPS', self.nps_frame, {2: '0.00%', 3: '0.00%', 4: '0.00%'})
+        if not self.tr_frame.empty:
+            writer.add_sheet('TR', self.tr_frame, {2: '0.00%'})
         if not self.roti_frame.empty:
-            with pd.ExcelWriter(excel_path, engine='openpyxl', mode='a') as writer:
-                self.roti_frame.to_excel(writer, sheet_name='ROTI', index=False)
-                workbook = writer.book
-                worksheet = workbook['ROTI']
-                for cell in worksheet['C']:  # колонка "Процент"
-                        if cell.row > 1:
-                            if cell.value is not None and isinstance(cell.value, (int, float)):
-                                # Только для строк с оценками от 1 до 5 — не форматируем строку со средним значением
-                                if not isinstance(cell.value, str):
-                                    cell.number_format = '0.00%'
-
-        # Добавляем CSI если есть
+            writer.add_sheet('ROTI', self.roti_frame, {2: '0.00%'})
         if not self.csi_frame.empty:
-            with pd.ExcelWriter(excel_path, engine='openpyxl', mode='a') as writer:
-                self.csi_frame.to_excel(writer, sheet_name='CSI', index=False)
-        
-        # Добавляем свободные ответы если есть
+            writer.add_sheet('CSI', self.csi_frame)
         if not self.free_answers_frame.empty:
-            with pd.ExcelWriter(excel_path, engine='openpyxl', mode='a') as writer:
-                self.free_answers_frame.to_excel(writer, sheet_name='Открытые комментарии', index=False)
+            writer.add_sheet('Открытые комментарии', self.free_answers_frame)
+
+        writer.save()
     
-    def to_csv(self, csv_path: str) -> None:
+    def to_csv(self, csv_path: str, renumber: bool = True) -> None:
         """
         Сохранение основных результатов в CSV файл
         
         Args:
             csv_path: путь к файлу CSV
+            renumber: перенумеровать вопросы так же, как в to_excel (без деления)
         """
         if not self.has_data():
             pd.DataFrame().to_csv(csv_path, index=False, encoding='utf-8')
             return
-            
-        # Читаем данные из Excel и сохраняем в CSV
-        df = pd.read_excel(csv_path.replace('.csv', '.xlsx'), engine="openpyxl")
-        df.to_csv(csv_path, index=False, encoding='utf-8')
+
+        write_csv(csv_path, self.main_frame(renumber))
 
     def to_excel_division(self, excel_path: str) -> None:
         """
@@ -280,71 +420,4 @@ class AnalysisResult:
         Args:
             excel_path: путь к файлу Excel
         """
-        if not self.has_data():
-            # Создаем пустой DataFrame если нет данных
-            pd.DataFrame().to_excel(excel_path, index=False)
-            return
-
-        # Объединяем все DataFrame в один
-        final_frame = pd.concat(self.data_frames, ignore_index=True)
-        final_frame.to_excel(excel_path, index=False)
-
-        # Добавляем дополнительные листы если есть данные
-        with pd.ExcelWriter(excel_path, engine='openpyxl', mode='a') as writer:
-            # Форматируем проценты в основном листе
-            workbook = writer.book
-            worksheet = workbook['Sheet1']
-
-            # Форматируем проценты
-            for cell in worksheet['F']:
-                if cell.row > 1:
-                    if cell.value is not None and isinstance(cell.value, (int, float)):
-                        cell.number_format = '0%'
-
-        # Добавляем NPS если есть
-        if not self.nps_frame.empty:
-            with pd.ExcelWriter(excel_path, engine='openpyxl', mode='a') as writer:
-                self.nps_frame.to_excel(writer, sheet_name='NPS', index=False)
-
-                # Форматируем проценты
-                workbook = writer.book
-                worksheet = workbook['NPS']
-                for cell in worksheet['C']:
-                    if cell.row > 1:
-                        if cell.value is not None and isinstance(cell.value, (int, float)):
-                            cell.number_format = '0.00%'
-
-        # Добавляем TR если есть
-        if not self.tr_frame.empty:
-            with pd.ExcelWriter(excel_path, engine='openpyxl', mode='a') as writer:
-                self.tr_frame.to_excel(writer, sheet_name='TR', index=False)
-
-                workbook = writer.book
-                worksheet = workbook['TR']
-                for cell in worksheet['C']:  # колонка "Процент"
-                    if cell.row > 1:
-                        if cell.value is not None and isinstance(cell.value, (int, float)):
-                            cell.number_format = '0.00%'
-
-        # Добавляем ROTI если есть
-        if not self.roti_frame.empty:
-            with pd.ExcelWriter(excel_path, engine='openpyxl', mode='a') as writer:
-                self.roti_frame.to_excel(writer, sheet_name='ROTI', index=False)
-                workbook = writer.book
-                worksheet = workbook['ROTI']
-                for cell in worksheet['C']:  # колонка "Процент"
-                        if cell.row > 1:
-                            if cell.value is not None and isinstance(cell.value, (int, float)):
-                                # Только для строк с оценками от 1 до 5 — не форматируем строку со средним значением
-                                if not isinstance(cell.value, str):
-                                    cell.number_format = '0.00%'
-
-        # Добавляем CSI если есть
-        if not self.csi_frame.empty:
-            with pd.ExcelWriter(excel_path, engine='openpyxl', mode='a') as writer:
-                self.csi_frame.to_excel(writer, sheet_name='CSI', index=False)
-
-        # Добавляем свободные ответы если есть
-        if not self.free_answers_frame.empty:
-            with pd.ExcelWriter(excel_path, engine='openpyxl', mode='a') as writer:
-                self.free_answers_frame.to_excel(writer, sheet_name='Открытые комментарии', index=False)
+        self._write_excel(excel_path, renumber=False)
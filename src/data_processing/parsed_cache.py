@@ -0,0 +1,238 @@
+import datetime
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .models import ColumnStore, Question
+from .question_types import QuestionType
+from config.config import config
+
+
+# Версия формата: меняется вместе с логикой разбора выгрузки, старые записи не читаются
+CACHE_VERSION = 1
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path: str) -> str:
+    """
+    SHA-256 содержимого файла
+
+    Args:
+        path: путь к файлу
+
+    Returns:
+        Шестнадцатеричный хеш
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _encode_value(value: Any) -> Optional[Tuple[str, Any]]:
+    """
+    Значение ячейки в виде (тип, значение), пригодном для JSON
+
+    Returns:
+        None для пропуска (NaN)
+    """
+    if value is None:
+        return ("n", None)
+    if isinstance(value, bool):
+        return ("b", value)
+    if isinstance(value, int):
+        return ("i", value)
+    if isinstance(value, float):
+        return None if np.isnan(value) else ("f", value)
+    if isinstance(value, str):
+        return ("s", value)
+    if isinstance(value, datetime.datetime):
+        return ("dt", value.isoformat())
+    if isinstance(value, datetime.date):
+        return ("d", value.isoformat())
+    if isinstance(value, datetime.time):
+        return ("t", value.isoformat())
+    if isinstance(value, datetime.timedelta):
+        return ("td", [value.days, value.seconds, value.microseconds])
+    raise TypeError(f"Неподдерживаемый тип значения: {type(value).__name__}")
+
+
+def _decode_value(tag: str, payload: Any) -> Any:
+    if tag == "dt":
+        return datetime.datetime.fromisoformat(payload)
+    if tag == "d":
+        return datetime.date.fromisoformat(payload)
+    if tag == "t":
+        return datetime.time.fromisoformat(payload)
+    if tag == "td":
+        return datetime.timedelta(days=payload[0], seconds=payload[1], microseconds=payload[2])
+    return payload
+
+
+def _encode_column(values: np.ndarray) -> Tuple[Dict[str, Any], np.ndarray]:
+    """
+    Столбец вопроса в виде массива: числовые как есть, остальные — коды словаря значений
+    """
+    if values.dtype.kind in "biuf":
+        return {"kind": "numeric"}, values
+
+    lookup: Dict[Tuple[str, Any], int] = {}
+    codes = np.empty(len(values), dtype=np.int32)
+    for index, value in enumerate(values.tolist()):
+        token = _encode_value(value)
+        if token is None:
+            codes[index] = -1
+            continue
+        code = lookup.get(token)
+        if code is None:
+            code = lookup[token] = len(lookup)
+        codes[index] = code
+
+    return {"kind": "codes", "uniques": [list(token) for token in lookup]}, codes
+
+
+def _decode_column(meta: Dict[str, Any], array: np.ndarray) -> np.ndarray:
+    if meta["kind"] == "numeric":
+        return array
+
+    # Последний элемент — для пропусков (код -1)
+    lookup = np.empty(len(meta["uniques"]) + 1, dtype=object)
+    lookup[:-1] = [_decode_value(tag, payload) for tag, payload in meta["uniques"]]
+    lookup[-1] = np.nan
+    return lookup[array]
+
+
+class ParsedExportCache:
+    """
+    Кэш разобранных выгрузок Анкетолога на диске.
+
+    Ключ — хеш содержимого файла, значение — список вопросов (название, тип,
+    номер и столбец ответов) в npz. При превышении max_bytes удаляются записи,
+    которые дольше всего не использовались.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir: str = cache_dir
+        self.max_bytes: int = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f"{digest}.npz")
+
+    def get(self, digest: str) -> Optional[List[Question]]:
+        """
+        Чтение списка вопросов из кэша
+
+        Returns:
+            Список вопросов или None, если записи нет или она устарела
+        """
+        if not self.enabled:
+            return None
+
+        path = self._path(digest)
+        try:
+            with np.load(path, allow_pickle=False) as archive:
+                meta = json.loads(str(archive["meta"]))
+                if meta.get("version") != CACHE_VERSION:
+                    return None
+                store = ColumnStore([
+                    _decode_column(item["column"], archive[f"values_{index}"])
+                    for index, item in enumerate(meta["questions"])
+                ], digest)
+                questions = [
+                    Question(item["name"], QuestionType(item["type"]), store, index, item["id"])
+                    for index, item in enumerate(meta["questions"])
+                ]
+        except (OSError, KeyError, ValueError):
+            return None
+
+        # Отмечаем использование для вытеснения по давности
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return questions
+
+    def put(self, digest: str, questions: List[Question]) -> None:
+        """
+        Сохранение списка вопросов в кэш
+        """
+        if not self.enabled:
+            return
+
+        try:
+            meta = {"version": CACHE_VERSION, "questions": []}
+            arrays = {}
+            for index, question in enumerate(questions):
+                column_meta, array = _encode_column(question.column)
+                meta["questions"].append({
+                    "name": question.name,
+                    "type": str(question.type),
+                    "id": question.id,
+                    "column": column_meta,
+                })
+                arrays[f"values_{index}"] = array
+        except TypeError:
+            # Значения, которые не умеем хранить без pickle, не кэшируем
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(digest)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as file:
+                np.savez(file, meta=np.array(json.dumps(meta, ensure_ascii=False)), **arrays)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        self.evict()
+
+    def evict(self) -> None:
+        """Удаление давно не использованных записей сверх max_bytes"""
+        evict_files(self.cache_dir, ".npz", self.max_bytes)
+
+
+def evict_files(cache_dir: str, suffix: str, max_bytes: int) -> None:
+    """
+    Удаление файлов кэша, которые дольше всего не использовались (по mtime),
+    пока их общий размер больше max_bytes
+
+    Args:
+        cache_dir: каталог кэша
+        suffix: расширение файлов записей
+        max_bytes: допустимый размер
+    """
+    try:
+        entries = [entry for entry in os.scandir(cache_dir) if entry.name.endswith(suffix)]
+    except OSError:
+        return
+
+    files = []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+parsed_cache = ParsedExportCache(config.parsed_cache_dir, config.parsed_cache_max_bytes)
@@ -1,16 +1,22 @@
+import asyncio
 import os
-from typing import Tuple, Optional, List
+from typing import Any, Dict, Tuple, Optional, List, Callable, Awaitable
 
 import pandas as pd
 from aiogram.types import Message
 
 from .calculate_targets import fetch_form_data, save_calculation_results, calculate_raw_weights_from_questions
-from .file_processor import read_file, table_validation, create_questions_list
-from .analyzer import analyze_questions
+from .file_processor import load_questions_list
+from .analyzer import analyze_questions, analyze_groups
 from .models import AnalysisError, AnalysisResult
+from .executor import processing_executor
+from .job_queue import job_store, remove_job_files
+from .history import report_history, survey_key
 from .prepare_target_distributions import prepare_target_distributions
 from src.utils.cleaner import clean_dict_keys, clean_text
-from src.utils.division_df import division_df, multi_division_df, process_result_with_divider
+from src.utils.division_df import division_rows, multi_division_rows
+from src.utils.tracing import add_records, current_trace, record_stage, start_trace, trace_stage
+from config.config import config
 
 def extract_group_label(key: str, field: str) -> str:
     """
@@ -29,6 +35,35 @@ def extract_group_label(key: str, field: str) -> str:
             return part.replace(f"{field}=", "")
     return ""
 
+def output_paths(path: str) -> Tuple[str, str]:
+    """
+    Пути итоговых файлов Excel и CSV: рядом с исходным, то есть в каталоге
+    задачи, который у каждого файла свой (job_dir)
+    """
+    name = os.path.basename(path).split(".")[0]
+    directory = os.path.dirname(path)
+    return (os.path.join(directory, f'{name}_modified.xlsx'),
+            os.path.join(directory, f'{name}_modified.csv'))
+
+class ProcessingOutcome:
+    """
+    Результат обработки, возвращаемый из рабочего процесса
+    """
+    def __init__(self, excel_path: str, csv_path: str, summary_text: str = "", skipped_questions: str = ""):
+        self.excel_path: str = excel_path
+        self.csv_path: str = csv_path
+        self.summary_text: str = summary_text
+        self.skipped_questions: str = skipped_questions
+        # Этапы обработки в рабочем процессе (записи трассы)
+        self.stages: List[Dict[str, Any]] = []
+        # Для истории отчетов: основные показатели, размеры выборки и итоги взвешивания
+        self.metrics: List[Dict[str, Any]] = []
+        self.respondents: Optional[int] = None
+        self.sample_size: Optional[int] = None
+        self.calculation_id: Optional[int] = None
+        self.raking: Optional[Dict[str, Any]] = None
+
+
 async def process_data(
     path: str,
     mood_number: Optional[int] = None,
@@ -39,10 +74,20 @@ async def process_data(
     question_numbers_weights:Optional[List[int]] = None,
     division = None,
     tr_number: Optional[int] = None,
-    roti_number: Optional[int] = None
+    roti_number: Optional[int] = None,
+    user_id: Optional[int] = None,
+    on_progress: Optional[Callable[[int, float], Awaitable[None]]] = None,
+    job_id: Optional[int] = None,
+    resumable: bool = True
 ) -> Tuple[str, str]:
     """
-    Обработка данных из файла анкеты
+    Обработка данных из файла анкеты в пуле процессов
+    
+    Задача сохраняется в очереди задач (job_store): пока она ждет пул и
+    считается, аренда продлевается, а по завершении записываются результат
+    и время этапов. Задача, прерванная перезапуском бота, запускается заново
+    с тем же job_id, если она создана с resumable=True. Записи в базу идут
+    через asyncio.to_thread и не блокируют цикл событий бота.
     
     Args:
         path: путь к файлу Excel
@@ -50,45 +95,164 @@ async def process_data(
         nps_number: номера вопросов NPS
         csi_numbers: номера вопросов CSI
         message: объект сообщения для отправки уведомлений
+        user_id: идентификатор пользователя для лимита параллельных задач
+        on_progress: корутина для сообщения позиции в очереди и прошедшего времени
+        job_id: задача из очереди, которая запускается заново (None — новая задача)
+        resumable: запускать ли задачу заново после перезапуска бота (False — результат
+            нужен только вызывающему коду, например пакетной выгрузке)
         
     Returns:
         Кортеж с путями к файлам Excel и CSV
     """
-    # Получаем имя файла для создания выходных файлов
-    name = path.split("/")[-1].split(".")[0]
-    excel_path = f'./{name}_modified.xlsx'
-    csv_path = f'./{name}_modified.csv'
+    if job_id is None:
+        params = {
+            "mood_number": mood_number, "nps_number": nps_number, "csi_numbers": csi_numbers,
+            "type_analyze": type_analyze, "question_numbers_weights": question_numbers_weights,
+            "division": division, "tr_number": tr_number, "roti_number": roti_number,
+        }
+        chat_id = message.chat.id if message else user_id
+        job_id = await asyncio.to_thread(job_store.create, user_id, chat_id, path, params, resumable=resumable)
+
+    trace = current_trace()
+    if trace is not None:
+        trace.job_id = job_id
+
+    job = None
+    marked_running = False
+
+    async def track_progress(position: int, elapsed: float) -> None:
+        # Продлеваем аренду задачи и отмечаем момент, когда она попала в процесс пула
+        nonlocal marked_running
+        await asyncio.to_thread(job_store.renew, job_id)
+        if not marked_running and job is not None and job.started_at is not None:
+            marked_running = True
+            await asyncio.to_thread(job_store.start, job_id)
+        if on_progress is not None:
+            await on_progress(position, elapsed)
+
+    try:
+        job = processing_executor.submit(
+            user_id, run_process_data, path, mood_number, nps_number, csi_numbers,
+            type_analyze, question_numbers_weights, division, tr_number, roti_number,
+            trash_list=list(config.trash_list),
+        )
+        outcome = await processing_executor.wait(job, track_progress)
+
+    except AnalysisError as e:
+        await asyncio.to_thread(job_store.fail, job_id, str(e))
+        if message:
+            await message.answer(f"{e}")
+        remove_job_files([path, *output_paths(path)])
+        raise
+
+    except Exception as e:
+        await asyncio.to_thread(job_store.fail, job_id, repr(e))
+        if message:
+            await message.answer("Произошла какая-то ошибка 😿\nНо ведь у меня лапки🐾")
+        remove_job_files([path, *output_paths(path)])
+        raise
+
+    # Этапы рабочего процесса пишутся в трассу задачи процесса бота
+    record_stage("queue", job.queue_time())
+    add_records(outcome.stages)
+    stage_timings = {"queue": round(job.queue_time(), 4)}
+    stage_timings.update((stage["stage"], stage["wall"]) for stage in outcome.stages)
+    await asyncio.to_thread(job_store.finish, job_id, outcome.excel_path, outcome.csv_path, stage_timings)
+    await asyncio.to_thread(
+        report_history.record,
+        survey_key(path), outcome.metrics, job_id=job_id, type_analyze=type_analyze,
+        respondents=outcome.respondents, sample_size=outcome.sample_size,
+        calculation_id=outcome.calculation_id, raking=outcome.raking,
+    )
+
+    if message:
+        if outcome.skipped_questions:
+            await message.answer(f"Были пропущены следующие вопросы{outcome.skipped_questions}")
+        if outcome.summary_text:
+            await message.answer(outcome.summary_text)
+
+    return outcome.excel_path, outcome.csv_path
+
+
+def run_process_data(
+    path: str,
+    mood_number: Optional[int] = None,
+    nps_number: Optional[List[int]] = None,
+    csi_numbers: Optional[List[int]] = None,
+    type_analyze = "standard",
+    question_numbers_weights:Optional[List[int]] = None,
+    division = None,
+    tr_number: Optional[int] = None,
+    roti_number: Optional[int] = None,
+    trash_list: Optional[List[str]] = None
+) -> ProcessingOutcome:
+    """
+    Обработка данных из файла анкеты. Выполняется в рабочем процессе пула.
+    
+    Этапы обработки собираются в трассу и возвращаются в outcome.stages:
+    в лог их пишет процесс бота вместе с остальными этапами задачи.
+    Аргументы — как у _run_process_data.
+    """
+    # Процесс пула считает одну задачу за раз, поэтому здесь меряется пик RSS этапов
+    with start_trace(emit=False, measure_peak=True) as trace:
+        outcome = _run_process_data(
+            path, mood_number, nps_number, csi_numbers, type_analyze,
+            question_numbers_weights, division, tr_number, roti_number, trash_list,
+        )
+    outcome.stages = trace.records
+    return outcome
+
+
+def _run_process_data(
+    path: str,
+    mood_number: Optional[int] = None,
+    nps_number: Optional[List[int]] = None,
+    csi_numbers: Optional[List[int]] = None,
+    type_analyze = "standard",
+    question_numbers_weights:Optional[List[int]] = None,
+    division = None,
+    tr_number: Optional[int] = None,
+    roti_number: Optional[int] = None,
+    trash_list: Optional[List[str]] = None
+) -> ProcessingOutcome:
+    """
+    Обработка данных из файла анкеты. Выполняется в рабочем процессе пула.
+    
+    Args:
+        path: путь к файлу Excel
+        mood_number: номер вопроса о настроении
+        nps_number: номера вопросов NPS
+        csi_numbers: номера вопросов CSI
+        trash_list: актуальный список мусорных слов из процесса бота
+        
+    Returns:
+        Пути к файлам Excel и CSV и текстовая сводка
+    """
+    # Рабочий процесс живет дольше одной задачи, поэтому список мусора берем из бота
+    if trash_list is not None:
+        config.trash_list = list(trash_list)
+
+    excel_path, csv_path = output_paths(path)
     
-    # Чтение и валидация данных из файла
-    df = read_file(path)
-    df = table_validation(df)
-    # Создание списка вопросов
-    questions_list = create_questions_list(df)
+    # Чтение, валидация и создание списка вопросов (повторные запуски — из кэша)
+    questions_list = load_questions_list(path)
 
     target_pol, target_age, target_art, sample_size = None, None, None, None
+    calculation_id, raking = None, None
 
-    length = len(questions_list[0].data)
+    length = len(questions_list[0])
     weights = pd.DataFrame({'ones': [1] * length})
 
     if type_analyze == "weighted":
         try:
             form_data = fetch_form_data()
         except ValueError as error:
-            if message:
-                await message.answer(f"{error}")
-            if os.path.exists(path):
-                os.remove(path)
             raise AnalysisError(str(error)) from error
 
         if form_data is None:
-            error = AnalysisError(
+            raise AnalysisError(
                 "Для взвешивания сначала заполните и сохраните параметры генеральной совокупности в mini app."
             )
-            if message:
-                await message.answer(f"{error}")
-            if os.path.exists(path):
-                os.remove(path)
-            raise error
 
         (male_count, female_count, art_school_labels, art_school_distribution,
          age_group_labels, age_group_distribution) = form_data
@@ -106,176 +270,153 @@ async def process_data(
                 art_school_distribution, art_school_labels,
                 confidence_level, p, E)
         except ValueError as error:
-            if message:
-                await message.answer(f"{error}")
-            if os.path.exists(path):
-                os.remove(path)
             raise AnalysisError(str(error)) from error
         
-        save_calculation_results(sample_size, target_pol, target_age, target_art)
+        calculation_id = save_calculation_results(sample_size, target_pol, target_age, target_art)
 
         # Сохраняем оригинальные версии
         original_target_pol = target_pol.copy()
         original_target_age = target_age.copy()
         original_target_art = target_art.copy()
 
-        original_data_columns = {}  # сохраняем оригинальные данные по вопросам
-
+        # Очищенные ответы признаков — в копиях вопросов, исходные столбцы не меняются
+        weighting_questions = []
         for q in questions_list:
             number_q = int(q.id.split("_")[1])
             if number_q in question_numbers_weights:
-                col_name = q.data.columns[0]
-                original_data_columns[q.id] = q.data[col_name].copy()  # копируем Series
-                q.data[col_name] = q.data[col_name].astype(str).apply(clean_text)
+                q = q.copy()
+                q.replace_column(pd.Series(q.column).astype(str).apply(clean_text).to_numpy())
+            weighting_questions.append(q)
 
         # Применяем очистку
         target_pol = clean_dict_keys(target_pol)
         target_age = clean_dict_keys(target_age)
         target_art = clean_dict_keys(target_art)
 
-        for q in questions_list:
-            number_q = int(q.id.split("_")[1])
-            if number_q in question_numbers_weights:
-                col_name = q.data.columns[0]
-                q.data[col_name] = q.data[col_name].astype(str).apply(clean_text)
-
         try:
-            weights = calculate_raw_weights_from_questions(questions_list, question_numbers_weights,
-                                                          [target_pol, target_age, target_art], sample_size- 1)
+            with trace_stage("raking", rows=len(questions_list[0]) - 2):
+                weights = calculate_raw_weights_from_questions(weighting_questions, question_numbers_weights,
+                                                              [target_pol, target_age, target_art], sample_size- 1)
         except ValueError as error:
-            if message:
-                await message.answer(f"{error}")
-            if os.path.exists(path):
-                os.remove(path)
             raise AnalysisError(str(error)) from error
+        if "raking" in weights.attrs:
+            raking = weights.attrs["raking"].as_dict()
         # Восстанавливаем target словари
         target_pol = original_target_pol.copy()
         target_age = original_target_age.copy()
         target_art = original_target_art.copy()
 
-        # Восстанавливаем данные вопросов
-        for q in questions_list:
-            if q.id in original_data_columns:
-                col_name = q.data.columns[0]
-                q.data[col_name] = original_data_columns[q.id].copy()
-
     first_question = questions_list[0]
-    total_rows = len(first_question.data)
+    total_rows = len(first_question)
 
     num_persons = total_rows - 2
-    summary_text = ""
-    try:
-        results_list = []
 
-        if division is not None:
+    if division is not None:
+        # Группы деления: (подпись, строки ответов, число участников)
+        groups = []
+
+        # Множественное или одиночное деление
+        if len(division) == 1:
+            dict_division = division_rows(questions_list, division[0])
+
+            target_division = None
+            if type_analyze != "standard" and division[0] in question_numbers_weights:
+                if division[0] == question_numbers_weights[0]:
+                    target_division = target_pol
+                elif division[0] == question_numbers_weights[1]:
+                    target_division = target_age
+                else:
+                    target_division = target_art
+            for key, rows in dict_division.items():
+                total_rows = len(rows)
+                num = (target_division[key] * sample_size) if target_division else sample_size if type_analyze != "standard" else total_rows
 
-            # Множественное или одиночное деление
-            if len(division) == 1:
-                dict_division, dict_weights = division_df(questions_list, division[0], weights)
+                groups.append((key, rows, num))
+
+        else:
+            division_results = multi_division_rows(questions_list, division)
 
+            for key, rows in division_results.items():
+                # Определяем нужный target_division
                 target_division = None
-                if type_analyze != "standard" and division[0] in question_numbers_weights:
+                if type_analyze != "standard" and any(d in question_numbers_weights for d in division):
                     if division[0] == question_numbers_weights[0]:
                         target_division = target_pol
                     elif division[0] == question_numbers_weights[1]:
                         target_division = target_age
                     else:
                         target_division = target_art
-                for key in dict_division:
-                    q_list = dict_division[key]
-                    w_list = dict_weights[key]
-                    first_question = q_list[0]
-                    total_rows = len(first_question.data) - 2
-                    print(total_rows)
-                    num = (target_division[key] * sample_size) if target_division else sample_size if type_analyze != "standard" else total_rows
-
-                    result = analyze_questions(q_list, mood_number, nps_number, csi_numbers, num, w_list, tr_number, roti_number)
-                    result = process_result_with_divider(result, key)
-                    results_list.append(result)
-
-            else:
-                division_results = multi_division_df(questions_list, weights, division)
-
-                for key, (q_list, w_list) in division_results.items():
-                    # Определяем нужный target_division
-                    target_division = None
-                    if type_analyze != "standard" and any(d in question_numbers_weights for d in division):
-                        if division[0] == question_numbers_weights[0]:
-                            target_division = target_pol
-                        elif division[0] == question_numbers_weights[1]:
-                            target_division = target_age
-                        else:
-                            target_division = target_art
-
-                    if target_division:
-                        group_label = extract_group_label(key, division[0])
-                        num = target_division.get(group_label, 0) * sample_size
-                    else:
-                        num = sample_size if type_analyze != "standard" else num_persons
-
-                    result = analyze_questions(q_list, mood_number, nps_number, csi_numbers, num, w_list, tr_number, roti_number)
-                    result = process_result_with_divider(result, key)
-                    results_list.append(result)
-
-            num_standart = num_persons if type_analyze == "standard" else sample_size
-            result_standart = analyze_questions(questions_list, mood_number, nps_number, csi_numbers, num_standart, weights, tr_number, roti_number)
-            results_list.append(process_result_with_divider(result_standart, "Общее"))
-
-            # Объединение результатов
-            merged_data_frames = []
-            for r in results_list:
-                df_block = r.data_frames if isinstance(r.data_frames, list) else [r.data_frames]
-                merged_data_frames.extend(df_block)
-
-            result2 = AnalysisResult()
-            result2.data_frames = merged_data_frames
-
-            if any(r.free_answers_frame is not None for r in results_list):
-                result2.free_answers_frame = pd.concat(
-                    [r.free_answers_frame for r in results_list if r.free_answers_frame is not None],
-                    ignore_index=True
-                )
-
-            if csi_numbers:
-                result2.csi_frame = pd.concat([r.csi_frame for r in results_list if r.csi_frame is not None], ignore_index=True)
-            if nps_number:
-                result2.nps_frame = pd.concat([r.nps_frame for r in results_list if r.nps_frame is not None], ignore_index=True)
-            if tr_number:
-                result2.tr_frame = pd.concat([r.tr_frame for r in results_list if r.tr_frame is not None], ignore_index=True)
-            if roti_number:
-                result2.roti_frame = pd.concat([r.roti_frame for r in results_list if r.roti_frame is not None], ignore_index=True)
-
-            result = result2
-        else:
-            num = num_persons if type_analyze == "standard" else sample_size
+
+                if target_division:
+                    group_label = extract_group_label(key, division[0])
+                    num = target_division.get(group_label, 0) * sample_size
+                else:
+                    num = sample_size if type_analyze != "standard" else num_persons
+
+                groups.append((key, rows, num))
+
+        num_standart = num_persons if type_analyze == "standard" else sample_size
+        groups.append(("Общее", None, num_standart))
+
+        # Все группы и общий итог считаются за один проход по вопросам (в трассе — размеры групп деления)
+        group_rows = [len(rows) for _, rows, _ in groups if rows is not None]
+        with trace_stage("analyze", questions=len(questions_list), groups=len(groups), group_rows=group_rows):
+            results_list = analyze_groups(
+                questions_list,
+                [rows for _, rows, _ in groups],
+                [num for _, _, num in groups],
+                mood_number, nps_number, csi_numbers, weights, tr_number, roti_number,
+                dividers=[key for key, _, _ in groups],
+            )
+
+        # Объединение результатов
+        merged_data_frames = []
+        for r in results_list:
+            df_block = r.data_frames if isinstance(r.data_frames, list) else [r.data_frames]
+            merged_data_frames.extend(df_block)
+
+        result2 = AnalysisResult()
+        result2.data_frames = merged_data_frames
+
+        if any(r.free_answers_frame is not None for r in results_list):
+            result2.free_answers_frame = pd.concat(
+                [r.free_answers_frame for r in results_list if r.free_answers_frame is not None],
+                ignore_index=True
+            )
+
+        if csi_numbers:
+            result2.csi_frame = pd.concat([r.csi_frame for r in results_list if r.csi_frame is not None], ignore_index=True)
+        if nps_number:
+            result2.nps_frame = pd.concat([r.nps_frame for r in results_list if r.nps_frame is not None], ignore_index=True)
+        if tr_number:
+            result2.tr_frame = pd.concat([r.tr_frame for r in results_list if r.tr_frame is not None], ignore_index=True)
+        if roti_number:
+            result2.roti_frame = pd.concat([r.roti_frame for r in results_list if r.roti_frame is not None], ignore_index=True)
+
+        result = result2
+    else:
+        num = num_persons if type_analyze == "standard" else sample_size
+        with trace_stage("analyze", questions=len(questions_list), groups=1):
             result = analyze_questions(questions_list, mood_number, nps_number, csi_numbers, num, weights, tr_number, roti_number)
 
-        # Сохраняем результат
+    # Сохраняем результат
+    with trace_stage("write_excel", frames=len(result.data_frames)):
         if division is not None:
             result.to_excel_division(excel_path)
         else:
             result.to_excel(excel_path)
-        result.to_csv(csv_path)
-
-        if message:
-            if result.skipped_questions:
-                await message.answer(f"Были пропущены следующие вопросы{result.skipped_questions}")
-            summary_text = result.build_summary()
-            if summary_text:
-                await message.answer(summary_text)
-
-    except AnalysisError as e:
-        if message:
-            await message.answer(f"{e}")
-        if os.path.exists(path):
-            os.remove(path)
-        raise
-
-    except Exception as e:
-        if message:
-            await message.answer("Произошла какая-то ошибка 😿\nНо ведь у меня лапки🐾")
-        if os.path.exists(path):
-            os.remove(path)
-        raise
-    
-    return excel_path, csv_path
+    with trace_stage("write_csv"):
+        result.to_csv(csv_path, renumber=division is None)
+
+    outcome = ProcessingOutcome(
+        excel_path,
+        csv_path,
+        summary_text=result.build_summary(),
+        skipped_questions=result.skipped_questions,
+    )
+    outcome.metrics = result.key_metrics()
+    outcome.respondents = num_persons
+    outcome.sample_size = sample_size
+    outcome.calculation_id = calculation_id
+    outcome.raking = raking
+    return outcome
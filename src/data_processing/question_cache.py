@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .parsed_cache import _decode_value, _encode_value, evict_files
+from config.config import config
+
+
+# Версия формата: меняется вместе с логикой расчета распределений, старые записи не читаются
+CACHE_VERSION = 1
+
+# Строки итоговой таблицы одного вопроса для каждой группы деления
+Fragments = List[List[Tuple]]
+
+
+def context_key(
+        digest: str,
+        weights: np.ndarray,
+        groups: Sequence[Optional[np.ndarray]],
+        num_persons: Sequence[Any],
+        trash_list: Iterable[Any]
+    ) -> str:
+    """
+    Общая часть ключа для всех вопросов одного анализа
+
+    Args:
+        digest: хеш выгрузки
+        weights: веса респондентов
+        groups: номера строк каждой группы деления (None — все ответы)
+        num_persons: число участников каждой группы
+        trash_list: мусорные ответы
+
+    Returns:
+        Шестнадцатеричный хеш (выгрузка, веса, деление, мусорные слова)
+    """
+    key = hashlib.sha256(f"{CACHE_VERSION}:{digest}".encode())
+    key.update(hashlib.sha256(np.ascontiguousarray(weights, dtype=float).tobytes()).digest())
+
+    division = hashlib.sha256(repr(list(num_persons)).encode())
+    for rows in groups:
+        division.update(b"*" if rows is None else np.ascontiguousarray(rows, dtype=np.int64).tobytes())
+        division.update(b"|")
+    key.update(division.digest())
+
+    key.update(repr(sorted({repr(value) for value in trash_list})).encode())
+    return key.hexdigest()
+
+
+def _encode_rows(rows: List[Tuple]) -> List[List[Any]]:
+    """Строки в виде, пригодном для JSON (None — пропуск)"""
+    return [[_encode_value(value) for value in row] for row in rows]
+
+
+def _decode_rows(rows: List[List[Any]]) -> List[Tuple]:
+    return [tuple(np.nan if token is None else _decode_value(*token) for token in row) for row in rows]
+
+
+class QuestionResultCache:
+    """
+    Кэш посчитанных распределений по вопросам.
+
+    Ключ — (контекст анализа, номер вопроса, роль вопроса), где контекст —
+    хеш выгрузки, весов, деления и мусорных слов (context_key). Повторный
+    анализ того же файла с другими NPS/CSI/TR/ROTI пересчитывает только
+    вопросы, у которых сменилась роль.
+
+    В памяти процесса хранится не больше max_entries вопросов (вытесняются
+    давно не использованные); на диске — файл JSON на контекст, который
+    load() подгружает перед анализом, так что записями пользуются и
+    другие процессы пула. При превышении max_bytes удаляются файлы, которые
+    дольше всего не использовались.
+    """
+    def __init__(self, cache_dir: str, max_entries: int, max_bytes: int):
+        self.cache_dir: str = cache_dir
+        self.max_entries: int = max_entries
+        self.max_bytes: int = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str, str], Fragments]" = OrderedDict()
+        self._pending: Dict[str, Dict[str, Fragments]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _path(self, context: str) -> str:
+        return os.path.join(self.cache_dir, f"{context}.json")
+
+    def get(self, context: str, question_id: str, role: str) -> Optional[Fragments]:
+        """
+        Строки вопроса из кэша
+
+        Returns:
+            Для каждой группы — строки вопроса, или None, если записи нет
+        """
+        if not self.enabled:
+            return None
+
+        key = (context, question_id, role)
+        fragments = self._entries.get(key)
+        if fragments is not None:
+            self._entries.move_to_end(key)
+        return fragments
+
+    def put(self, context: str, question_id: str, role: str, fragments: Fragments) -> None:
+        """
+        Сохранение строк вопроса (на диск — при flush)
+        """
+        if not self.enabled:
+            return
+
+        self._remember((context, question_id, role), fragments)
+        self._pending.setdefault(context, {})[f"{question_id}|{role}"] = fragments
+
+    def flush(self, context: str) -> None:
+        """Запись новых вопросов контекста на диск"""
+        pending = self._pending.pop(context, None)
+        if not pending or self.max_bytes <= 0:
+            return
+
+        stored = self._read(context)
+        for name, fragments in pending.items():
+            try:
+                stored[name] = [_encode_rows(rows) for rows in fragments]
+            except TypeError:
+                # Значения, которые не умеем хранить в JSON, остаются только в памяти
+                continue
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(context)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump({"version": CACHE_VERSION, "questions": stored}, file, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        evict_files(self.cache_dir, ".json", self.max_bytes)
+
+    def _read(self, context: str) -> Dict[str, List[List[List[Any]]]]:
+        """Записи контекста с диска в закодированном виде"""
+        if self.max_bytes <= 0:
+            return {}
+
+        path = self._path(context)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != CACHE_VERSION:
+            return {}
+
+        # Отмечаем использование для вытеснения по давности
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data.get("questions", {})
+
+    def load(self, context: str) -> None:
+        """Подгрузка в память записей контекста с диска (например, сделанных другим процессом пула)"""
+        if not self.enabled:
+            return
+
+        for name, fragments in self._read(context).items():
+            question_id, role = name.split("|", 1)
+            if (context, question_id, role) in self._entries:
+                continue
+            try:
+                decoded = [_decode_rows(rows) for rows in fragments]
+            except (TypeError, ValueError):
+                continue
+            self._remember((context, question_id, role), decoded)
+
+    def _remember(self, key: Tuple[str, str, str], fragments: Fragments) -> None:
+        self._entries[key] = fragments
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+question_cache = QuestionResultCache(
+    config.question_cache_dir, config.question_cache_max_entries, config.question_cache_max_bytes)
@@ -0,0 +1,94 @@
+import re
+from enum import Enum
+from typing import Dict, Optional, Tuple
+
+from .models import AnalysisError
+
+
+class QuestionType(str, Enum):
+    """
+    Типы вопросов Анкетолога (значение — подпись типа в заголовке выгрузки)
+    """
+    SCALE = "Шкала"
+    SINGLE = "Одиночный выбор"
+    MULTIPLE = "Множественный выбор"
+    DROPDOWN = "Выпадающий список"
+    MULTIPLE_DROPDOWN = "Множественный выпадающий список"
+    AREA = "Выбор области"
+    MATRIX = "Матрица"
+    MATRIX_3D = "Матрица 3D"
+    FREE_ANSWER = "Свободный ответ"
+    FREE_ANSWER_MATRIX = "Матрица свободных ответов"
+    FREE_ANSWER_GROUP = "Группа свободных ответов"
+    NAME = "Имя"
+    DATE = "Дата"
+    EMAIL = "Email"
+    PHONE = "Телефон"
+    FILE_UPLOAD = "Загрузка файла"
+
+    def __str__(self) -> str:
+        return self.value
+
+
+# Реестр: подпись типа в выгрузке -> тип вопроса
+QUESTION_TYPES: Dict[str, QuestionType] = {question_type.value: question_type for question_type in QuestionType}
+
+# Типы, которые не считаются, а только перечисляются в сводке
+SKIPPED_TYPES = frozenset({
+    QuestionType.NAME, QuestionType.DATE, QuestionType.EMAIL,
+    QuestionType.PHONE, QuestionType.FILE_UPLOAD,
+})
+
+# Типы, которые считаются как множественный выбор
+MULTIPLE_TYPES = frozenset({
+    QuestionType.MULTIPLE, QuestionType.DROPDOWN,
+    QuestionType.AREA, QuestionType.MULTIPLE_DROPDOWN,
+})
+
+# Типы, распределения которых выводятся в итоговую таблицу
+DISTRIBUTION_TYPES = frozenset({
+    QuestionType.SCALE, QuestionType.SINGLE,
+    QuestionType.MATRIX, QuestionType.MATRIX_3D,
+}) | MULTIPLE_TYPES
+
+# Заголовок столбца после table_validation: «Название (Тип) <номер вопроса>»
+HEADER_PATTERN = re.compile(r"(?P<name>.*)\((?P<type>[^()]*)\)[^()]*?\s(?P<number>\d+)\s*", re.DOTALL)
+
+
+def parse_header(label: str) -> Tuple[str, QuestionType, int]:
+    """
+    Разбор заголовка столбца вопроса
+
+    Args:
+        label: заголовок столбца
+
+    Returns:
+        Название вопроса, тип и номер вопроса
+
+    Raises:
+        AnalysisError: если заголовок не разбирается или тип вопроса неизвестен
+    """
+    match = HEADER_PATTERN.fullmatch(label)
+    if match is None:
+        raise AnalysisError(
+            f"Есть проблемка...\n"
+            f"Не получилось разобрать заголовок столбца \"{label}\"")
+
+    question_type = question_type_of(match["type"])
+    if question_type is None:
+        raise AnalysisError(
+            f"Есть проблемка...\n"
+            f"Я не знаю такой тип вопроса как \"{match['type']}\""
+            f"\nОшибка произошла при обработке вопроса номер D1_{int(match['number'])}")
+
+    return match["name"], question_type, int(match["number"])
+
+
+def question_type_of(label: str) -> Optional[QuestionType]:
+    """
+    Тип вопроса по подписи из выгрузки
+
+    Returns:
+        Тип вопроса или None, если такого типа нет в реестре
+    """
+    return QUESTION_TYPES.get(label)
@@ -0,0 +1,212 @@
+import csv
+import datetime
+import math
+from typing import Any, Dict, List, Optional, Set
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+
+from .excel_cells import build_column, convert_cell
+
+
+# Оформление заголовка как у DataFrame.to_excel
+_THIN = Side(style="thin")
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="top")
+
+DATETIME_FORMAT = "YYYY-MM-DD HH:MM:SS"
+DATE_FORMAT = "YYYY-MM-DD"
+
+# Сколько строк CSV приводится и записывается за раз
+CSV_CHUNK_ROWS = 10000
+
+
+def renumber_questions(numbers: List[str]) -> List[str]:
+    """
+    Сквозная перенумерация вопросов D1_1, D1_2, ... в порядке следования
+
+    Args:
+        numbers: номера вопросов вида D1_<номер в анкете>
+
+    Returns:
+        Номера без пропусков, соседние строки одного вопроса получают один номер
+    """
+    if not numbers:
+        return []
+
+    renumbered = []
+    new_num = 1
+    previous_num = int(numbers[0].split("_")[1])
+
+    for value in numbers:
+        current_num = int(value.split("_")[1])
+        if previous_num != current_num:
+            previous_num = current_num
+            new_num += 1
+        renumbered.append(f"D1_{new_num}")
+
+    return renumbered
+
+
+def excel_value(value: Any) -> Any:
+    """
+    Приведение значения к виду, в котором его записывает DataFrame.to_excel
+
+    Args:
+        value: значение ячейки DataFrame
+
+    Returns:
+        None для пропусков, строка для бесконечности, иначе само значение
+    """
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if math.isinf(value):
+            return "inf" if value > 0 else "-inf"
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value
+
+
+def stored_number(value: Any) -> Any:
+    """
+    Число в том виде, в котором openpyxl сохраняет его в xlsx (16 значащих цифр)
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float("%.16g" % value) if isinstance(value, float) or abs(value) >= 10 ** 16 else value
+    return value
+
+
+def _csv_values(frame: pd.DataFrame, index: int, start: int, stop: int) -> List[Any]:
+    """Значения части столбца в том виде, в котором их дает pd.read_excel для листа отчета"""
+    return [convert_cell(stored_number(excel_value(value))) for value in frame.iloc[start:stop, index].tolist()]
+
+
+def _column_dtype(chunk_dtypes: Set[str]) -> Optional[str]:
+    """
+    Тип столбца по типам его частей — такой же, как у build_column по всему
+    столбцу сразу (None — части нельзя объединить, столбец собирается целиком)
+    """
+    if "object" in chunk_dtypes:
+        # Хотя бы одно значение не число — весь столбец остается object
+        return "object"
+    if chunk_dtypes and chunk_dtypes <= {"int64", "float64"}:
+        return "float64" if "float64" in chunk_dtypes else "int64"
+    return None
+
+
+def write_csv(csv_path: str, frame: pd.DataFrame, chunk_rows: int = CSV_CHUNK_ROWS) -> None:
+    """
+    Запись CSV из DataFrame отчета частями по chunk_rows строк
+
+    Значения приводятся так же, как при чтении листа Excel через pd.read_excel
+    (целые float становятся int, тип столбца выводится заново), поэтому CSV
+    совпадает с основным листом отчета без повторного чтения xlsx. Тип
+    столбца зависит от всех его значений, поэтому первый проход по частям
+    только определяет типы, а второй приводит и записывает строки; в памяти
+    одновременно — только приведенная часть таблицы.
+
+    Args:
+        csv_path: путь к файлу CSV
+        frame: данные основного листа
+        chunk_rows: сколько строк приводится и записывается за раз
+    """
+    rows_count, columns_count = frame.shape
+    starts = range(0, rows_count, chunk_rows)
+
+    dtypes = []
+    whole_columns: Dict[int, List[Any]] = {}
+    for index in range(columns_count):
+        chunk_dtypes = {
+            str(build_column(_csv_values(frame, index, start, start + chunk_rows)).dtype) for start in starts
+        }
+        dtype = _column_dtype(chunk_dtypes)
+        if dtype is None:
+            whole_columns[index] = build_column(_csv_values(frame, index, 0, rows_count)).tolist()
+        dtypes.append(dtype)
+
+    with open(csv_path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(list(frame.columns))
+        for start in starts:
+            stop = min(start + chunk_rows, rows_count)
+            columns = []
+            for index, dtype in enumerate(dtypes):
+                if dtype is None:
+                    columns.append(whole_columns[index][start:stop])
+                elif dtype == "object":
+                    columns.append(_csv_values(frame, index, start, stop))
+                else:
+                    columns.append(build_column(_csv_values(frame, index, start, stop)).astype(dtype).tolist())
+            writer.writerows(
+                [None if isinstance(value, float) and math.isnan(value) else value for value in row]
+                for row in zip(*columns)
+            )
+
+
+class ReportWriter:
+    """
+    Запись отчета в Excel за один проход.
+
+    Книга создается в режиме openpyxl write_only: строки каждого листа
+    сразу сериализуются, форматы чисел задаются при создании ячейки,
+    а файл записывается один раз в save().
+    """
+    def __init__(self, excel_path: str):
+        self.excel_path: str = excel_path
+        self._workbook = Workbook(write_only=True)
+
+    def add_sheet(self, title: str, frame: pd.DataFrame, number_formats: Optional[Dict[int, str]] = None) -> None:
+        """
+        Добавление листа с данными
+
+        Args:
+            title: название листа
+            frame: данные листа
+            number_formats: формат чисел по номеру столбца (с нуля), применяется к числовым ячейкам
+        """
+        sheet = self._workbook.create_sheet(title)
+        if len(frame.columns) == 0:
+            return
+
+        formats = number_formats or {}
+        sheet.append([self._header_cell(sheet, column) for column in frame.columns])
+
+        columns = [frame.iloc[:, index].tolist() for index in range(frame.shape[1])]
+        for row in zip(*columns):
+            sheet.append([
+                self._data_cell(sheet, excel_value(value), formats.get(index))
+                for index, value in enumerate(row)
+            ])
+
+    def save(self) -> None:
+        """Запись книги в файл"""
+        if not self._workbook.worksheets:
+            self._workbook.create_sheet("Sheet1")
+        self._workbook.save(self.excel_path)
+
+    @staticmethod
+    def _header_cell(sheet, value: Any) -> WriteOnlyCell:
+        cell = WriteOnlyCell(sheet, value=excel_value(value))
+        cell.font = HEADER_FONT
+        cell.border = HEADER_BORDER
+        cell.alignment = HEADER_ALIGNMENT
+        return cell
+
+    @staticmethod
+    def _data_cell(sheet, value: Any, number_format: Optional[str]) -> Any:
+        if isinstance(value, datetime.datetime):
+            number_format = DATETIME_FORMAT
+        elif isinstance(value, datetime.date):
+            number_format = DATE_FORMAT
+        elif number_format is None or value is None or not isinstance(value, (int, float)):
+            return value
+
+        cell = WriteOnlyCell(sheet, value=value)
+        cell.number_format = number_format
+        return cell
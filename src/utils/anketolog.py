@@ -1,11 +1,15 @@
+import asyncio
 import os
+import random
 import re
-import time
-from typing import Any
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Iterator
 
-import requests
+import aiofiles
+import aiohttp
 
 from config.config import config
+from src.utils.tracing import traced
 
 
 BASE_URL = "https://apiv2.anketolog.ru"
@@ -18,10 +22,34 @@ REPORT_FORMAT = "excel"
 SURVEY_FOLDER = "Мои анкеты"
 TIMEOUT = 60
 DOWNLOAD_TIMEOUT = 120
-POLL_INTERVAL = 7
-MAX_POLLS = 80
+# Опрос готовности отчета: первая проверка через секунду, дальше паузы растут
+# в POLL_BACKOFF раз до POLL_MAX_DELAY; отчет ждем не дольше REPORT_TIMEOUT секунд
+POLL_INITIAL_DELAY = 1.0
+POLL_BACKOFF = 1.5
+POLL_MAX_DELAY = 10.0
+REPORT_TIMEOUT = 560
+# Повторы запросов к API и скачивания: экспоненциальная пауза со случайным разбросом
+REQUEST_RETRIES = 4
 DOWNLOAD_RETRIES = 12
-DOWNLOAD_RETRY_DELAY = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 10.0
+# Пауза после ответа 429 без заголовка Retry-After
+RATE_LIMIT_DELAY = 10
+# Ответы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Ссылки на готовые отчеты отдаются только «браузеру»
+BROWSER_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/122.0.0.0 Safari/537.36"
+    ),
+    "Accept": "*/*",
+    "Accept-Language": "ru,en;q=0.9",
+    "Referer": "https://anketolog.ru/",
+    "Connection": "keep-alive",
+}
 
 
 class AnketologError(Exception):
@@ -67,17 +95,6 @@ def get_extension(report_format: str) -> str:
     return mapping.get(report_format, "bin")
 
 
-def get_survey_folders() -> Any:
-    response = requests.post(
-        SURVEY_FOLDER_LIST_URL,
-        headers=_headers(),
-        json={},
-        timeout=TIMEOUT,
-    )
-    response.raise_for_status()
-    return response.json()
-
-
 def flatten_folder_names(folder_tree: Any) -> list[str]:
     names: list[str] = []
 
@@ -96,122 +113,54 @@ def flatten_folder_names(folder_tree: Any) -> list[str]:
     return names
 
 
-def get_survey_list_all() -> list[dict[str, Any]]:
-    response = requests.post(
-        SURVEY_LIST_URL,
-        headers=_headers(),
-        json={},
-        timeout=TIMEOUT,
-    )
-    response.raise_for_status()
-    data = response.json()
-    if not isinstance(data, list):
-        raise AnketologError(f"Ожидался список анкет, но пришло: {type(data)}")
-    return data
-
-
-def get_survey_list() -> list[dict[str, Any]]:
-    surveys = get_survey_list_all()
-
-    surveys_by_id: dict[int, dict[str, Any]] = {}
-    for survey in surveys:
-        survey_id = survey.get("id")
-        if survey_id is not None:
-            surveys_by_id[survey_id] = survey
-
-    return list(surveys_by_id.values())
+def find_folder_ids(folder_tree: Any, folder_name: str) -> set[Any]:
+    """
+    Идентификаторы папки с таким названием и всех ее вложенных папок
 
+    Args:
+        folder_tree: ответ survey/folder/list
+        folder_name: название папки (без учета регистра и лишних пробелов)
+    """
+    folder_ids: set[Any] = set()
+    normalized_name = normalize_survey_name(folder_name)
 
-def find_survey_by_name(surveys: list[dict[str, Any]], survey_name: str) -> dict[str, Any]:
-    exact_matches = []
-    partial_matches = []
-    normalized_search = normalize_survey_name(survey_name)
-
-    for survey in surveys:
-        current_name = (survey.get("settings") or {}).get("name")
-        if not current_name:
-            continue
-
-        normalized_current_name = normalize_survey_name(current_name)
-
-        if current_name == survey_name or normalized_current_name == normalized_search:
-            exact_matches.append(survey)
-        elif normalized_search in normalized_current_name:
-            partial_matches.append(survey)
-
-    if len(exact_matches) == 1:
-        return exact_matches[0]
-
-    if len(exact_matches) > 1:
-        raise AnketologError(
-            "Найдено несколько анкет с точным совпадением: "
-            + ", ".join([f'{s.get("id")}:{(s.get("settings") or {}).get("name")}' for s in exact_matches])
-        )
-
-    if len(partial_matches) == 1:
-        return partial_matches[0]
-
-    if len(partial_matches) > 1:
-        raise AnketologError(
-            "Найдено несколько анкет с частичным совпадением: "
-            + ", ".join([f'{s.get("id")}:{(s.get("settings") or {}).get("name")}' for s in partial_matches])
-        )
-
-    raise AnketologError(f'Анкета с названием "{survey_name}" не найдена.')
-
-
-def get_folder_hint() -> str:
-    try:
-        folder_names = flatten_folder_names(get_survey_folders())
-    except requests.RequestException:
-        return ""
-
-    if not folder_names:
-        return ""
-
-    return f" Доступные папки: {', '.join(folder_names[:20])}."
-
+    def _collect(node: Any) -> None:
+        if isinstance(node, dict):
+            if node.get("id") is not None:
+                folder_ids.add(node["id"])
+            for value in node.values():
+                _collect(value)
+        elif isinstance(node, list):
+            for item in node:
+                _collect(item)
 
-def locate_survey_by_name(survey_name: str) -> dict[str, Any]:
-    surveys = get_survey_list()
-    if not surveys:
-        raise AnketologError("Не удалось получить список анкет из Anketolog.")
+    def _walk(node: Any) -> None:
+        if isinstance(node, dict):
+            name = node.get("name")
+            if isinstance(name, str) and normalize_survey_name(name) == normalized_name:
+                _collect(node)
+                return
+            for value in node.values():
+                _walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                _walk(item)
 
-    try:
-        return find_survey_by_name(surveys, survey_name)
-    except AnketologError as error:
-        message = str(error)
-        if "не найдена" in message:
-            raise AnketologError(message + get_folder_hint())
-        raise
-
-
-def create_report(survey_id: int) -> dict[str, Any]:
-    response = requests.post(
-        SURVEY_REPORT_CREATE_URL,
-        headers=_headers(),
-        json={"survey_id": survey_id, "format": REPORT_FORMAT},
-        timeout=TIMEOUT,
-    )
-    response.raise_for_status()
-    data = response.json()
-    if not isinstance(data, dict):
-        raise AnketologError("Не удалось создать отчет: неверный формат ответа.")
-    return data
-
-
-def get_report_list(survey_id: int) -> list[dict[str, Any]]:
-    response = requests.post(
-        SURVEY_REPORT_LIST_URL,
-        headers=_headers(),
-        json={"survey_id": survey_id},
-        timeout=TIMEOUT,
-    )
-    response.raise_for_status()
-    data = response.json()
-    if not isinstance(data, list):
-        raise AnketologError("Не удалось получить список отчетов.")
-    return data
+    _walk(folder_tree)
+    return folder_ids
+
+
+def get_survey_folder_id(survey: dict[str, Any]) -> Any:
+    """Папка анкеты из списка анкет (поле folder_id или folder, в том числе в settings)"""
+    for source in (survey, survey.get("settings") or {}):
+        if source.get("folder_id") is not None:
+            return source["folder_id"]
+        folder = source.get("folder")
+        if isinstance(folder, dict):
+            return folder.get("id")
+        if folder is not None:
+            return folder
+    return None
 
 
 def find_report_by_id(report_list: list[dict[str, Any]], report_id: int) -> dict[str, Any] | None:
@@ -221,92 +170,239 @@ def find_report_by_id(report_list: list[dict[str, Any]], report_id: int) -> dict
     return None
 
 
-def wait_until_report_ready(survey_id: int, report_id: int) -> dict[str, Any]:
-    for _ in range(MAX_POLLS):
-        report_list = get_report_list(survey_id)
-        report = find_report_by_id(report_list, report_id)
-
-        if not report:
-            time.sleep(POLL_INTERVAL)
-            continue
-
-        status = report.get("status")
-        url = report.get("url")
-
-        if status == "complete" and url:
-            return report
-
-        if status == "fail":
-            raise AnketologError("Формирование отчета завершилось с ошибкой.")
-
-        time.sleep(POLL_INTERVAL)
+def get_retry_after(response: aiohttp.ClientResponse) -> float:
+    """Пауза из заголовка Retry-After ответа 429 (в секундах)"""
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", RATE_LIMIT_DELAY)))
+    except ValueError:
+        return RATE_LIMIT_DELAY
+
+
+def backoff_delay(attempt: int, base: float = RETRY_BASE_DELAY, cap: float = RETRY_MAX_DELAY) -> float:
+    """
+    Пауза перед повтором номер attempt (с 1): base * 2^(attempt-1), не больше cap,
+    со случайным разбросом от половины до полной паузы, чтобы повторы разных
+    запросов не приходили одновременно
+    """
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def poll_delays(timeout: float = REPORT_TIMEOUT) -> Iterator[float]:
+    """
+    Паузы между проверками готовности отчета: сначала частые (маленькие
+    отчеты готовы за пару секунд), затем все реже, пока суммарно не пройдет timeout
+    """
+    delay, waited = POLL_INITIAL_DELAY, 0.0
+    while waited < timeout:
+        pause = min(delay * random.uniform(0.9, 1.1), timeout - waited)
+        yield pause
+        waited += pause
+        delay = min(POLL_MAX_DELAY, delay * POLL_BACKOFF)
+
+
+class RateLimiter:
+    """
+    Ограничение запросов к API Anketolog одного клиента: не больше
+    max_concurrency запросов одновременно и не чаще rate_per_second
+    в секунду (0 — без ограничения частоты). После ответа 429 все
+    запросы клиента ждут паузу, которую попросил сервер.
+    """
+    def __init__(self, max_concurrency: int, rate_per_second: float):
+        self._semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrency)
+        self._interval: float = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self._next_slot: float = 0.0
+        self._paused_until: float = 0.0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Место для одного запроса: ждет свободный слот и свою очередь по частоте"""
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            # Время старта резервируется сразу, поэтому ожидающие запросы не стартуют пачкой
+            now = loop.time()
+            start = max(now, self._next_slot, self._paused_until)
+            self._next_slot = start + self._interval
+            if start > now:
+                await asyncio.sleep(start - now)
+            yield
+
+    def pause(self, seconds: float) -> None:
+        """Пауза для всех запросов клиента (после ответа 429)"""
+        until = asyncio.get_running_loop().time() + seconds
+        self._paused_until = max(self._paused_until, until)
+        self._next_slot = max(self._next_slot, until)
+
+
+class AnketologClient:
+    """
+    Асинхронный клиент API Anketolog.
+
+    Все запросы идут через одну сессию aiohttp: соединения с API и с
+    сервером отчетов переиспользуются, а не открываются заново на каждый
+    запрос. Частоту запросов к API ограничивает общий RateLimiter, поэтому
+    пакетная выгрузка и обычные запросы пользователей делят один лимит.
+    Ошибки сети, 5xx и 429 повторяются с экспоненциальной паузой и разбросом.
+
+    Сессия создается при первом запросе и закрывается через close().
+    """
+    def __init__(self, max_concurrency: int | None = None, rate_per_second: float | None = None):
+        self.limiter: RateLimiter = RateLimiter(
+            max_concurrency or config.anketolog_max_concurrency,
+            config.anketolog_rate_per_second if rate_per_second is None else rate_per_second,
+        )
+        self._session: aiohttp.ClientSession | None = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=TIMEOUT),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _post(self, url: str, payload: dict[str, Any], idempotent: bool = True) -> Any:
+        """
+        POST-запрос к API с повторами
+
+        Args:
+            url: адрес метода API
+            payload: тело запроса (JSON)
+            idempotent: можно ли повторить запрос, который мог дойти до сервера.
+                Для неидемпотентных (создание отчета) повторяются только 429 и
+                ошибки соединения — иначе можно создать отчет дважды.
+        """
+        headers = _headers()
+        session = self._get_session()
+        last_error = ""
+
+        for attempt in range(1, REQUEST_RETRIES + 2):
+            async with self.limiter.slot():
+                try:
+                    async with session.post(url, headers=headers, json=payload) as response:
+                        if response.status == 429:
+                            self.limiter.pause(get_retry_after(response))
+                            last_error = "Anketolog ограничил частоту запросов"
+                            continue
+                        if response.status >= 400:
+                            text = await response.text()
+                            last_error = f"Anketolog вернул {response.status}: {text[:200]}"
+                            if not idempotent or response.status not in RETRY_STATUSES:
+                                raise AnketologError(last_error)
+                        else:
+                            return await response.json(content_type=None)
+                except aiohttp.ClientConnectorError as error:
+                    last_error = f"Не удалось подключиться к Anketolog: {error!r}"
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    last_error = f"Не удалось обратиться к Anketolog: {error!r}"
+                    if not idempotent:
+                        raise AnketologError(last_error) from error
+            if attempt <= REQUEST_RETRIES:
+                await asyncio.sleep(backoff_delay(attempt))
+
+        raise AnketologError(f"{last_error}. Попробуйте позже.")
+
+    async def survey_list(self) -> list[dict[str, Any]]:
+        """Все анкеты без повторов по id"""
+        data = await self._post(SURVEY_LIST_URL, {})
+        if not isinstance(data, list):
+            raise AnketologError(f"Ожидался список анкет, но пришло: {type(data)}")
+        surveys_by_id = {survey.get("id"): survey for survey in data if survey.get("id") is not None}
+        return list(surveys_by_id.values())
+
+    async def folders(self) -> Any:
+        return await self._post(SURVEY_FOLDER_LIST_URL, {})
+
+    async def create_report(self, survey_id: int) -> dict[str, Any]:
+        data = await self._post(SURVEY_REPORT_CREATE_URL, {"survey_id": survey_id, "format": REPORT_FORMAT},
+                                idempotent=False)
+        if not isinstance(data, dict):
+            raise AnketologError("Не удалось создать отчет: неверный формат ответа.")
+        return data
+
+    async def report_list(self, survey_id: int) -> list[dict[str, Any]]:
+        data = await self._post(SURVEY_REPORT_LIST_URL, {"survey_id": survey_id})
+        if not isinstance(data, list):
+            raise AnketologError("Не удалось получить список отчетов.")
+        return data
+
+    async def wait_until_report_ready(self, survey_id: int, report_id: int) -> dict[str, Any]:
+        """Ожидание готовности отчета (паузы между проверками — poll_delays)"""
+        for delay in poll_delays():
+            await asyncio.sleep(delay)
+            report = find_report_by_id(await self.report_list(survey_id), report_id)
+            if not report:
+                continue
+
+            status = report.get("status")
+            url = report.get("url")
+
+            if status == "complete" and url:
+                return report
+
+            if status == "fail":
+                raise AnketologError("Формирование отчета завершилось с ошибкой.")
+
+        raise AnketologError("Отчет не стал готовым за отведенное время.")
+
+    @traced("anketolog_download")
+    async def download(self, url: str, filename: str) -> str:
+        """
+        Скачивание готового отчета по ссылке (с повторами)
+
+        Части ответа пишутся в файл через aiofiles (запись в пуле потоков),
+        чтобы одновременные скачивания пакетной выгрузки не блокировали
+        цикл событий. Недокачанный файл удаляется.
+        """
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        session = self._get_session()
+        timeout = aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT)
+        last_error: Exception | None = None
+
+        for attempt in range(1, DOWNLOAD_RETRIES + 1):
+            try:
+                async with session.get(url, headers=BROWSER_HEADERS, timeout=timeout) as response:
+                    response.raise_for_status()
+                    async with aiofiles.open(filename, "wb") as file_obj:
+                        async for chunk in response.content.iter_chunked(1024 * 1024):
+                            await file_obj.write(chunk)
+                return filename
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                last_error = error
+                if attempt == DOWNLOAD_RETRIES:
+                    break
+                await asyncio.sleep(backoff_delay(attempt))
+
+        if os.path.exists(filename):
+            os.remove(filename)
+        raise AnketologError(f"Не удалось скачать отчет по ссылке: {last_error!r}")
+
+    async def download_report(self, survey: dict[str, Any], directory: str | None = None) -> str:
+        """
+        Создание отчета по анкете, ожидание готовности и скачивание
+
+        Args:
+            survey: анкета из списка анкет
+            directory: каталог для файла (по умолчанию download_dir)
+
+        Returns:
+            Путь к файлу «Название_номер анкеты.xlsx»
+        """
+        survey_id = survey.get("id")
+        survey_name = (survey.get("settings") or {}).get("name") or str(survey_id)
 
-    raise AnketologError("Отчет не стал готовым за отведенное время.")
+        report = await self.create_report(survey_id)
+        if report.get("status") != "complete" or not report.get("url"):
+            report = await self.wait_until_report_ready(survey_id, report.get("id"))
 
+        ext = get_extension(report.get("format", REPORT_FORMAT))
+        filename = os.path.join(directory or config.download_dir, f"{sanitize_filename(survey_name)}_{survey_id}.{ext}")
+        return await self.download(report["url"], filename)
 
-def download_file(url: str, filename: str) -> str:
-    browser_headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/122.0.0.0 Safari/537.36"
-        ),
-        "Accept": "*/*",
-        "Accept-Language": "ru,en;q=0.9",
-        "Referer": "https://anketolog.ru/",
-        "Connection": "keep-alive",
-    }
 
-    last_error: Exception | None = None
-
-    for attempt in range(1, DOWNLOAD_RETRIES + 1):
-        try:
-            with requests.Session() as session:
-                with session.get(
-                    url,
-                    headers=browser_headers,
-                    stream=True,
-                    allow_redirects=True,
-                    timeout=DOWNLOAD_TIMEOUT,
-                ) as response:
-                    response.raise_for_status()
-                    with open(filename, "wb") as file_obj:
-                        for chunk in response.iter_content(chunk_size=1024 * 1024):
-                            if chunk:
-                                file_obj.write(chunk)
-            return filename
-        except requests.RequestException as error:
-            last_error = error
-            if attempt == DOWNLOAD_RETRIES:
-                break
-            time.sleep(DOWNLOAD_RETRY_DELAY)
-
-    raise AnketologError(f"Не удалось скачать отчет по ссылке: {last_error}")
-
-
-def download_report_by_survey_name(survey_name: str) -> tuple[str, str]:
-    survey = locate_survey_by_name(survey_name)
-    survey_id = survey.get("id")
-    survey_real_name = (survey.get("settings") or {}).get("name") or survey_name
-
-    report = create_report(survey_id)
-    report_id = report.get("id")
-    report_status = report.get("status")
-    report_url = report.get("url")
-
-    if report_status == "complete" and report_url:
-        ready_format = report.get("format", REPORT_FORMAT)
-        ext = get_extension(ready_format)
-        filename = os.path.join(config.download_dir, f"{sanitize_filename(survey_real_name)}_{survey_id}.{ext}")
-        return download_file(report_url, filename), survey_real_name
-
-    ready_report = wait_until_report_ready(survey_id, report_id)
-    ready_url = ready_report.get("url")
-    ready_format = ready_report.get("format", REPORT_FORMAT)
-
-    if not ready_url:
-        raise AnketologError("Отчет помечен как готовый, но URL отсутствует.")
-
-    ext = get_extension(ready_format)
-    filename = os.path.join(config.download_dir, f"{sanitize_filename(survey_real_name)}_{survey_id}.{ext}")
-    return download_file(ready_url, filename), survey_real_name
+anketolog_client = AnketologClient()
@@ -0,0 +1,265 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# Схема общей базы мониторинга: создается один раз на процесс, при первом подключении
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS allowed_users (
+        id INTEGER PRIMARY KEY,
+        first_name TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS form_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        menCount TEXT,
+        womenCount TEXT,
+        artSchools TEXT,
+        ageGroups TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS calculation_results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sampleSize INTEGER,
+        targetPol TEXT,
+        targetAge TEXT,
+        targetArt TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS processing_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        chat_id INTEGER,
+        status TEXT NOT NULL,
+        input_path TEXT NOT NULL,
+        params TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        lease_owner TEXT,
+        lease_until REAL,
+        error TEXT,
+        excel_path TEXT,
+        csv_path TEXT,
+        stage_timings TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        resumable INTEGER NOT NULL DEFAULT 1
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_processing_jobs_status ON processing_jobs (status, lease_until)",
+    "CREATE INDEX IF NOT EXISTS idx_calculation_results_created_at ON calculation_results (created_at)",
+    """
+    CREATE TABLE IF NOT EXISTS report_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at REAL NOT NULL,
+        survey TEXT NOT NULL,
+        job_id INTEGER,
+        type_analyze TEXT,
+        respondents INTEGER,
+        sample_size INTEGER,
+        calculation_id INTEGER,
+        raking TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_report_history_survey ON report_history (survey, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_report_history_created_at ON report_history (created_at)",
+    """
+    CREATE TABLE IF NOT EXISTS report_metrics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        report_id INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        survey TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        question TEXT,
+        divider TEXT,
+        value REAL NOT NULL,
+        ci_lower REAL,
+        ci_upper REAL
+    )
+    """,
+    # Тренды: показатель по анкете за период читается по индексу, без просмотра таблицы
+    "CREATE INDEX IF NOT EXISTS idx_report_metrics_trend ON report_metrics (metric, survey, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_report_metrics_created_at ON report_metrics (metric, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_report_metrics_report ON report_metrics (report_id)",
+)
+
+# Столбцы, добавленные в существующие таблицы: (таблица, столбец, определение).
+# В базах, созданных прежними версиями, они добавляются при создании схемы
+ADDED_COLUMNS = (
+    ("processing_jobs", "resumable", "INTEGER NOT NULL DEFAULT 1"),
+)
+
+# Сколько подготовленных запросов держит каждое подключение
+CACHED_STATEMENTS = 256
+
+
+class MonitoringDatabase:
+    """
+    Доступ к общей SQLite базе мониторинга (ее же читает и пишет mini app).
+
+    У каждого потока свое подключение, открытое один раз: PRAGMA и схема
+    не выполняются на каждый запрос, а подготовленные запросы переиспользуются
+    (кэш выражений sqlite3 живет вместе с подключением). Подключения
+    работают в режиме autocommit, запись — через transaction().
+
+    Часто читаемые данные (список пользователей, последняя форма) хранятся
+    в памяти через cached(): в течение ttl секунд база не читается вовсе,
+    а после — проверяется PRAGMA data_version, и данные перечитываются,
+    только если базу кто-то изменил (бот или mini app).
+    """
+    def __init__(self, path: str, cache_ttl: float = 5.0):
+        self.path: str = path
+        self.cache_ttl: float = cache_ttl
+        self._local: threading.local = threading.local()
+        self._lock: threading.Lock = threading.Lock()
+        self._pid: int = os.getpid()
+        self._schema_ready: bool = False
+        # Отдельное подключение только для PRAGMA data_version: номера версий
+        # сравнимы лишь в пределах одного подключения, и записи всех потоков
+        # для него — изменения «другого подключения»
+        self._version_conn: Optional[sqlite3.Connection] = None
+        # Ключ -> (срок годности, версия базы при чтении, значение)
+        self._cache: Dict[str, Tuple[float, int, Any]] = {}
+
+    def _open(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                               check_same_thread=check_same_thread, cached_statements=CACHED_STATEMENTS)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _check_process(self) -> None:
+        """После fork подключения родителя не используются"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._local = threading.local()
+            self._version_conn = None
+            self._schema_ready = False
+            self._cache.clear()
+
+    def _thread_connection(self) -> sqlite3.Connection:
+        self._check_process()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Подключение текущего потока (при первом обращении в процессе создается схема)"""
+        conn = self._thread_connection()
+        if not self._schema_ready:
+            self.init_schema()
+        return conn
+
+    def init_schema(self) -> None:
+        """Создание таблиц и индексов (один раз на процесс)"""
+        conn = self._thread_connection()
+        with self._lock:
+            if self._schema_ready:
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for statement in SCHEMA:
+                    conn.execute(statement)
+                for table, column, definition in ADDED_COLUMNS:
+                    columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+                    if column not in columns:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            self._schema_ready = True
+
+    def fetchall(self, query: str, params: Iterable[Any] = ()) -> List[sqlite3.Row]:
+        """Чтение строк запроса"""
+        return self.connection().execute(query, tuple(params)).fetchall()
+
+    def fetchone(self, query: str, params: Iterable[Any] = ()) -> Optional[sqlite3.Row]:
+        """Первая строка запроса (None, если строк нет)"""
+        rows = self.fetchall(query, params)
+        return rows[0] if rows else None
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Транзакция записи (BEGIN IMMEDIATE): при ошибке изменения откатываются
+
+        Yields:
+            Подключение текущего потока
+        """
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def data_version(self) -> int:
+        """Счетчик изменений базы (меняется после каждой записи любым подключением)"""
+        with self._lock:
+            self._check_process()
+            if self._version_conn is None:
+                self._version_conn = self._open(check_same_thread=False)
+            return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def cached(self, key: str, loader: Callable[[], Any]) -> Any:
+        """
+        Значение из кэша в памяти или загрузка через loader
+
+        Пока не истек ttl, значение возвращается без обращения к базе; после —
+        сверяется data_version: если база не менялась, срок продлевается.
+
+        Args:
+            key: имя значения в кэше
+            loader: чтение значения из базы (ошибки sqlite3 пробрасываются)
+
+        Returns:
+            Значение loader (возможно, сохраненное ранее)
+        """
+        self._check_process()
+        now = time.monotonic()
+        entry = self._cache.get(key)
+        if entry is not None and now < entry[0]:
+            return entry[2]
+
+        version = self.data_version()
+        if entry is not None and entry[1] == version:
+            self._cache[key] = (now + self.cache_ttl, version, entry[2])
+            return entry[2]
+
+        value = loader()
+        self._cache[key] = (now + self.cache_ttl, version, value)
+        return value
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """Сброс значения кэша (None — всех значений), например после записи"""
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+    def close(self) -> None:
+        """Закрытие подключения текущего потока и подключения для проверки версии"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        with self._lock:
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
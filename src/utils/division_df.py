@@ -1,52 +1,38 @@
-from src.data_processing.models import Question
+import numpy as np
 import pandas as pd
 
-def division_df(questions_list, division, weights):
+def division_rows(questions_list, division, rows=None):
+    """
+    Разбиение строк ответов на подгруппы по значениям вопроса-разделителя.
+
+    Данные вопросов не копируются: подгруппа — это массив номеров строк
+    ответов (без двух строк заголовка), который анализаторы применяют
+    к общим столбцам.
+
+    Args:
+        questions_list: список вопросов
+        division: номер вопроса-разделителя
+        rows: строки родительской подгруппы (None — все ответы)
+
+    Returns:
+        Словарь {значение разделителя: массив номеров строк}
+    """
     division = f"D1_{division}"
     for q in questions_list:
         if q.id == division:
-            division_question = q.data["value"].iloc[2:]
+            division_question = q.values
             break
+
+    if rows is None:
+        rows = np.arange(len(division_question))
+
     index_dict = {}
-    for idx, value in division_question.items():
+    for idx, value in zip(rows.tolist(), division_question[rows].tolist()):
         if value not in index_dict:
             index_dict[value] = []
         index_dict[value].append(idx)
 
-    result = {}
-    weights_result = {}
-
-    for value, indices in index_dict.items():
-        filtered_questions = []
-        for question in questions_list:
-            # Получаем данные по нужным индексам
-            filtered_data = question.data.loc[indices]
-            filtered_weights = weights.loc[indices]
-
-            # Добавляем первые 2 записи (если они есть)
-            first_two = question.data.iloc[:2]
-
-            # Объединяем и удаляем возможные дубли (если индексы пересекаются)
-            new_data = pd.concat([first_two, filtered_data])
-            new_data = new_data.reset_index(drop=True)
-
-            filtered_weights = pd.concat([weights.iloc[:2], filtered_weights])
-            filtered_weights = filtered_weights.reset_index(drop=True)
-
-            # Пересоздаем объект Question со срезанными данными
-            new_question = Question(
-                name=question.name,
-                type_q=question.type,
-                data=new_data,
-                id=question.id
-            )
-
-            filtered_questions.append(new_question)
-
-        result[value] = filtered_questions
-        weights_result[value] = filtered_weights
-
-    return result, weights_result
+    return {value: np.array(indices, dtype=np.intp) for value, indices in index_dict.items()}
 
 def process_result_with_divider(result, key):
         def add_divider(df):
@@ -68,28 +54,30 @@ def process_result_with_divider(result, key):
             add_divider(result.tr_frame)
         return result
 
-def multi_division_df(
+def multi_division_rows(
     questions_list,
-    weights,
     divisions,
+    rows=None,
     prefix=""
 ):
     """
-    Рекурсивно разбивает данные по нескольким вопросам
+    Рекурсивно разбивает строки ответов по нескольким вопросам
+
+    Returns:
+        Словарь {'2=Значение | 3=Значение': массив номеров строк}
     """
     if not divisions:
-        return {prefix.rstrip(" | "): (questions_list, weights)}
+        return {prefix.rstrip(" | "): rows}
 
     current_division = divisions[0]
     result = {}
 
-    dict_div, dict_weights = division_df(questions_list, current_division, weights)
+    dict_div = division_rows(questions_list, current_division, rows)
 
-    for value, q_list in dict_div.items():
+    for value, sub_rows in dict_div.items():
         new_prefix = f"{prefix}{current_division}={value} | "
-        w_list = dict_weights[value]
         # рекурсивно вызываем для оставшихся делений
-        sub_result = multi_division_df(q_list, w_list, divisions[1:], prefix=new_prefix)
+        sub_result = multi_division_rows(questions_list, divisions[1:], sub_rows, prefix=new_prefix)
         result.update(sub_result)
 
-    return result
\ No newline at end of file
+    return result
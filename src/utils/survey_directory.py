@@ -0,0 +1,306 @@
+import asyncio
+import re
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set
+
+from config.config import config
+from src.utils.anketolog import (
+    AnketologClient,
+    AnketologError,
+    anketolog_client,
+    flatten_folder_names,
+    normalize_survey_name,
+)
+
+
+# Сколько похожих анкет предлагать и минимальная похожесть названия (0..1)
+SUGGESTIONS_LIMIT = 5
+MIN_SUGGESTION_SCORE = 0.3
+# Вес совпадающих слов в похожести (остальное — доля общих триграмм)
+TOKEN_WEIGHT = 0.3
+# Если анкета не найдена, список перечитывается заново, но не чаще, чем раз в столько секунд
+MISS_REFRESH_INTERVAL = 30
+
+
+class SurveyLookupError(AnketologError):
+    """
+    Анкета не найдена (ambiguous=False) или название подходит к нескольким
+    анкетам (ambiguous=True). В suggestions — подходящие анкеты, лучшие первыми.
+    """
+    def __init__(self, message: str, suggestions: Optional[List[Dict[str, Any]]] = None, ambiguous: bool = False):
+        super().__init__(message)
+        self.suggestions: List[Dict[str, Any]] = suggestions or []
+        self.ambiguous: bool = ambiguous
+
+
+def survey_name(survey: Dict[str, Any]) -> str:
+    return (survey.get("settings") or {}).get("name") or ""
+
+
+def name_trigrams(normalized: str) -> Set[str]:
+    """Триграммы названия с пробелами по краям (начало и конец слова тоже учитываются)"""
+    padded = f" {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def name_tokens(normalized: str) -> Set[str]:
+    """Слова названия без знаков препинания, «ё» считается «е»"""
+    return set(re.findall(r"\w+", normalized.replace("ё", "е")))
+
+
+def _describe(surveys: List[Dict[str, Any]]) -> str:
+    return ", ".join(f'{survey.get("id")}:{survey_name(survey)}' for survey in surveys)
+
+
+def _consume_error(task: asyncio.Task) -> None:
+    if not task.cancelled():
+        task.exception()
+
+
+class SurveyIndex:
+    """
+    Индекс списка анкет по нормализованным названиям.
+
+    Точные совпадения ищутся по словарю названий, вхождение подстроки —
+    только среди анкет, в названии которых есть все триграммы запроса
+    (пересечение списков из триграммного индекса), а не просмотром всего
+    списка. Для похожих названий (опечатки, другой порядок слов) анкеты
+    ранжируются по доле общих триграмм и совпадающих слов (инвертированный
+    индекс слов).
+    """
+    def __init__(self, surveys: List[Dict[str, Any]]):
+        self.built_at: float = time.monotonic()
+        self.surveys: Dict[Any, Dict[str, Any]] = {}
+        self._names: Dict[Any, str] = {}
+        self._order: Dict[Any, int] = {}
+        self._by_name: Dict[str, List[Any]] = defaultdict(list)
+        self._trigrams: Dict[str, Set[Any]] = defaultdict(set)
+        self._trigram_counts: Dict[Any, int] = {}
+        self._tokens: Dict[str, Set[Any]] = defaultdict(set)
+
+        for survey in surveys:
+            survey_id = survey.get("id")
+            name = survey_name(survey)
+            if survey_id is None or not name or survey_id in self.surveys:
+                continue
+            normalized = normalize_survey_name(name)
+            self.surveys[survey_id] = survey
+            self._names[survey_id] = normalized
+            self._order[survey_id] = len(self._order)
+            self._by_name[normalized].append(survey_id)
+
+            trigrams = name_trigrams(normalized)
+            self._trigram_counts[survey_id] = len(trigrams)
+            for trigram in trigrams:
+                self._trigrams[trigram].add(survey_id)
+            for token in name_tokens(normalized):
+                self._tokens[token].add(survey_id)
+
+    def __len__(self) -> int:
+        return len(self.surveys)
+
+    def age(self) -> float:
+        return time.monotonic() - self.built_at
+
+    def get(self, survey_id: Any) -> Optional[Dict[str, Any]]:
+        return self.surveys.get(survey_id)
+
+    def find(self, name: str) -> Dict[str, Any]:
+        """
+        Анкета по названию: единственное точное совпадение (без учета регистра
+        и лишних пробелов) или единственная анкета, в название которой оно входит
+
+        Raises:
+            SurveyLookupError: анкета не найдена (suggestions — похожие) или
+                подходит несколько анкет (suggestions — они)
+        """
+        normalized = normalize_survey_name(name)
+
+        exact = [self.surveys[survey_id] for survey_id in self._by_name.get(normalized, [])]
+        if len(exact) == 1:
+            return exact[0]
+        if len(exact) > 1:
+            raise SurveyLookupError(
+                "Найдено несколько анкет с точным совпадением: " + _describe(exact), exact[:SUGGESTIONS_LIMIT],
+                ambiguous=True,
+            )
+
+        partial = [self.surveys[survey_id] for survey_id in self._containing(normalized)]
+        if len(partial) == 1:
+            return partial[0]
+        if len(partial) > 1:
+            raise SurveyLookupError(
+                "Найдено несколько анкет с частичным совпадением: " + _describe(partial),
+                self.suggest(name, candidates=[survey.get("id") for survey in partial]),
+                ambiguous=True,
+            )
+
+        suggestions = self.suggest(name)
+        message = f'Анкета с названием "{name}" не найдена.'
+        if suggestions:
+            message += " Возможно, вы имели в виду: " + ", ".join(f'"{survey_name(s)}"' for s in suggestions) + "."
+        raise SurveyLookupError(message, suggestions)
+
+    def _containing(self, normalized: str) -> List[Any]:
+        """Анкеты, в нормализованное название которых входит строка (в порядке списка анкет)"""
+        trigrams = [normalized[i:i + 3] for i in range(len(normalized) - 2)]
+        if not trigrams:
+            candidates = self._names.keys()
+        else:
+            postings = sorted((self._trigrams.get(trigram, set()) for trigram in set(trigrams)), key=len)
+            candidates = set.intersection(*postings) if postings[0] else set()
+        found = [survey_id for survey_id in candidates if normalized in self._names[survey_id]]
+        return sorted(found, key=self._order.__getitem__)
+
+    def suggest(self, name: str, limit: int = SUGGESTIONS_LIMIT,
+                candidates: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Похожие анкеты, самые похожие первыми
+
+        Похожесть — доля общих триграмм (коэффициент Дайса) с добавкой за
+        совпадающие слова; анкеты без общих триграмм и слов не рассматриваются.
+
+        Args:
+            name: название из запроса
+            limit: максимум анкет
+            candidates: ранжировать только эти анкеты (без порога похожести)
+        """
+        normalized = normalize_survey_name(name)
+        query_trigrams = name_trigrams(normalized)
+        query_tokens = name_tokens(normalized)
+
+        common: Dict[Any, int] = defaultdict(int)
+        for trigram in query_trigrams:
+            for survey_id in self._trigrams.get(trigram, ()):
+                common[survey_id] += 1
+        shared_tokens: Dict[Any, int] = defaultdict(int)
+        for token in query_tokens:
+            for survey_id in self._tokens.get(token, ()):
+                shared_tokens[survey_id] += 1
+
+        ids = set(candidates) if candidates is not None else set(common) | set(shared_tokens)
+        scored = []
+        for survey_id in ids:
+            if survey_id not in self.surveys:
+                continue
+            dice = 2 * common.get(survey_id, 0) / (len(query_trigrams) + self._trigram_counts[survey_id])
+            token_share = shared_tokens.get(survey_id, 0) / len(query_tokens) if query_tokens else 0.0
+            score = (1 - TOKEN_WEIGHT) * dice + TOKEN_WEIGHT * token_share
+            if candidates is None and score < MIN_SUGGESTION_SCORE:
+                continue
+            scored.append((-score, self._order[survey_id], survey_id))
+
+        scored.sort()
+        return [self.surveys[survey_id] for _, _, survey_id in scored[:limit]]
+
+
+class SurveyDirectory:
+    """
+    Кэш списка анкет и дерева папок Anketolog.
+
+    Список анкет запрашивается один раз и хранится ttl секунд вместе с
+    индексом SurveyIndex, поэтому поиск анкеты по названию не ходит в API.
+    Устаревший список отдается сразу, а новый загружается в фоне; кроме
+    того, run_refresher обновляет его периодически. Если анкета не найдена,
+    а список старше MISS_REFRESH_INTERVAL секунд, он перечитывается —
+    только что созданная анкета находится без ожидания ttl.
+    """
+    def __init__(self, client: AnketologClient, ttl: float):
+        self.client: AnketologClient = client
+        self.ttl: float = ttl
+        self._index: Optional[SurveyIndex] = None
+        self._folders: Any = None
+        self._folders_at: float = 0.0
+        self._refreshing: Optional[asyncio.Task] = None
+
+    async def index(self) -> SurveyIndex:
+        """Индекс анкет (при первом обращении — загрузка, при устаревании — обновление в фоне)"""
+        if self._index is None:
+            return await self.refresh()
+        if self._index.age() >= self.ttl:
+            self._refresh_in_background()
+        return self._index
+
+    async def refresh(self) -> SurveyIndex:
+        """Перечитать список анкет (одновременные вызовы ждут одну загрузку)"""
+        return await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._load())
+            # Ошибку фонового обновления никто не ждет: остается прежний список
+            self._refreshing.add_done_callback(_consume_error)
+        return self._refreshing
+
+    async def _load(self) -> SurveyIndex:
+        surveys = await self.client.survey_list()
+        if not surveys:
+            raise AnketologError("Не удалось получить список анкет из Anketolog.")
+        self._index = SurveyIndex(surveys)
+        return self._index
+
+    def _refresh_in_background(self) -> None:
+        self._start_refresh()
+
+    async def run_refresher(self) -> None:
+        """Фоновое обновление списка анкет раз в ttl секунд"""
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                await self.refresh()
+            except AnketologError:
+                pass
+
+    async def folders(self) -> Any:
+        """Дерево папок (хранится ttl секунд)"""
+        if self._folders is None or time.monotonic() - self._folders_at >= self.ttl:
+            self._folders = await self.client.folders()
+            self._folders_at = time.monotonic()
+        return self._folders
+
+    async def folder_hint(self) -> str:
+        """Подсказка со списком папок для сообщения «анкета не найдена»"""
+        try:
+            folder_names = flatten_folder_names(await self.folders())
+        except AnketologError:
+            return ""
+
+        if not folder_names:
+            return ""
+
+        return f" Доступные папки: {', '.join(folder_names[:20])}."
+
+    async def get(self, survey_id: Any) -> Optional[Dict[str, Any]]:
+        return (await self.index()).get(survey_id)
+
+    async def locate(self, name: str) -> Dict[str, Any]:
+        """
+        Анкета по названию
+
+        Raises:
+            SurveyLookupError: анкета не найдена или подходит несколько анкет
+                (в suggestions — похожие анкеты)
+            AnketologError: если не удалось получить список анкет
+        """
+        index = await self.index()
+        try:
+            return index.find(name)
+        except SurveyLookupError as error:
+            if error.ambiguous or index.age() < MISS_REFRESH_INTERVAL:
+                raise await self._with_folder_hint(error)
+
+        index = await self.refresh()
+        try:
+            return index.find(name)
+        except SurveyLookupError as error:
+            raise await self._with_folder_hint(error)
+
+    async def _with_folder_hint(self, error: SurveyLookupError) -> SurveyLookupError:
+        """Если похожих анкет нет, к сообщению добавляется список папок"""
+        if error.suggestions:
+            return error
+        return SurveyLookupError(str(error) + await self.folder_hint(), ambiguous=error.ambiguous)
+
+
+survey_directory = SurveyDirectory(anketolog_client, config.survey_directory_ttl)
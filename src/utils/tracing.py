@@ -0,0 +1,321 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import re
+import resource
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+trace_logger = logging.getLogger("bot.trace")
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+_HWM_PATTERN = re.compile(r"VmHWM:\s+(\d+)\s+kB")
+_RSS_PATTERN = re.compile(r"VmRSS:\s+(\d+)\s+kB")
+
+
+def _reset_peak_rss() -> None:
+    """
+    Сброс пика RSS процесса (Linux), чтобы мерить пик отдельного этапа.
+    Счетчик общий на процесс, поэтому сбрасывается только в трассах с
+    measure_peak (рабочий процесс пула, в котором одна задача за раз)
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> float:
+    """Пик RSS процесса в МБ с последнего сброса (без /proc — за все время процесса)"""
+    try:
+        with open("/proc/self/status", "r") as file:
+            match = _HWM_PATTERN.search(file.read())
+        if match:
+            return int(match.group(1)) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss: на macOS — в байтах, на Linux — в КБ
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _current_rss_mb() -> float:
+    """Текущий RSS процесса в МБ (без /proc — пик за все время процесса)"""
+    try:
+        with open("/proc/self/status", "r") as file:
+            match = _RSS_PATTERN.search(file.read())
+        if match:
+            return int(match.group(1)) / 1024
+    except OSError:
+        pass
+    return _peak_rss_mb()
+
+
+class Span:
+    """
+    Этап обработки: время (настенное и процессорное), память и
+    произвольные поля (например, число строк и столбцов).
+
+    Память — пик RSS этапа, если трасса меряет пик (measure_peak), иначе
+    RSS процесса в начале и в конце этапа.
+    """
+    def __init__(self, stage: str, fields: Optional[Dict[str, Any]] = None, measure_peak: bool = False):
+        self.stage: str = stage
+        self.fields: Dict[str, Any] = dict(fields or {})
+        self.measure_peak: bool = measure_peak
+        self.wall: float = 0.0
+        self.cpu: float = 0.0
+        self.peak_rss_mb: float = 0.0
+        self.rss_start_mb: float = 0.0
+        self.rss_end_mb: float = 0.0
+        self.finished_at: float = 0.0
+
+    def set(self, **fields: Any) -> None:
+        """Добавление полей этапа"""
+        self.fields.update(fields)
+
+    def as_dict(self) -> Dict[str, Any]:
+        if self.measure_peak:
+            memory = {"peak_rss_mb": round(self.peak_rss_mb, 1)}
+        else:
+            memory = {"rss_start_mb": round(self.rss_start_mb, 1), "rss_end_mb": round(self.rss_end_mb, 1)}
+        return {
+            "ts": round(self.finished_at, 3),
+            "stage": self.stage,
+            "wall": round(self.wall, 4),
+            "cpu": round(self.cpu, 4),
+            **memory,
+            **self.fields,
+        }
+
+
+class Trace:
+    """
+    Этапы одной задачи обработки.
+
+    Этапы, завершенные внутри start_trace, собираются в трассу и (если emit)
+    пишутся в лог при ее закрытии — с номером задачи, который становится
+    известен по ходу обработки. В рабочем процессе пула трасса только
+    собирает этапы (emit=False): они возвращаются в процесс бота и
+    добавляются в его трассу через add_records.
+
+    Пик RSS этапов меряется только в трассах с measure_peak: счетчик пика
+    общий на процесс, и в процессе бота этапы разных задач перекрываются.
+    """
+    def __init__(self, job_id: Optional[int] = None, emit: bool = True, measure_peak: bool = False):
+        self.job_id: Optional[int] = job_id
+        self.emit: bool = emit
+        self.measure_peak: bool = measure_peak
+        self.records: List[Dict[str, Any]] = []
+        self.started_at: float = time.perf_counter()
+
+    def add_records(self, records: Iterable[Dict[str, Any]]) -> None:
+        """Добавление готовых этапов (например, из рабочего процесса)"""
+        self.records.extend(records)
+
+    def timings(self) -> Dict[str, float]:
+        """Настенное время этапов, в секундах"""
+        return {record["stage"]: record["wall"] for record in self.records}
+
+
+def current_trace() -> Optional[Trace]:
+    """Трасса текущей задачи (None, если этап выполняется вне задачи)"""
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(job_id: Optional[int] = None, emit: bool = True, measure_peak: bool = False) -> Iterator[Trace]:
+    """
+    Трасса задачи: все этапы внутри блока (и в порожденных им корутинах)
+    собираются в нее. По завершении этапы пишутся в лог вместе с итоговой
+    записью «job».
+
+    Args:
+        job_id: номер задачи (можно задать позже через trace.job_id)
+        emit: писать ли этапы в лог
+        measure_peak: мерить пик RSS этапов (только там, где процесс выполняет
+            одну задачу за раз, — в рабочем процессе пула)
+    """
+    trace = Trace(job_id, emit, measure_peak)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        if emit and trace.records:
+            for record in trace.records:
+                _log_record(record, trace.job_id)
+            _log_record({
+                "stage": "job",
+                "wall": round(time.perf_counter() - trace.started_at, 4),
+                "peak_rss_mb": max(record.get("peak_rss_mb", 0.0) for record in trace.records),
+                "stages": len(trace.records),
+            }, trace.job_id)
+
+
+@contextmanager
+def trace_stage(stage: str, **fields: Any) -> Iterator[Span]:
+    """
+    Замер этапа обработки
+
+    В трассе с measure_peak (рабочий процесс пула) пишется пик RSS процесса
+    внутри этапа (с учетом вложенных этапов), иначе — RSS в начале и в конце
+    этапа: в процессе бота этапы разных задач идут одновременно, и сброс
+    общего счетчика пика испортил бы замеры соседних этапов. Процессорное
+    время — всего процесса, поэтому для корутин, которые ждут сеть, оно
+    почти нулевое.
+
+    Args:
+        stage: название этапа
+        **fields: дополнительные поля записи
+
+    Yields:
+        Этап, в который можно добавить поля через span.set(...)
+    """
+    trace = _current_trace.get()
+    measure_peak = trace is not None and trace.measure_peak
+    span = Span(stage, fields, measure_peak)
+    parent = _current_span.get() if measure_peak else None
+    if parent is not None:
+        # Пик внешнего этапа до сброса счетчика
+        parent.peak_rss_mb = max(parent.peak_rss_mb, _peak_rss_mb())
+    token = _current_span.set(span)
+    if measure_peak:
+        _reset_peak_rss()
+    else:
+        span.rss_start_mb = _current_rss_mb()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield span
+    except BaseException as error:
+        span.set(error=type(error).__name__)
+        raise
+    finally:
+        span.wall = time.perf_counter() - wall_start
+        span.cpu = time.process_time() - cpu_start
+        span.finished_at = time.time()
+        if measure_peak:
+            span.peak_rss_mb = max(span.peak_rss_mb, _peak_rss_mb())
+        else:
+            span.rss_end_mb = _current_rss_mb()
+        _current_span.reset(token)
+        if parent is not None:
+            parent.peak_rss_mb = max(parent.peak_rss_mb, span.peak_rss_mb)
+
+        add_records([span.as_dict()])
+
+
+def record_stage(stage: str, wall: float, **fields: Any) -> None:
+    """Запись этапа, время которого измерено отдельно (например, ожидание в очереди)"""
+    add_records([{"ts": round(time.time(), 3), "stage": stage, "wall": round(wall, 4), **fields}])
+
+
+def add_records(records: Iterable[Dict[str, Any]]) -> None:
+    """Добавление готовых этапов в текущую трассу (вне трассы — сразу в лог)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_records(records)
+        return
+    for record in records:
+        _log_record(record, None)
+
+
+def with_trace(func: Callable) -> Callable:
+    """
+    Декоратор корутины: каждый вызов — отдельная трасса задачи
+    """
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with start_trace():
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+def traced(stage: str) -> Callable:
+    """
+    Декоратор: замер каждого вызова функции (обычной или корутины) как этапа stage
+    """
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with trace_stage(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with trace_stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def _log_record(record: Dict[str, Any], job_id: Optional[int]) -> None:
+    """Запись этапа в лог одной строкой JSON (ts — время окончания этапа)"""
+    if not trace_logger.isEnabledFor(logging.INFO):
+        return
+    trace_logger.info(json.dumps({"ts": round(time.time(), 3), "job": job_id, **record},
+                                 ensure_ascii=False, default=str))
+
+
+def configure_trace_log(path: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 3) -> None:
+    """
+    Запись этапов в файл JSON Lines (одна запись — одна строка)
+
+    Args:
+        path: путь к файлу лога
+        max_bytes: размер файла до ротации
+        backup_count: сколько старых файлов хранить
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.addHandler(handler)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+
+def stage_percentiles(path: str, limit: int = 5000) -> Dict[str, Tuple[int, float, float]]:
+    """
+    Медиана и 95-й перцентиль времени этапов по последним записям лога
+
+    Args:
+        path: путь к файлу лога
+        limit: сколько последних записей учитывать
+
+    Returns:
+        {этап: (число записей, p50, p95)} в порядке первого появления этапа
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            lines = deque(file, maxlen=limit)
+    except OSError:
+        return {}
+
+    walls: Dict[str, List[float]] = {}
+    for line in lines:
+        try:
+            record = json.loads(line)
+            walls.setdefault(record["stage"], []).append(float(record["wall"]))
+        except (ValueError, KeyError, TypeError):
+            continue
+
+    return {
+        stage: (len(values), float(np.percentile(values, 50)), float(np.percentile(values, 95)))
+        for stage, values in walls.items()
+    }